@@ -0,0 +1,289 @@
+# --- action_grammar.py ---
+# Constrained decoding for agent actions: the agent model can only produce a JSON object of the form
+# {"action": "<TOOLKIT name>", "args": {"<arg>": "<string>", ...}} and generation stops when it closes.
+
+import torch
+from transformers import LogitsProcessor, StoppingCriteria
+
+MAX_WHITESPACE_RUN = 4   # Whitespace allowed between JSON tokens, so the model can't idle on spaces.
+MAX_VALUE_CHARS = 300    # Longer argument strings are forced to close.
+SCAN_TOP_K = 256         # Candidates checked against the grammar before falling back to the whole vocabulary.
+KEEP_VALID = 8           # Valid candidates kept per step (greedy only needs the first).
+BUDGET_MARGIN = 8        # Once the token budget is this close to the closing text, candidates must keep it closable.
+
+_WHITESPACE = " \n\t"
+_ESCAPES = '"\\/bfnrt'
+
+
+class ActionGrammar:
+    """
+    Character-level recognizer for one action object, driven by a toolkit schema:
+    {action_name: {arg_name: {"optional": bool, "enum": [...]}}}.
+    States are small and copied on every step, so a candidate token can be tried without side effects.
+    """
+
+    def __init__(self, toolkit):
+        self.toolkit = toolkit
+        self.phase = "literal"
+        self.pending = ("{", '"action"', ":", '"')
+        self.then = "action_name"
+        self.buffer = ""
+        self.action = None
+        self.keys_done = ()
+        self.key = None
+        self.escaped = False
+        self.whitespace = 0
+
+    @property
+    def done(self):
+        return self.phase == "done"
+
+    def copy(self):
+        clone = ActionGrammar.__new__(ActionGrammar)
+        clone.__dict__.update(self.__dict__)
+        return clone
+
+    def advance(self, text):
+        """Returns the state after consuming `text`, or None if `text` breaks the grammar."""
+        state = self.copy()
+        for ch in text:
+            if not state._feed(ch):
+                return None
+        return state
+
+    def completion(self):
+        """The shortest text that closes the action object from this state."""
+        state, text = self, ""
+        while not state.done:
+            step = state._closing_step()
+            state = state.advance(step)
+            text += step
+        return text
+
+    def _closing_step(self):
+        if self.phase == "literal":
+            return self.pending[0][len(self.buffer):]
+        if self.phase == "action_name":
+            name = min((n for n in self.toolkit if n.startswith(self.buffer)), key=len)
+            return name[len(self.buffer):] + '"'
+        if self.phase == "args_next":
+            missing = [k for k, spec in self.toolkit[self.action].items() if not spec.get("optional") and k not in self.keys_done]
+            if not missing:
+                return "}"
+            return ',"' if self.keys_done else '"'
+        if self.phase == "key":
+            candidates = [k for k in self._remaining_keys() if k.startswith(self.buffer)]
+            required = [k for k in candidates if not self.toolkit[self.action][k].get("optional")]
+            key = min(required or candidates, key=len)
+            return key[len(self.buffer):] + '"'
+        if self.escaped:
+            return "/"
+        enum = self.toolkit[self.action][self.key].get("enum")
+        if enum:
+            return min((v for v in enum if v.startswith(self.buffer)), key=len)[len(self.buffer):] + '"'
+        return '"'
+
+    # --- Transitions ---
+    def _expect(self, literals, then):
+        self.phase, self.pending, self.then = "literal", tuple(literals), then
+
+    def _skip_whitespace(self, ch):
+        if ch in _WHITESPACE and self.whitespace < MAX_WHITESPACE_RUN:
+            self.whitespace += 1
+            return True
+        return False
+
+    def _remaining_keys(self):
+        return [k for k in self.toolkit[self.action] if k not in self.keys_done]
+
+    def _required_done(self):
+        return all(spec.get("optional") or k in self.keys_done for k, spec in self.toolkit[self.action].items())
+
+    def _feed(self, ch):
+        phase = self.phase
+        if phase == "literal":
+            literal = self.pending[0]
+            if not self.buffer and self._skip_whitespace(ch):
+                return True
+            if ch != literal[len(self.buffer)]:
+                return False
+            self.buffer += ch
+            self.whitespace = 0
+            if self.buffer == literal:
+                self.buffer, self.pending = "", self.pending[1:]
+                if not self.pending:
+                    self.phase = self.then
+            return True
+
+        if phase == "action_name":
+            if ch == '"':
+                if self.buffer not in self.toolkit:
+                    return False
+                self.action, self.buffer = self.buffer, ""
+                self._expect((",", '"args"', ":", "{"), "args_next")
+                return True
+            if not any(name.startswith(self.buffer + ch) for name in self.toolkit):
+                return False
+            self.buffer += ch
+            return True
+
+        if phase == "args_next":
+            # Between arguments: close the object, separate with a comma, or open the first key.
+            if self._skip_whitespace(ch):
+                return True
+            self.whitespace = 0
+            if ch == "}" and self._required_done():
+                self._expect(("}",), "done")
+                return True
+            if ch == "," and self.keys_done and self._remaining_keys():
+                self._expect(('"',), "key")
+                return True
+            if ch == '"' and not self.keys_done and self._remaining_keys():
+                self.phase = "key"
+                return True
+            return False
+
+        if phase == "key":
+            if ch == '"':
+                if self.buffer not in self._remaining_keys():
+                    return False
+                self.key, self.buffer = self.buffer, ""
+                self._expect((":", '"'), "value")
+                return True
+            if not any(k.startswith(self.buffer + ch) for k in self._remaining_keys()):
+                return False
+            self.buffer += ch
+            return True
+
+        if phase == "value":
+            enum = self.toolkit[self.action][self.key].get("enum")
+            if self.escaped:
+                if enum or ch not in _ESCAPES:
+                    return False
+                self.escaped = False
+                self.buffer += "\\" + ch
+                return True
+            if ch == '"':
+                if enum and self.buffer not in enum:
+                    return False
+                self.keys_done += (self.key,)
+                self.key, self.buffer, self.phase = None, "", "args_next"
+                return True
+            if len(self.buffer) >= MAX_VALUE_CHARS or ch < " ":
+                return False
+            if enum:
+                if not any(v.startswith(self.buffer + ch) for v in enum):
+                    return False
+            elif ch == "\\":
+                self.escaped = True
+                return True
+            self.buffer += ch
+            return True
+
+        return False  # "done": nothing may follow the closing brace.
+
+
+class ActionJSONLogitsProcessor(LogitsProcessor):
+    """
+    Masks every token that would take the generated text outside the action grammar.
+    The grammar state is derived from the generated ids alone (and memoized per prefix), so the
+    processor also works when the same positions are scored more than once.
+    When the token budget is about to run out, only tokens that close the object are allowed.
+    """
+
+    def __init__(self, tokenizer, toolkit, prompt_length, max_new_tokens):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.max_new_tokens = max_new_tokens
+        self.eos_token_id = tokenizer.eos_token_id
+        self.excluded_ids = set(tokenizer.all_special_ids) | set(getattr(tokenizer, "added_tokens_decoder", {}))
+        self.states = {(): ActionGrammar(toolkit)}
+        self.token_texts = {}
+        self.closing_cache = {}
+        anchor = tokenizer.encode("a", add_special_tokens=False)
+        self.anchor_ids = anchor[:1]
+        self.anchor_text = tokenizer.decode(self.anchor_ids, skip_special_tokens=False)
+
+    def token_text(self, token_id):
+        """The text a token adds when appended to other text (keeps sentencepiece's leading spaces)."""
+        text = self.token_texts.get(token_id)
+        if text is None:
+            decoded = self.tokenizer.decode(self.anchor_ids + [token_id], skip_special_tokens=False)
+            text = decoded[len(self.anchor_text):]
+            self.token_texts[token_id] = text
+        return text
+
+    def state_for(self, generated_ids):
+        generated_ids = tuple(generated_ids)
+        state = self.states.get(generated_ids, False)
+        if state is False:
+            previous = self.state_for(generated_ids[:-1])
+            state = previous.advance(self.token_text(generated_ids[-1])) if previous is not None else None
+            self.states[generated_ids] = state
+        return state
+
+    def closing_ids(self, closing):
+        """Tokens the closing text takes when tokenized on its own (cached, the same texts recur)."""
+        token_ids = self.closing_cache.get(closing)
+        if token_ids is None:
+            token_ids = self.closing_cache[closing] = self.tokenizer.encode(closing, add_special_tokens=False)
+        return token_ids
+
+    def _valid_tokens(self, state, candidate_ids, budget=None):
+        valid = []
+        for token_id in candidate_ids:
+            if token_id in self.excluded_ids:
+                continue
+            text = self.token_text(token_id)
+            if not text or "\ufffd" in text:
+                continue
+            next_state = state.advance(text)
+            if next_state is None:
+                continue
+            if budget is not None and len(self.closing_ids(next_state.completion())) > budget:
+                continue
+            valid.append(token_id)
+            if len(valid) >= KEEP_VALID:
+                break
+        return valid
+
+    def _allowed_tokens(self, state, scores, remaining):
+        closing = state.completion()
+        closing_ids = self.closing_ids(closing)
+        if len(closing_ids) >= remaining and closing.startswith(self.token_text(closing_ids[0])):
+            # Out of slack: spend the remaining tokens on closing the object.
+            return closing_ids[:1]
+        # Near the end of the budget, candidates must leave the object closable in the tokens left.
+        budget = remaining - 1 if remaining - len(closing_ids) <= BUDGET_MARGIN else None
+        top = torch.topk(scores, min(SCAN_TOP_K, scores.shape[-1])).indices.tolist()
+        allowed = self._valid_tokens(state, top, budget)
+        if not allowed:
+            ranked = torch.argsort(scores, descending=True).tolist()
+            allowed = self._valid_tokens(state, ranked[len(top):], budget)
+        return allowed or closing_ids[:1] or [self.eos_token_id]
+
+    def __call__(self, input_ids, scores):
+        masked = torch.full_like(scores, float("-inf"))
+        for row in range(input_ids.shape[0]):
+            generated = input_ids[row, self.prompt_length:].tolist()
+            state = self.state_for(generated)
+            if state is None or state.done:
+                allowed = [self.eos_token_id]
+            else:
+                allowed = self._allowed_tokens(state, scores[row], self.max_new_tokens - len(generated))
+            masked[row, allowed] = scores[row, allowed]
+        return masked
+
+
+class ActionCompleteCriteria(StoppingCriteria):
+    """Stops generation as soon as the action object has been closed."""
+
+    def __init__(self, processor):
+        self.processor = processor
+
+    def __call__(self, input_ids, scores, **kwargs):
+        finished = []
+        for row in range(input_ids.shape[0]):
+            state = self.processor.state_for(input_ids[row, self.processor.prompt_length:].tolist())
+            finished.append(state is None or state.done)
+        return torch.tensor(finished, dtype=torch.bool, device=input_ids.device)
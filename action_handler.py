@@ -1,135 +1,346 @@
 # --- action_handler.py (The Final, Privacy-Hardened Version) ---
+# Every desktop call goes through desktop_backend, and every wait is for an observable condition
+# (a new window, focus, a visible control) rather than a fixed sleep. Each action is a tracing span.
+# Controls are looked up in the window's element index (element_index) before walking the UI tree.
+# Reads taken ahead of time by prefetch_observations() stand in for the first read an observation needs.
 
-import os
-import subprocess
-from pywinauto.application import Application
-from pywinauto import Desktop
-import time
-import pyperclip
-import pyautogui
-import re
+from desktop_backend import get_backend
+from ui_wait import wait_until, wait_until_stable
+from element_snapshots import snapshots, diff_lines
+from element_index import indexes
+from observation_prefetch import prefetched
+from window_pool import pool
+from tracing import traced
 
+# Upper bounds only: each wait returns as soon as its condition holds.
+LAUNCH_TIMEOUT = 15.0
+URL_TIMEOUT = 5.0  # A URL opened in a focused browser may change nothing we can see (the same page again).
+START_MENU_TIMEOUT = 3.0
+SEARCH_SETTLE_SECONDS = 0.4
+FOCUS_TIMEOUT = 2.0
+ELEMENT_TIMEOUT = 10.0
+KEY_SETTLE_SECONDS = 0.2
+KEY_SETTLE_TIMEOUT = 1.0
+FIND_RESULTS = 5  # Controls FIND_ELEMENTS reports.
+
+# --- REDACTION-BASED PRIVACY FILTER ---
+# Define control types that often contain sensitive user-generated content.
+SENSITIVE_TYPES = {'ListItem', 'Document', 'Text'}
+# Define safe titles that should always be shown (e.g., UI commands).
+SAFE_TITLES = {'Chats', 'Calls', 'Status', 'Settings', 'Profile', 'Archived chats', 'Starred messages'}
+
+
+def _snapshot():
+    """The current ({window handle: title}, foreground handle), to detect what an action changed."""
+    backend = get_backend()
+    return {w.handle: w.title for w in backend.list_windows()}, backend.foreground_handle()
+
+
+def _wait_for_window_change(before, description, ignore=(), title_change=False, timeout=LAUNCH_TIMEOUT):
+    """
+    Waits for a window that wasn't open before, or for another existing window to take focus
+    (e.g. a browser opening a new tab). Windows in `ignore` (the Start Menu) count as neither.
+    With `title_change`, the focused window changing its title counts too (a focused browser
+    opening a tab in place). Returns that window's title, or None on timeout.
+    """
+    backend = get_backend()
+    known, foreground = before
+
+    def changed():
+        windows = backend.list_windows()
+        new = next((w for w in windows if w.handle not in known and w.handle not in ignore), None)
+        if new: return new
+        current = backend.foreground_handle()
+        if current in ignore:
+            return None
+        window = next((w for w in windows if w.handle == current), None)
+        if current != foreground or (title_change and window and window.title != known.get(current)):
+            return window
+        return None
+
+    window = wait_until(changed, timeout=timeout, description=description)
+    return window.title if window else None
+
+
+def _as_bool(value):
+    # Tool arguments arrive as JSON strings ("true"/"false") from the constrained decoder.
+    return value is True or str(value).strip().lower() in ("true", "1", "yes")
+
+
+def _focus(window):
+    """Brings a window to the front and waits until it actually has focus."""
+    backend = get_backend()
+    handle = backend.window_handle(window)
+    try:
+        backend.focus_window(window)
+    except Exception:
+        pool.invalidate(handle)  # Most likely closed since we pooled it.
+        raise
+    wait_until(lambda: backend.foreground_handle() == handle, timeout=FOCUS_TIMEOUT, description="window focus")
+
+
+@traced("action.open_url")
 def open_url(url: str):
     """Opens a URL in the default web browser using the 'start' command."""
     try:
         if not url.lower().startswith('http'):
             url = 'https://www.' + url.split('www.')[-1]
         print(f"ACTION: Opening URL '{url}'...")
-        subprocess.run(f'start "" "{url}"', shell=True, check=True)
-        time.sleep(3)
+        snapshots.invalidate()
+        indexes.invalidate()
+        prefetched.discard()
+        before = _snapshot()
+        get_backend().open_url(url)
+        title = _wait_for_window_change(before, "the browser window", title_change=True, timeout=URL_TIMEOUT)
+        if title:
+            return f"Successfully opened URL {url} in window '{title}'."
         return f"Successfully opened URL {url}. Use LIST_OPEN_WINDOWS to find the browser title."
     except Exception as e:
         return f"Error opening URL '{url}': {e}"
 
+@traced("action.search_and_open_app")
 def search_and_open_app(app_name: str):
     """Opens any application by searching for it in the Windows Start Menu."""
     try:
         print(f"ACTION: Searching for '{app_name}' in the Start Menu...")
-        pyautogui.press('win')
-        time.sleep(1)
-        pyautogui.write(app_name, interval=0.05)
-        time.sleep(1.5)
-        pyautogui.press('enter')
-        time.sleep(3)
+        backend = get_backend()
+        snapshots.invalidate()
+        indexes.invalidate()
+        prefetched.discard()
+        # The baseline is the desktop before the Start Menu opens: after Enter, focus going back to the
+        # window that had it then is not the app opening.
+        before = _snapshot()
+        backend.press_keys('win')
+        wait_until(lambda: backend.foreground_handle() != before[1], timeout=START_MENU_TIMEOUT, description="the Start Menu")
+        backend.write_text(app_name, interval=0.05)
+        # Search results have no event to wait on; wait for the search window to stop changing.
+        wait_until_stable(backend.foreground_handle, settle_time=SEARCH_SETTLE_SECONDS, timeout=START_MENU_TIMEOUT)
+        menu_windows, menu_foreground = _snapshot()
+        start_menu = (menu_windows.keys() - before[0].keys()) | {menu_foreground}
+        backend.press_keys('enter')
+        title = _wait_for_window_change(before, f"'{app_name}' to open", ignore=start_menu)
+        if title:
+            return f"Successfully launched '{app_name}' from the Start Menu in window '{title}'."
         return f"Successfully launched '{app_name}' from the Start Menu. Use LIST_OPEN_WINDOWS to find its title."
     except Exception as e:
         return f"Error searching for and opening '{app_name}': {e}"
 
+@traced("action.list_open_windows")
 def list_open_windows() -> str:
     """Gets a list of all top-level window titles on the desktop."""
     try:
-        windows = Desktop(backend="uia").windows()
-        titles = [w.window_text() for w in windows if w.window_text() and w.is_visible()]
+        windows = get_backend().list_windows()
+        pool.retain({w.handle for w in windows})
+        titles = [w.title for w in windows]
         return "\n".join(titles) if titles else "No open windows found."
     except Exception as e:
         return f"Error listing windows: {e}"
 
 def _get_target_window(window_title: str):
-    """Helper to connect to an app and get its main window."""
+    """Helper to connect to an app and get its main window, reusing the pooled window when it's still valid."""
     if not window_title:
         raise ValueError("A window_title is required for this action.")
-    app = Application(backend="uia").connect(title_re=f".*{re.escape(window_title)}.*", timeout=10)
-    return app.top_window()
+    return pool.get(window_title, get_backend())
 
-def get_window_elements(window_title: str) -> str:
+@traced("action.get_window_elements")
+def get_window_elements(window_title: str, full_refresh=False) -> str:
     """
     Gets a list of all elements, intelligently redacting sensitive user content for privacy.
+    A window the task was shown before is reported as a diff against what it saw unless `full_refresh` is
+    set, and an untouched window that was read moments ago isn't read again at all. Once the task's history
+    no longer shows the last full listing, the full list is sent again.
     """
     try:
+        backend = get_backend()
+        full_refresh = _as_bool(full_refresh)
         target_window = _get_target_window(window_title)
-        target_window.set_focus()
-        time.sleep(0.5)
-        controls = target_window.descendants()
-        element_info = []
-        unique_elements = set()
-        
-        # --- REDACTION-BASED PRIVACY FILTER ---
-        # Define control types that often contain sensitive user-generated content.
-        SENSITIVE_TYPES = {'ListItem', 'Document', 'Text'}
-        # Define safe titles that should always be shown (e.g., UI commands).
-        SAFE_TITLES = {'Chats', 'Calls', 'Status', 'Settings', 'Profile', 'Archived chats', 'Starred messages'}
-
-        for c in controls:
-            text = c.window_text()
-            control_type = c.element_info.control_type
-            
-            # If the element is visible and has a control type...
-            if c.is_enabled() and c.is_visible() and control_type:
-                # If the control type is sensitive AND its text is not a known safe UI command...
-                if control_type in SENSITIVE_TYPES and text not in SAFE_TITLES:
-                    # Redact the content entirely.
-                    info_str = f"Type: '{control_type}', Title: '[User Content Redacted]'"
-                else:
-                    # Otherwise, the element is safe to show.
-                    info_str = f"Type: '{control_type}', Title: '{text or ''}'"
-                
-                # Add to list if we haven't seen this exact element before.
-                if info_str not in unique_elements:
-                    element_info.append(info_str)
-                    unique_elements.add(info_str)
-                    
-        return "\n".join(element_info) if element_info else "No interactable elements found."
+        handle = backend.window_handle(target_window)
+        if not full_refresh:
+            cached = snapshots.fresh(handle)
+            if cached:
+                return f"No changes in '{cached.title}' since the last GET_WINDOW_ELEMENTS ({len(cached.lines)} elements)."
+        _focus(target_window)
+        elements = prefetched.take(("elements", handle))
+        if elements is None:
+            elements = backend.window_elements(target_window)
+        indexes.store(handle, elements)
+        element_lines = _element_lines(elements)
+        previous = None if full_refresh else snapshots.baseline(handle)
+        added, removed = diff_lines(previous.lines, element_lines) if previous else ((), ())
+        full = previous is None or not element_lines or len(added) + len(removed) >= len(element_lines)
+        snapshots.store(handle, backend.window_title(target_window), element_lines, full)
+        if not element_lines:
+            return "No interactable elements found."
+        if full:
+            return "\n".join(element_lines)
+        if not added and not removed:
+            return f"No changes in '{window_title}' since the last GET_WINDOW_ELEMENTS ({len(element_lines)} elements)."
+        changes = [f"+ {line}" for line in added] + [f"- {line}" for line in removed]
+        return (f"Changes since the last GET_WINDOW_ELEMENTS ({len(element_lines)} elements now, "
+                f"+{len(added)}/-{len(removed)}; use full_refresh for the full list):\n" + "\n".join(changes))
     except Exception as e:
         return f"Error getting window elements for title '{window_title}': {e}"
 
 
+def _element_lines(elements):
+    """Formats elements for the agent, dropping disabled/hidden ones and duplicates."""
+    element_info = []
+    unique_elements = set()
+
+    for c in elements:
+        # If the element is visible and has a control type...
+        if c.enabled and c.visible and c.control_type:
+            info_str = _element_line(c.control_type, c.title)
+
+            # Add to list if we haven't seen this exact element before.
+            if info_str not in unique_elements:
+                element_info.append(info_str)
+                unique_elements.add(info_str)
+
+    return element_info
+
+
+def _element_line(control_type, text):
+    # If the control type is sensitive AND its text is not a known safe UI command...
+    if control_type in SENSITIVE_TYPES and text not in SAFE_TITLES:
+        # Redact the content entirely.
+        return f"Type: '{control_type}', Title: '[User Content Redacted]'"
+    # Otherwise, the element is safe to show.
+    return f"Type: '{control_type}', Title: '{text or ''}'"
+
+
+def _window_index(backend, window, handle, allow_dirty=False):
+    """The window's element index, reading the window's controls again if there isn't a usable one."""
+    index = indexes.get(handle, allow_dirty=allow_dirty)
+    if index is None:
+        index = indexes.store(handle, backend.window_elements(window))
+    return index
+
+
+def _indexed_element(backend, window, handle, element_title, control_type):
+    """
+    The target control straight from the window's element index, if it is there and still on screen;
+    None to fall back to searching the tree (and waiting for it to appear).
+    """
+    index = _window_index(backend, window, handle, allow_dirty=True)
+    match = index.resolve(element_title, control_type)
+    if match is None and index.dirty:
+        # The window changed since the index was built; one bulk read is still cheaper than a tree walk.
+        index = indexes.store(handle, backend.window_elements(window))
+        match = index.resolve(element_title, control_type)
+    if match is None or match.ref is None:
+        return None
+    control = backend.bound_element(window, match.ref)
+    if backend.element_visible(control):
+        return control
+    indexes.invalidate(handle)  # Gone or hidden since it was indexed.
+    return None
+
+
+@traced("action.find_elements")
+def find_elements(window_title: str, query: str, control_type: str = None) -> str:
+    """Lists only the few controls whose titles best match `query` (by word, partial word or close spelling)."""
+    try:
+        backend = get_backend()
+        target_window = _get_target_window(window_title)
+        handle = backend.window_handle(target_window)
+        elements = prefetched.take(("elements", handle))
+        index = indexes.store(handle, elements) if elements is not None else indexes.get(handle)
+        if index is None:
+            _focus(target_window)
+            index = indexes.store(handle, backend.window_elements(target_window))
+        lines = list(dict.fromkeys(_element_line(e.control_type, e.title) for _, e in index.search(query, control_type, k=FIND_RESULTS)))
+        if not lines:
+            return f"No elements matching '{query}' in '{window_title}' ({len(index.elements)} elements). Use GET_WINDOW_ELEMENTS to see them all."
+        return f"Best matches for '{query}' in '{window_title}' ({len(lines)} of {len(index.elements)} elements):\n" + "\n".join(lines)
+    except Exception as e:
+        return f"Error finding elements matching '{query}' in window '{window_title}': {e}"
+
+
+@traced("action.interact_with_element")
 def interact_with_element(window_title: str, action: str, element_title: str = None, control_type: str = None, value: str = "") -> str:
     """Interacts with a specific element using a hybrid approach."""
     try:
+        backend = get_backend()
         target_window = _get_target_window(window_title)
         criteria = {}
-        if element_title: criteria['title_re'] = f"(?i).*{re.escape(element_title)}.*"
+        if element_title: criteria['title'] = element_title
         if control_type: criteria['control_type'] = control_type
         if not criteria: return "Error: Must provide 'element_title' and/or 'control_type'."
-        control = target_window.child_window(found_index=0, **criteria)
-        control.wait('visible', timeout=10)
+        handle = backend.window_handle(target_window)
+        control = _indexed_element(backend, target_window, handle, element_title, control_type)
+        snapshots.invalidate(handle)
+        indexes.invalidate(handle)
+        prefetched.discard()
+        if control is None:
+            control = backend.find_element(target_window, **criteria)
+            if not wait_until(lambda: backend.element_visible(control), timeout=ELEMENT_TIMEOUT):
+                return f"Error: No visible element matching {criteria} appeared in window '{window_title}' within {ELEMENT_TIMEOUT:g}s."
         if action.lower() == 'click':
             is_browser = any(browser in window_title.lower() for browser in ["chrome", "firefox", "edge"])
-            if is_browser:
-                coords = control.rectangle().mid_point()
-                pyautogui.click(coords.x, coords.y)
-            else:
-                control.click_input()
+            backend.click_element(control, use_mouse=is_browser)
             return f"Successfully clicked the element matching {criteria}."
         elif action.lower() == 'type':
-            control.set_focus()
-            pyperclip.copy(value or "")
-            control.type_keys('^a^v', pause=0.05)
+            backend.type_into_element(control, value)
             return f"Successfully pasted text into the element matching {criteria}."
         else:
             return f"Error: Unknown action '{action}'."
     except Exception as e:
         return f"Error interacting with element matching criteria {locals().get('criteria', {})} in window '{window_title}': {e}"
 
+@traced("action.press_key")
 def press_key(window_title: str, key: str) -> str:
     """Brings a window to the front and sends a keystroke using pyautogui."""
     try:
+        backend = get_backend()
         target_window = _get_target_window(window_title)
-        target_window.set_focus()
-        time.sleep(0.5)
+        _focus(target_window)
+        snapshots.invalidate(backend.window_handle(target_window))
+        indexes.invalidate(backend.window_handle(target_window))
+        prefetched.discard()
         keys_to_press = key.lower().replace('^', 'ctrl+').replace('%', 'alt+').replace('+', ' ').split()
-        pyautogui.hotkey(*keys_to_press)
-        time.sleep(1)
+        backend.press_keys(*keys_to_press)
+        # Let the window react (title change, dialog, navigation) before the next observation.
+        wait_until_stable(lambda: [w.title for w in backend.list_windows()], settle_time=KEY_SETTLE_SECONDS, timeout=KEY_SETTLE_TIMEOUT)
         return f"Sent key(s) '{key}' to window '{window_title}'."
     except Exception as e:
-        return f"Error pressing key on window '{window_title}': {e}"
\ No newline at end of file
+        return f"Error pressing key on window '{window_title}': {e}"
+
+
+# --- Speculative observations ---
+def prefetch_observations(action_upper, args):
+    """
+    Starts, in the background, the read the agent most likely wants after `action_upper` ran: the window
+    it clicked in or sent a key to, or after a launch the new foreground window. Used by the next
+    GET_WINDOW_ELEMENTS / FIND_ELEMENTS if the model asks for it; otherwise dropped. Typing is usually
+    followed by a key press, and a launch's result already names its window, so neither reads ahead.
+    """
+    try:
+        backend = get_backend()
+        generation = prefetched.generation_now()
+        clicked = action_upper == "INTERACT_WITH_ELEMENT" and str(args.get("action", "")).lower() == "click"
+        if (clicked or action_upper == "PRESS_KEY") and args.get("window_title"):
+            window = _get_target_window(args["window_title"])
+            handle = backend.window_handle(window)
+            prefetched.start(("elements", handle), lambda: _read_elements(backend, window, handle, generation))
+        elif action_upper in ("SEARCH_AND_OPEN_APP", "OPEN_URL"):
+            handle = backend.foreground_handle()
+            prefetched.start(("elements", handle), lambda: _foreground_elements(backend, handle, generation))
+    except Exception as e:
+        print(f"ERROR: Could not start prefetching after {action_upper}: {e}")
+
+
+def _foreground_elements(backend, handle, generation):
+    title = next(w.title for w in backend.list_windows() if w.handle == handle)
+    return _read_elements(backend, pool.get(title, backend), handle, generation)
+
+
+def _read_elements(backend, window, handle, generation):
+    """
+    One read of the window's elements, also indexed for FIND_ELEMENTS. The action that ran before has
+    already waited for its own effect, so a single read sees what the agent's own read would.
+    """
+    elements = backend.window_elements(window)
+    if prefetched.current(generation):
+        indexes.store(handle, elements)
+    return elements
@@ -0,0 +1,165 @@
+# --- agent_context.py ---
+# The agent's working memory for one task. Instead of re-sending every observation verbatim, the history
+# is rendered within a token budget: the last few steps in full (with long element lists cut down to the
+# entries relevant to the objective), older steps as one-line summaries, and the oldest dropped if needed.
+# A summary never changes once written, so successive prompts keep sharing a prefix for the KV cache.
+
+import os
+import re
+import copy
+
+AGENT_CONTEXT_TOKENS = int(os.environ.get("JARVIS_AGENT_CONTEXT_TOKENS", "2048"))  # History budget per step.
+RECENT_STEPS = 3  # Steps shown in full.
+MAX_ELEMENT_LINES = 40  # Element lines kept per observation, most relevant first.
+SUMMARY_CHARS = 160  # Older observations shrink to their first line, cut to this.
+PENDING_OBSERVATION = "\x00pending\x00"  # Stands in for the result of an action that is still running.
+
+_ELEMENT_LINE = re.compile(r"^[+-]? ?Type: '")
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def estimate_tokens(text):
+    """Rough count for when the real tokenizer isn't available (about four characters per token)."""
+    return len(text) // 4 + 1
+
+
+def _words(text):
+    return set(_WORD.findall(str(text).lower()))
+
+
+class AgentStep:
+    def __init__(self, action, args, observation):
+        self.action = action  # None for a step where the model produced no usable action.
+        self.args = args
+        self.observation = observation
+        self.summary = None  # Set once when the step is compacted, then never changed.
+
+
+class AgentContext:
+    def __init__(self, objective, count_tokens=None, budget=AGENT_CONTEXT_TOKENS, recent_steps=RECENT_STEPS, count_tokens_many=None):
+        self.objective = objective
+        self.count_tokens = count_tokens or estimate_tokens
+        self.count_tokens_many = count_tokens_many  # Counts a list of texts in one call, when available.
+        self.budget = budget
+        self.recent_steps = recent_steps
+        self.keywords = _words(objective)
+        self.steps = []
+        self.dropped = 0
+        self.history_tokens = 0
+        self._token_counts = {}
+
+    def add_step(self, action, args, observation):
+        self.steps.append(AgentStep(action, args, observation))
+
+    def add_error(self, message):
+        self.steps.append(AgentStep(None, None, message))
+
+    def preview(self, action, args):
+        """
+        A copy of this context with (action, args) added and PENDING_OBSERVATION as its result: its history
+        reads like the next step's will, up to where the result goes. Rendering it compacts the same older
+        steps the real step will (summaries are written once either way); steps it drops stay in this context.
+        """
+        preview = copy.copy(self)
+        preview.steps = [*self.steps, AgentStep(action, args, PENDING_OBSERVATION)]
+        return preview
+
+    def step_count(self):
+        """Steps taken so far, counting dropped ones: the number the next step's observation will have."""
+        return self.dropped + len(self.steps)
+
+    def shows_in_full(self, step_number):
+        """
+        Whether the next prompt will still show step `step_number`'s observation in full (not summarized
+        or dropped); a step not added yet will be.
+        """
+        index = step_number - self.dropped
+        if index >= len(self.steps):
+            return True
+        return (index >= 0 and self.steps[index].summary is None
+                and step_number >= self.step_count() + 1 - self.recent_steps)
+
+    # --- Rendering ---
+    def _count(self, text):
+        if text not in self._token_counts:
+            try:
+                self._token_counts[text] = self.count_tokens(text)
+            except Exception:
+                self._token_counts[text] = estimate_tokens(text)
+        return self._token_counts[text]
+
+    def _count_new(self, texts):
+        """Counts every text not counted yet in one count_tokens_many call (one model server round trip)."""
+        new = [text for text in dict.fromkeys(texts) if text not in self._token_counts]
+        if len(new) < 2 or self.count_tokens_many is None:
+            return
+        try:
+            self._token_counts.update(zip(new, self.count_tokens_many(new)))
+        except Exception:
+            pass  # _count() tries each text on its own.
+
+    def _trim_elements(self, observation, args):
+        """Keeps the MAX_ELEMENT_LINES element lines sharing the most words with the objective and the step's args."""
+        lines = observation.split("\n")
+        element_rows = [i for i, line in enumerate(lines) if _ELEMENT_LINE.match(line)]
+        if len(element_rows) <= MAX_ELEMENT_LINES:
+            return observation
+        keywords = self.keywords | _words(" ".join(map(str, (args or {}).values())))
+        ranked = sorted(element_rows, key=lambda i: -len(_words(lines[i]) & keywords))
+        dropped = set(ranked[MAX_ELEMENT_LINES:])
+        kept = [line for i, line in enumerate(lines) if i not in dropped]
+        kept.append(f"({len(dropped)} less relevant elements not shown)")
+        return "\n".join(kept)
+
+    def _full(self, step):
+        if step.action is None:
+            return f"Observation: {step.observation}\n"
+        return f"Action: {step.action} with args {step.args}. Result:\n---\n{self._trim_elements(step.observation, step.args)}\n---\n"
+
+    def _summarize(self, step, previous):
+        if previous is not None and (step.action, step.args, step.observation) == (previous.action, previous.args, previous.observation):
+            return "Repeated the previous step with the same result.\n"
+        if step.action is None:
+            return f"Observation: {step.observation[:SUMMARY_CHARS]}\n"
+        lines = step.observation.split("\n")
+        element_count = sum(1 for line in lines if _ELEMENT_LINE.match(line))
+        result = f"[{element_count} elements listed]" if element_count > 1 else lines[0][:SUMMARY_CHARS]
+        return f"Action: {step.action} with args {step.args}. Result: {result}\n"
+
+    def _compact(self, index):
+        step = self.steps[index]
+        if step.summary is None:
+            step.summary = self._summarize(step, self.steps[index - 1] if index > 0 else None)
+
+    def _segments(self):
+        segments = [f"OBJECTIVE: {self.objective}\n"]
+        if self.dropped:
+            segments.append(f"[{self.dropped} earlier steps omitted]\n")
+        for step in self.steps:
+            segments.append(step.summary if step.summary is not None else self._full(step))
+        return segments
+
+    def render_history(self):
+        """The history for the next prompt, shrunk until it fits the token budget."""
+        for i in range(len(self.steps) - self.recent_steps):
+            self._compact(i)
+        while True:
+            segments = self._segments()
+            self._count_new(segments)
+            self.history_tokens = sum(self._count(s) for s in segments)
+            if self.history_tokens <= self.budget:
+                break
+            compacted = sum(1 for step in self.steps if step.summary is not None)
+            if compacted:
+                # Drop the oldest half at once, so the shared prompt prefix is invalidated rarely.
+                drop = max(1, compacted // 2)
+                self.steps = self.steps[drop:]
+                self.dropped += drop
+            elif len(self.steps) > 1:
+                self._compact(0)
+            else:
+                break  # Only the latest step is left; it is always shown in full.
+        return "".join(segments)
+
+    def stats(self):
+        return {"steps": len(self.steps) + self.dropped, "dropped": self.dropped, "history_tokens": self.history_tokens}
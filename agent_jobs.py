@@ -0,0 +1,175 @@
+# --- agent_jobs.py ---
+# Runs agent tasks in the background on bounded worker pools. Each task gets a job ID the browser can
+# poll, stream progress events from, or cancel, instead of holding an HTTP request open for minutes.
+# There is one desktop, so desktop agent jobs run one at a time; file jobs never touch it and get their
+# own pool, so they don't queue behind a long agent task.
+
+import os
+import time
+import uuid
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DESKTOP_WORKERS = 1  # Two agents driving the same mouse, keyboard and focus would undo each other's steps.
+FILE_WORKERS = int(os.environ.get("JARVIS_FILE_WORKERS", "2"))
+MAX_ACTIVE_JOBS = int(os.environ.get("JARVIS_MAX_ACTIVE_JOBS", "16"))  # Queued plus running; more are rejected.
+JOB_RETENTION_SECONDS = 3600  # Finished jobs stay queryable this long.
+MAX_EVENT_TEXT = 1000  # Observations are long element dumps; progress events only need the start.
+
+FINISHED_STATES = {"succeeded", "failed", "cancelled"}
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class AgentJob:
+    def __init__(self, owner_id, description, conversation_id=None):
+        self.id = uuid.uuid4().hex
+        self.owner_id = owner_id
+        self.description = description
+        self.conversation_id = conversation_id
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.events = []
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.condition = threading.Condition()
+        self.async_waiters = []  # (event loop, asyncio.Event) per stream served by the ASGI app.
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def add_event(self, event):
+        """Records a progress event and wakes every stream waiting on this job."""
+        event = {k: (v[:MAX_EVENT_TEXT] if isinstance(v, str) else v) for k, v in event.items()}
+        with self.condition:
+            self.events.append(event)
+            self._notify()
+
+    def finish(self, status, result=None, error=None, **extra):
+        # Status and the final "done" event change together, so a stream never sees one without the other.
+        with self.condition:
+            self.status, self.result, self.error = status, result, error
+            self.finished_at = time.time()
+            self.events.append({"type": "done", "status": status, "response": result, "error": error, **extra})
+            self._notify()
+
+    def _notify(self):
+        """Wakes thread and event-loop waiters. Call with the condition held."""
+        self.condition.notify_all()
+        for loop, waiter in self.async_waiters:
+            try:
+                loop.call_soon_threadsafe(waiter.set)
+            except RuntimeError:
+                pass  # That loop has shut down.
+
+    def wait_for_events(self, start, timeout):
+        """Returns (events after index `start`, finished), waiting up to `timeout` seconds for something new."""
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.events) > start or self.finished, timeout)
+            return self.events[start:], self.finished
+
+    async def wait_for_events_async(self, start, timeout):
+        """Like wait_for_events(), but waits on the event loop instead of holding a thread."""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self.condition:
+            if len(self.events) > start or self.finished:
+                return self.events[start:], self.finished
+            self.async_waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self.condition:
+                self.async_waiters.remove(waiter)
+        with self.condition:
+            return self.events[start:], self.finished
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "description": self.description,
+            "conversation_id": self.conversation_id,
+            "result": self.result,
+            "error": self.error,
+            "steps": sum(1 for e in self.events if e.get("type") == "action"),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    def __init__(self, file_workers=FILE_WORKERS, max_active=MAX_ACTIVE_JOBS):
+        self.executors = {
+            "desktop": ThreadPoolExecutor(max_workers=DESKTOP_WORKERS, thread_name_prefix="agent-job"),
+            "file": ThreadPoolExecutor(max_workers=file_workers, thread_name_prefix="file-job"),
+        }
+        self.max_active = max_active
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, owner_id, description, run, conversation_id=None, on_finish=None, pool="desktop"):
+        """
+        Queues `run(job) -> str` on the `pool` ("desktop" or "file") workers and returns the job immediately.
+        `on_finish(job, result)` runs on the worker before the job is marked finished; a dict it
+        returns is added to the final "done" event.
+        """
+        with self.lock:
+            self._prune()
+            if sum(1 for job in self.jobs.values() if not job.finished) >= self.max_active:
+                raise JobQueueFull(f"{self.max_active} tasks are already queued or running.")
+            job = AgentJob(owner_id, description, conversation_id)
+            self.jobs[job.id] = job
+        self.executors[pool].submit(self._run, job, run, on_finish)
+        return job
+
+    def _run(self, job, run, on_finish):
+        if job.cancel_event.is_set():
+            status, result, error = "cancelled", "Task cancelled.", None
+        else:
+            job.status, job.started_at = "running", time.time()
+            job.add_event({"type": "status", "status": "running"})
+            try:
+                result, error = run(job), None
+                status = "cancelled" if job.cancel_event.is_set() else "succeeded"
+            except Exception as e:
+                print(f"CRITICAL ERROR in job {job.id}: {e}")
+                status, result, error = "failed", "An unexpected error occurred.", str(e)
+        extra = {}
+        if on_finish:
+            try:
+                extra = on_finish(job, result) or {}
+            except Exception as e:
+                print(f"ERROR: Could not finish job {job.id}: {e}")
+        job.finish(status, result, error, **extra)
+
+    def get(self, job_id, owner_id=None):
+        job = self.jobs.get(job_id)
+        if job is None or (owner_id is not None and job.owner_id != owner_id):
+            return None
+        return job
+
+    def cancel(self, job_id, owner_id=None):
+        """Asks a job to stop; a running agent task stops before its next step."""
+        job = self.get(job_id, owner_id)
+        if job and not job.finished:
+            job.cancel_event.set()
+            job.add_event({"type": "status", "status": "cancelling"})
+        return job
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id in [j.id for j in self.jobs.values() if j.finished and j.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+
+jobs = JobManager()
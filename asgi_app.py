@@ -0,0 +1,205 @@
+# --- asgi_app.py ---
+# ASGI serving mode. The streaming endpoints (/stream-command and the agent job status/stream routes) run on
+# an event loop, so an open EventSource costs a coroutine instead of a server thread; every other route is the
+# unchanged Flask app behind a WSGI adapter. Users are loaded from Flask's session cookie with Flask-Login,
+# so logins, redirects and job ownership behave the same in both modes.
+#
+#   JARVIS_SERVER=asgi python webapp.py        (or: uvicorn asgi_app:app --port 5000)
+
+import io
+import os
+import sys
+import json
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import uvicorn
+from a2wsgi import WSGIMiddleware
+from flask_login import current_user
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+import agent_jobs
+import assistant_core
+import tracing
+import webapp
+
+STREAM_WORKERS = int(os.environ.get("JARVIS_ASGI_STREAM_WORKERS", "32"))  # Chat replies generated at once; more wait.
+KEEPALIVE_SECONDS = 15
+
+_generation_pool = ThreadPoolExecutor(max_workers=STREAM_WORKERS, thread_name_prefix="asgi-stream")
+
+
+# --- Flask session and login ---
+def _environ(scope):
+    """A WSGI environ for an ASGI request, enough for Flask to open its session and load the user."""
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": "",
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        key = name.decode("latin-1").upper().replace("-", "_")
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = "HTTP_" + key
+        value = value.decode("latin-1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _as_starlette(flask_response):
+    response = Response(flask_response.get_data(), status_code=flask_response.status_code)
+    response.raw_headers = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in flask_response.headers.items()]
+    return response
+
+
+def _as_user(request, handler):
+    """
+    Runs `handler()` inside a Flask request context for the logged-in user and returns its result, or
+    Flask-Login's "unauthorized" response (the redirect to the login page) as a Starlette response.
+    Blocking (it loads the user from the database): call it in a worker thread.
+    """
+    with webapp.app.request_context(_environ(request.scope)):
+        if not current_user.is_authenticated:
+            return _as_starlette(webapp.app.process_response(webapp.login_manager.unauthorized()))
+        return handler()
+
+
+# --- Simple chat ---
+def _hand_over(loop, queue, item):
+    try:
+        loop.call_soon_threadsafe(queue.put_nowait, item)
+    except RuntimeError:
+        pass  # The event loop has shut down.
+
+
+def _generate(loop, chunks, stop, convo_id, command, history, use_cache):
+    """Runs the blocking token stream on a worker thread, handing each chunk to the event loop."""
+    full_response_text = ""
+    stream = assistant_core.stream_simple_command(history, command, use_cache=use_cache)
+    try:
+        for chunk in stream:
+            full_response_text += chunk
+            _hand_over(loop, chunks, chunk)
+            if stop.is_set():
+                break
+    except Exception as e:
+        print(f"ERROR: Chat stream failed: {e}")
+    finally:
+        # Closing the stream right away cancels generation if the client disconnected.
+        stream.close()
+        webapp.finish_chat_turn(convo_id, command, full_response_text)
+        _hand_over(loop, chunks, None)
+
+
+async def _chat_events(convo_id, command, history, use_cache):
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+    stop = threading.Event()
+    loop.run_in_executor(_generation_pool, _generate, loop, chunks, stop, convo_id, command, history, use_cache)
+    try:
+        while (chunk := await chunks.get()) is not None:
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+    finally:
+        stop.set()
+
+
+async def stream_command(request):
+    command = request.query_params.get("command", "")
+    convo_id = request.query_params.get("conversation_id")
+
+    def begin():
+        if not convo_id:
+            return Response("Error: Missing conversation ID", media_type="text/event-stream")
+        return webapp.begin_chat_turn(convo_id, command)
+
+    result = await run_in_threadpool(_as_user, request, begin)
+    if isinstance(result, Response):
+        return result
+    history, use_cache = result
+    return StreamingResponse(_chat_events(convo_id, command, history, use_cache), media_type="text/event-stream")
+
+
+# --- Agent jobs ---
+async def _user_job(request):
+    """(job, None) for the logged-in user's job, or (None, an error response)."""
+    owner_id = await run_in_threadpool(_as_user, request, lambda: current_user.id)
+    if isinstance(owner_id, Response):
+        return None, owner_id
+    return agent_jobs.jobs.get(request.path_params["job_id"], owner_id=owner_id), None
+
+
+async def job_status(request):
+    job, error = await _user_job(request)
+    if error is not None:
+        return error
+    if not job:
+        return JSONResponse({"error": "Job not found"}, status_code=404)
+    return JSONResponse(job.to_dict())
+
+
+async def stream_job(request):
+    job, error = await _user_job(request)
+    if error is not None:
+        return error
+    if not job:
+        return Response("Error: Job not found", status_code=404, media_type="text/event-stream")
+
+    async def events():
+        sent = 0
+        while True:
+            new_events, finished = await job.wait_for_events_async(sent, timeout=KEEPALIVE_SECONDS)
+            for event in new_events:
+                yield f"data: {json.dumps(event)}\n\n"
+            sent += len(new_events)
+            if finished and sent == len(job.events):
+                break
+            if not new_events:
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def _traced(route, endpoint):
+    """The endpoint as an http.request span, labelled with the same route pattern as its Flask twin."""
+    async def traced_endpoint(request):
+        with tracing.span("http.request", route=route, method=request.method):
+            return await endpoint(request)
+    return traced_endpoint
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # `uvicorn asgi_app:app` never runs webapp's __main__, so the database is created or migrated here.
+    await run_in_threadpool(webapp.create_database_if_needed)
+    yield
+
+
+app = Starlette(lifespan=lifespan, routes=[
+    Route("/stream-command", _traced("/stream-command", stream_command)),
+    Route("/api/jobs/{job_id}", _traced("/api/jobs/<job_id>", job_status)),
+    Route("/api/jobs/{job_id}/stream", _traced("/api/jobs/<job_id>/stream", stream_job)),
+    Mount("/", WSGIMiddleware(webapp.app)),
+])
+
+
+def run(host="0.0.0.0", port=5000):
+    print(f">>> Serving JARVIS over ASGI on {host}:{port}")
+    uvicorn.run(app, host=host, port=port, log_level="warning")
@@ -1,14 +1,29 @@
 # --- assistant_core.py (The Final, Transplanted Version) ---
 
-# CHANGE: We now import our local brain handler instead of Gemini.
-import local_llm_handler
-
 import os
 import time
 import datetime
 import json
 import re
+import uuid
 import action_handler
+import response_cache
+import file_ingest
+import tracing
+import model_client
+from concurrent.futures import ThreadPoolExecutor
+from model_common import CHAT_MAX_NEW_TOKENS, CHAT_MODEL_ID, MAX_BATCH_SIZE, QUANTIZE_MODE, StreamStalled
+from agent_context import AgentContext
+from element_snapshots import SnapshotScope, snapshots, use_scope
+from plan_cache import plans
+
+# With JARVIS_MODEL_SERVER set, the models live in one shared model_server.py process and every web
+# worker reaches them through model_client, which has the same functions; torch is then never imported.
+if model_client.SERVER_ADDRESS:
+    local_llm_handler = model_client
+else:
+    # CHANGE: We now import our local brain handler instead of Gemini.
+    import local_llm_handler
 
 # --- Configuration & Initialization ---
 
@@ -17,65 +32,215 @@ def initialize():
     """Initializes the connection to the local LLMs."""
     return local_llm_handler.initialize_models()
 
+def model_status():
+    """Load state and memory footprint of the local models."""
+    return local_llm_handler.model_status()
+
 # CHANGE: This function now gets conversational responses from our local chat model.
-def stream_simple_command(history, command):
-    """Handles simple, conversational commands using the local chat model."""
+# Ends a reply whose stream stalled, so the saved turn (and the reader) can tell it isn't the whole answer.
+CUT_SHORT_NOTE = " [The reply was cut short.]"
+
+def stream_simple_command(history, command, use_cache=True):
+    """
+    Handles simple, conversational commands using the local chat model.
+    An answer already given to the same command after the same recent history is replayed from the
+    response cache instead; `use_cache=False` (a conversation's opt-out) always asks the model.
+    Only a reply whose stream ended normally is cached.
+    """
+    key = response_cache.fingerprint(history, command, _chat_cache_namespace()) if use_cache else None
+    cached = response_cache.responses.get(key) if key else None
+    if cached is not None:
+        print(f"Answering chat command from the response cache: '{command}'")
+        yield from response_cache.replay(cached)
+        return
     print(f"Sending simple chat command to Local LLM: '{command}'")
+    chunks = []
+    # A stream outlives its HTTP request, so it gets its own trace; the span covers the whole reply.
+    trace = tracing.new_trace("chat-stream")
+    started = time.perf_counter()
+    stream = tracing.iterate_in_trace(trace, local_llm_handler.stream_chat_response(history, command))
+    completed = False
     try:
         # The new handler will yield the response chunks
-        yield from local_llm_handler.stream_chat_response(history, command)
+        for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+        completed = True
+    except StreamStalled as e:
+        print(f"CORE_ERROR in stream_simple_command: {e}")
+        yield CUT_SHORT_NOTE
+        return
     except Exception as e:
         print(f"CORE_ERROR in stream_simple_command: {e}")
         yield "Sorry, I'm having trouble with my local AI brain right now."
+        return
+    finally:
+        stream.close()  # Cancels generation right away if the client went away mid-reply.
+        with tracing.use_traces((trace,) if trace else ()):
+            tracing.record_span("chat.stream", started)
+        if trace: trace.finish()
+    # Not after a stall or an error (both return above), nor for a client that disconnected mid-reply,
+    # which closes this generator before it gets here.
+    if completed and key and "".join(chunks).strip():
+        response_cache.responses.put(key, "".join(chunks))
+
+def _chat_cache_namespace():
+    # Answers from another model or generation setting must not be replayed.
+    return f"{CHAT_MODEL_ID}|{QUANTIZE_MODE}|{CHAT_MAX_NEW_TOKENS}"
+
+def response_cache_stats():
+    """Hit/miss counters and size of the chat response cache."""
+    return response_cache.responses.stats()
+
+# Argument schema of every TOOLKIT action. Drives constrained decoding, so the agent model can only
+# answer with one of these actions and its known arguments.
+# RULE 1: Only these exact action names exist (no 'send' or 'type_text').
+# RULE 2: To send a message or submit a search after typing, use PRESS_KEY with key 'enter'.
+TOOLKIT = {
+    # Local apps like 'WhatsApp', 'Notepad', launched from the Start Menu.
+    "search_and_open_app": {"app_name": {}},
+    # Websites like 'https://www.google.com'.
+    "open_url": {"url": {}},
+    # The titles of all open windows.
+    "LIST_OPEN_WINDOWS": {},
+    # A window's controls. Looking at the same window again lists only what changed (+ added, - removed);
+    # full_refresh "true" lists everything.
+    "GET_WINDOW_ELEMENTS": {"window_title": {}, "full_refresh": {"optional": True, "enum": ["true", "false"]}},
+    # Only the few controls whose titles best match a query like 'message box' or 'send'; typos are fine.
+    "FIND_ELEMENTS": {"window_title": {}, "query": {}, "control_type": {"optional": True}},
+    # 'click' or 'type' into a control matched by title and/or control type.
+    "INTERACT_WITH_ELEMENT": {
+        "window_title": {},
+        "action": {"enum": ["click", "type"]},
+        "element_title": {"optional": True},
+        "control_type": {"optional": True},
+        "value": {"optional": True},
+    },
+    # Single keys like 'enter' or shortcuts like '^s'.
+    "PRESS_KEY": {"window_title": {}, "key": {}},
+    # The entire objective is complete.
+    "FINISH": {"reason": {}},
+}
+
+def _extract_json(response_text):
+    """Returns the first complete JSON object in the model's response."""
+    start = response_text.find("{")
+    if start == -1: raise ValueError(f"No JSON object found in response: {response_text}")
+    decision_json, _ = json.JSONDecoder().raw_decode(response_text[start:])
+    return decision_json
+
+# Pipelined steps: while an action runs, the next prompt's known prefix is prefilled into the task's model
+# session, and once it returns, the observations the model will likely ask for next are read in the
+# background (see action_handler.prefetch_observations). Only the decode and the action itself stay on
+# each step's critical path.
+AGENT_PIPELINE = os.environ.get("JARVIS_AGENT_PIPELINE", "1") != "0"
+_pipeline = ThreadPoolExecutor(max_workers=2, thread_name_prefix="agent-pipeline")
 
-def process_agentic_task(objective: str) -> str:
-    """Uses a local agent model for reasoning and a dedicated local toolkit."""
-    thought_history = [f"OBJECTIVE: {objective}\n"]
+def process_agentic_task(objective: str, on_event=None, cancel_event=None) -> str:
+    """
+    Uses a local agent model for reasoning and a dedicated local toolkit.
+    `on_event(dict)` receives each step's action and observation as it happens; setting
+    `cancel_event` stops the task before its next step.
+    """
+    context = AgentContext(objective, count_tokens=local_llm_handler.count_agent_tokens,
+                           count_tokens_many=local_llm_handler.count_agent_tokens_many)
     max_steps = 20
-    
-    for i in range(max_steps):
-        print(f"\n--- Agent Execution Step {i+1}/{max_steps} ---")
-        
-        # NOTE: The system prompt remains the same, as our handler is designed to parse it.
-        system_prompt = f"""
-You are the reasoning core of a general-purpose PC control assistant. Your task is to analyze the user's objective and the history of actions to decide the single next logical step.
-
-**USER'S OBJECTIVE:** {objective}
-**ACTION HISTORY & OBSERVATIONS:**
-{''.join(thought_history)}
-
---- TOOLKIT & CRITICAL RULES ---
-**RULE 1: You MUST ONLY use the exact action names from the TOOLKIT below. Do NOT invent actions like 'send' or 'type_text'.**
-**RULE 2: To send a message or submit a search after typing, you MUST use the `PRESS_KEY` action with the `key` parameter set to `'enter'`.**
-
-**TOOLKIT (The ONLY allowed actions):**
-- `search_and_open_app(app_name: str)`: Use for local apps like 'WhatsApp', 'Notepad'.
-- `open_url(url: str)`: Use for websites like 'https://www.google.com'.
-- `LIST_OPEN_WINDOWS()`: Gets the titles of all open windows.
-- `GET_WINDOW_ELEMENTS(window_title: str)`: Inspects a window to see its controls.
-- `INTERACT_WITH_ELEMENT(window_title: str, action: str, element_title: str = None, control_type: str = None, value: str = "")`: Use this to 'click' or 'type'.
-- `PRESS_KEY(window_title: str, key: str)`: Use this for single keys like 'enter'.
-- `FINISH(reason: str)`: Use this when the entire objective is complete.
-
---- MASTER STRATEGY ---
-1.  **Opening:** First, decide if the target is a website or a local app, and use the correct tool (`open_url` or `search_and_open_app`).
-2.  **Re-evaluating:** After any major `click` or `PRESS_KEY` action, use `GET_WINDOW_ELEMENTS` to see the new screen state.
-
-Based on this strategy and the critical rules, what is the single best action from the TOOLKIT to take NEXT? Respond with only a valid JSON object.
-"""
+    # Lets the agent model keep the key/values of the prompt prefix between steps.
+    session_id = uuid.uuid4().hex
+    emit = on_event or (lambda event: None)
+    trace = []  # (action, args, observation) of every executed step, for the plan cache.
+    task_span = tracing.span("agent.task")
+    # GET_WINDOW_ELEMENTS diffs against what this task's history still shows, never another task's reads.
+    scope = SnapshotScope(session_id, context.step_count, context.shows_in_full)
+    try:
+        with use_scope(scope):
+            # A plan that completed this kind of objective before runs without the model; if a step
+            # fails, the model takes over from there with the replayed steps in its history.
+            plan, slots = plans.lookup(objective)
+            if plan:
+                result = _replay_plan(plan, slots, context, trace, emit, cancel_event)
+                if result is not None:
+                    return result
+            result = _run_agent_steps(context, max_steps - len(trace), session_id, emit, cancel_event, trace)
+            if trace and trace[-1][0] == "FINISH":
+                plans.record(objective, trace[:-1], result)
+            return result
+    finally:
+        snapshots.forget(session_id)
+        local_llm_handler.release_agent_session(session_id)
+        task_span.end()
+
+def _replay_plan(plan, slots, context, trace, emit, cancel_event):
+    """Runs a cached plan step by step; returns its finish reason, or None if a step failed."""
+    print(f"AGENT: Replaying cached plan '{plan.template}' with slots {slots}.")
+    started = time.monotonic()
+    steps, finish_reason = plan.instantiate(slots)
+    for i, (action, args) in enumerate(steps):
+        if cancel_event and cancel_event.is_set():
+            plans.replay_finished(plan, time.monotonic() - started, completed=False)
+            return "Task cancelled."
+        emit({"type": "action", "step": i + 1, "action": action, "args": args, "replayed": True})
+        with tracing.span("agent.step", source="plan"):
+            observation = _execute_action(action, args)
+        print(f"Replayed {action}: {observation}")
+        trace.append((action, args, observation))
+        context.add_step(action, args, observation)
+        emit({"type": "observation", "step": i + 1, "observation": observation, "replayed": True})
+        if "Error" in observation:
+            print(f"AGENT: Cached plan diverged at step {i+1}; handing over to the agent model.")
+            plans.replay_finished(plan, time.monotonic() - started, completed=False)
+            return None
+    plans.replay_finished(plan, time.monotonic() - started, completed=True)
+    print(f"AGENT: Cached plan completed in {time.monotonic() - started:.2f}s.")
+    return finish_reason
+
+def plan_cache_stats():
+    """Hit rate, replay latency and fallbacks of the action plan cache."""
+    return plans.stats()
+
+def _prefill_next_step(context, action_upper, args, session_id):
+    """Starts prefilling the next step's prompt, up to where this action's result goes; returns its Future."""
+    try:
+        prefix = local_llm_handler.build_agent_prompt_prefix(context, action_upper, args)
+    except Exception as e:
+        print(f"ERROR: Could not build the next prompt's prefix: {e}")
+        return None
+    traces = tracing.current_traces()
+
+    def prefill():
+        with tracing.use_traces(traces):
+            try:
+                return local_llm_handler.prefill_agent_prompt(prefix, session_id)
+            except Exception as e:
+                print(f"ERROR: Ahead-of-time prefill failed; the next step prefills in full. {e}")
+    return _pipeline.submit(prefill)
+
+def _run_agent_steps(context, max_steps, session_id, emit, cancel_event, trace):
+    start = len(trace)  # Steps already taken by a cached plan.
+    prefill = None  # The previous step's ahead-of-time prefill, if still running.
+    for i in range(start, start + max_steps):
+        if cancel_event and cancel_event.is_set():
+            print("AGENT: Task cancelled.")
+            return "Task cancelled."
+        print(f"\n--- Agent Execution Step {i+1}/{start + max_steps} ---")
+        step_span = tracing.span("agent.step", source="model")
+        step_started = time.perf_counter()
+        if prefill:
+            prefill.result()  # The decode queues behind it anyway; this keeps the session cache in step order.
+            prefill = None
         
         # --- THIS IS THE BRAIN TRANSPLANT ---
         # The old try/except block that called Gemini is replaced with this new one.
         try:
             print("ACTION: Sending request to Local Agent for next logical action...")
             # CHANGE: This is the key line. We call our local handler instead of Gemini.
-            response_text = local_llm_handler.get_agentic_action_json(system_prompt)
+            with tracing.span("agent.decide"):
+                response_text = local_llm_handler.get_agentic_action_json(context, session_id=session_id, toolkit=TOOLKIT)
+            print(f"AGENT: History {context.stats()}")
 
-            # The rest of the parsing logic is the same, as it's designed to find JSON.
-            json_match = re.search(r"```json\s*(\{.*?\})\s*```|(\{.*?\})", response_text, re.DOTALL | re.S)
-            if not json_match: raise ValueError(f"No JSON object found in response: {response_text}")
-            json_string = json_match.group(1) if json_match.group(1) else json_match.group(2)
-            decision_json = json.loads(json_string)
+            # With constrained decoding the response is exactly one action object; the decoder
+            # still tolerates surrounding text in case constraints are turned off.
+            decision_json = _extract_json(response_text)
             
             def lower_keys(x):
                 if isinstance(x, dict): return {k.lower(): lower_keys(v) for k, v in x.items()}
@@ -98,42 +263,156 @@ Based on this strategy and the critical rules, what is the single best action fr
         except Exception as e:
             # CHANGE: The error message now reflects a problem with the local model.
             print(f"AGENT_ERROR: Could not get decision from local model. Error: {e}")
-            thought_history.append(f"Observation: AI reasoning failed with error: {e}\n")
-            time.sleep(3); continue
+            context.add_error(f"AI reasoning failed with error: {e}")
+            emit({"type": "error", "step": i + 1, "message": f"AI reasoning failed: {e}"})
+            step_span.end()
+            continue
         
         # --- END OF BRAIN TRANSPLANT ---
         
-        observation = ""
         action_upper = action.upper()
-        
-        # The action execution logic remains unchanged.
-        try:
-            if action_upper == "SEARCH_AND_OPEN_APP":
-                observation = action_handler.search_and_open_app(**args)
-            elif action_upper == "OPEN_URL":
-                observation = action_handler.open_url(**args)
-            elif action_upper == "LIST_OPEN_WINDOWS":
-                observation = action_handler.list_open_windows(**args)
-            elif action_upper == "GET_WINDOW_ELEMENTS":
-                observation = action_handler.get_window_elements(**args)
-            elif action_upper == "INTERACT_WITH_ELEMENT":
-                observation = action_handler.interact_with_element(**args)
-            elif action_upper == "PRESS_KEY":
-                 observation = action_handler.press_key(**args)
-            elif action_upper == "FINISH":
-                print("AGENT: Master plan complete.")
-                return args.get("reason", "Objective complete.")
-            else:
-                observation = f"Attempted an unknown action: '{action}'."
-        except Exception as e:
-            observation = f"Error executing action {action_upper}: {e}"
-            
+        emit({"type": "action", "step": i + 1, "action": action_upper, "args": args})
+        if action_upper == "FINISH":
+            print("AGENT: Master plan complete.")
+            trace.append((action_upper, args, ""))
+            step_span.end()
+            return args.get("reason", "Objective complete.")
+
+        if AGENT_PIPELINE:
+            prefill = _prefill_next_step(context, action_upper, args, session_id)
+        action_started = time.perf_counter()
+        observation = _execute_action(action_upper, args)
+        if AGENT_PIPELINE:
+            action_handler.prefetch_observations(action_upper, args)
         print(f"Action Result: {observation}")
-        thought_history.append(f"Action: {action.upper()} with args {args}. Result:\n---\n{observation}\n---\n")
+        print(f"AGENT: Step {i+1} critical path {(time.perf_counter() - step_started) * 1000:.0f} ms "
+              f"(decide {(action_started - step_started) * 1000:.0f} ms, action {(time.perf_counter() - action_started) * 1000:.0f} ms).")
+        trace.append((action_upper, args, observation))
+        context.add_step(action_upper, args, observation)
+        emit({"type": "observation", "step": i + 1, "observation": observation})
+        step_span.end()
+        # No pause here: each action waits for its own UI condition before returning.
+
+    return "Task failed: reached maximum number of steps."
 
-        if "Error" not in observation:
-            time.sleep(2)
+def _execute_action(action_upper, args):
+    """Runs one TOOLKIT action through action_handler and returns its observation."""
+    try:
+        if action_upper == "SEARCH_AND_OPEN_APP":
+            return action_handler.search_and_open_app(**args)
+        elif action_upper == "OPEN_URL":
+            return action_handler.open_url(**args)
+        elif action_upper == "LIST_OPEN_WINDOWS":
+            return action_handler.list_open_windows(**args)
+        elif action_upper == "GET_WINDOW_ELEMENTS":
+            return action_handler.get_window_elements(**args)
+        elif action_upper == "FIND_ELEMENTS":
+            return action_handler.find_elements(**args)
+        elif action_upper == "INTERACT_WITH_ELEMENT":
+            return action_handler.interact_with_element(**args)
+        elif action_upper == "PRESS_KEY":
+            return action_handler.press_key(**args)
         else:
-            time.sleep(3) 
+            return f"Attempted an unknown action: '{action_upper}'."
+    except Exception as e:
+        return f"Error executing action {action_upper}: {e}"
+
+# --- File commands ---
+# Uploaded text files are read as a stream of chunks (see file_ingest). "Summarize"-style commands summarize
+# the chunks in batches the chat scheduler decodes together, folding the summaries into one whenever they
+# grow long; questions are answered from the chunks that mention the question's words most.
+FILE_SUMMARY_BATCH = MAX_BATCH_SIZE
+FILE_MAX_SUMMARIZED_CHUNKS = int(os.environ.get("JARVIS_FILE_MAX_CHUNKS", "64"))  # Larger files are sampled evenly.
+FILE_SUMMARY_FOLD_CHARS = 6000  # Running summaries longer than this are folded into one.
+FILE_ANSWER_CHUNKS = 3
+_SUMMARY_COMMAND = re.compile(r"^\s*(summari[sz]e|summary|tl;?dr|overview|what('s| is) (in )?(this|the) (file|document))", re.IGNORECASE)
+
+def process_file_command(file_path: str, command: str, on_event=None, cancel_event=None) -> str:
+    """
+    Answers a command about an uploaded text file without loading the whole file.
+    `on_event(dict)` receives "progress" events and each partial summary ("partial") as it is produced;
+    setting `cancel_event` stops at the next batch.
+    """
+    emit = on_event or (lambda event: None)
+    name = os.path.basename(file_path)
+    try:
+        with tracing.span("file.process"):
+            if not command.strip() or _SUMMARY_COMMAND.match(command):
+                return _summarize_file(file_path, name, command, emit, cancel_event)
+            return _answer_from_file(file_path, name, command, emit, cancel_event)
+    except file_ingest.UnsupportedFile as e:
+        return f"I can't read {name}: {e}."
+    except Exception as e:
+        print(f"CORE_ERROR in process_file_command: {e}")
+        return "Sorry, I'm having trouble with my local AI brain right now."
+
+def _ask_chat_model(prompts):
+    """Answers standalone prompts concurrently, so the chat scheduler decodes them as one batch."""
+    def ask(prompt):
+        return "".join(local_llm_handler.stream_chat_response([], prompt)).strip()
+    if len(prompts) == 1:
+        return [ask(prompts[0])]
+    with ThreadPoolExecutor(max_workers=len(prompts), thread_name_prefix="file-batch") as pool:
+        return list(pool.map(ask, prompts))
+
+def _summarize_file(file_path, name, command, emit, cancel_event):
+    stride = -(-file_ingest.estimated_chunks(file_path) // FILE_MAX_SUMMARIZED_CHUNKS)
+    instruction = command.strip() or "Summarize this file."
+    summaries, batch, summarized, total = [], [], 0, 0
+
+    def flush():
+        nonlocal summarized
+        prompts = [f"This is part {index + 1} of the file '{name}'. Summarize it in at most three sentences.\n\n{chunk}" for index, chunk in batch]
+        with tracing.span("file.summarize_batch"):
+            answers = _ask_chat_model(prompts)
+        for (index, _), answer in zip(batch, answers):
+            summaries.append(answer)
+            emit({"type": "partial", "part": index + 1, "text": answer})
+        summarized += len(batch)
+        batch.clear()
+        if sum(len(s) for s in summaries) > FILE_SUMMARY_FOLD_CHARS:
+            summaries[:] = _ask_chat_model([_fold_prompt(name, "Combine these partial summaries into one short summary.", summaries)])
+
+    for index, chunk, fraction in file_ingest.iter_chunks(file_path):
+        total = index + 1
+        if index % stride:
+            continue
+        batch.append((index, chunk))
+        if len(batch) >= FILE_SUMMARY_BATCH:
+            if cancel_event and cancel_event.is_set():
+                return "Task cancelled."
+            emit({"type": "progress", "message": f"Read {fraction:.0%} of {name}"})
+            flush()
+    if batch:
+        flush()
+    if not summaries:
+        return f"{name} is empty."
+    print(f"INFO: Summarized {summarized} of {total} parts of {name}.")
+    result = summaries[0] if len(summaries) == 1 and total == 1 else _ask_chat_model([_fold_prompt(name, instruction, summaries)])[0]
+    if stride > 1:
+        result += f"\n\n_(Based on {summarized} evenly spaced sections out of {total}.)_"
+    return result
+
+def _fold_prompt(name, instruction, summaries):
+    parts = "\n\n".join(f"- {s}" for s in summaries)
+    return f"These are summaries of consecutive parts of the file '{name}'.\n\n{parts}\n\n{instruction}"
 
-    return "Task failed: reached maximum number of steps."
\ No newline at end of file
+def _answer_from_file(file_path, name, command, emit, cancel_event):
+    terms = file_ingest.query_terms(command)
+    best = file_ingest.TopChunks(FILE_ANSWER_CHUNKS)
+    reported = 0.0
+    with tracing.span("file.search"):
+        for index, chunk, fraction in file_ingest.iter_chunks(file_path):
+            best.offer(file_ingest.relevance(chunk, terms), index, chunk)
+            if fraction - reported >= 0.1:
+                if cancel_event and cancel_event.is_set():
+                    return "Task cancelled."
+                reported = fraction
+                emit({"type": "progress", "message": f"Searched {fraction:.0%} of {name}"})
+    excerpts = best.in_file_order()
+    if not excerpts:
+        return f"{name} is empty."
+    context = "\n\n".join(f"[Part {index + 1}]\n{chunk}" for index, chunk in excerpts)
+    emit({"type": "progress", "message": f"Answering from parts {', '.join(str(i + 1) for i, _ in excerpts)} of {name}"})
+    prompt = f"Excerpts from the file '{name}':\n\n{context}\n\nUsing only these excerpts, answer: {command}"
+    return _ask_chat_model([prompt])[0]
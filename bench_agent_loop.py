@@ -0,0 +1,273 @@
+# --- bench_agent_loop.py ---
+# End-to-end agent loop benchmark on the simulated desktop. Canned objectives run through the real
+# process_agentic_task(), action_handler and ui_wait code against a FakeDesktopBackend with realistic
+# per-call latencies, while a scripted stand-in for the agent model answers each step after a simulated
+# decode time. Every step is broken down into LLM time, action time, and within the action the time
+# spent waiting on UI conditions (ui_wait) and in simulated desktop calls. Each objective runs serially and
+# pipelined (ahead-of-time prefill and speculative observation reads, see assistant_core.AGENT_PIPELINE);
+# a step's critical path is the time from the previous action's end to its own.
+#
+#   python bench_agent_loop.py                         (Windows-like latencies, 400 ms per model call)
+#   python bench_agent_loop.py --llm-ms 0 --instant    (the loop's own overhead)
+#   python bench_agent_loop.py --modes serial          (without the pipeline)
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import contextlib
+
+os.environ.setdefault("JARVIS_PLAN_CACHE", "")
+os.environ.setdefault("JARVIS_RESPONSE_CACHE", "")
+
+import assistant_core
+import local_llm_handler
+from agent_context import estimate_tokens
+from desktop_backend import FakeDesktopBackend, FakeElement, SIMULATED_WINDOWS_LATENCIES, SIMULATED_LAUNCH_DELAY, set_backend
+from element_snapshots import snapshots
+from element_index import indexes
+from observation_prefetch import prefetched
+from plan_cache import PlanCache
+from ui_wait import get_thread_wait_seconds
+from window_pool import pool
+
+FILLER_ELEMENTS = 60  # Extra controls per app window, so element reads cost what a real window's do.
+
+
+# --- Simulated apps ---
+def _filler(prefix):
+    return [FakeElement("Button" if i % 3 else "Text", f"{prefix} item {i}") for i in range(FILLER_ELEMENTS)]
+
+
+def notepad_elements():
+    return [FakeElement("MenuItem", "File"), FakeElement("MenuItem", "Edit"), FakeElement("Document", "Text Editor"), *_filler("Notepad")]
+
+
+def whatsapp_elements():
+    def open_chat(backend):
+        backend.windows[backend.foreground].elements.extend([FakeElement("Edit", "Type a message"), FakeElement("Button", "Send")])
+
+    return [FakeElement("Edit", "Search or start new chat"), FakeElement("ListItem", "Mom", on_click=open_chat),
+            FakeElement("ListItem", "Dad", on_click=open_chat), *_filler("WhatsApp")]
+
+
+APPS = {
+    "notepad": ("Untitled - Notepad", notepad_elements),
+    "whatsapp": ("WhatsApp", whatsapp_elements),
+}
+
+# Objective -> the actions the scripted model answers with, in order.
+SCRIPTS = {
+    "open notepad and type hello world": [
+        ("search_and_open_app", {"app_name": "notepad"}),
+        ("GET_WINDOW_ELEMENTS", {"window_title": "Notepad"}),
+        ("INTERACT_WITH_ELEMENT", {"window_title": "Notepad", "action": "type", "element_title": "Text Editor", "value": "hello world"}),
+        ("FINISH", {"reason": "Typed hello world in Notepad."}),
+    ],
+    "search google for the weather": [
+        ("open_url", {"url": "https://www.google.com"}),
+        ("GET_WINDOW_ELEMENTS", {"window_title": "Google"}),
+        ("INTERACT_WITH_ELEMENT", {"window_title": "Google", "action": "type", "element_title": "Search", "control_type": "Edit", "value": "weather"}),
+        ("PRESS_KEY", {"window_title": "Google", "key": "enter"}),
+        ("FINISH", {"reason": "Searched Google for the weather."}),
+    ],
+    "open whatsapp and message Mom good night": [
+        ("search_and_open_app", {"app_name": "whatsapp"}),
+        ("GET_WINDOW_ELEMENTS", {"window_title": "WhatsApp"}),
+        ("INTERACT_WITH_ELEMENT", {"window_title": "WhatsApp", "action": "click", "element_title": "Mom"}),
+        ("GET_WINDOW_ELEMENTS", {"window_title": "WhatsApp"}),
+        ("INTERACT_WITH_ELEMENT", {"window_title": "WhatsApp", "action": "type", "element_title": "Type a message", "value": "good night"}),
+        ("PRESS_KEY", {"window_title": "WhatsApp", "key": "enter"}),
+        ("FINISH", {"reason": "Sent Mom 'good night' on WhatsApp."}),
+    ],
+    # The same task observed through FIND_ELEMENTS queries instead of full element lists.
+    "open whatsapp and message Dad good morning": [
+        ("search_and_open_app", {"app_name": "whatsapp"}),
+        ("FIND_ELEMENTS", {"window_title": "WhatsApp", "query": "Dad", "control_type": "ListItem"}),
+        ("INTERACT_WITH_ELEMENT", {"window_title": "WhatsApp", "action": "click", "element_title": "Dad"}),
+        ("FIND_ELEMENTS", {"window_title": "WhatsApp", "query": "type mesage"}),
+        ("INTERACT_WITH_ELEMENT", {"window_title": "WhatsApp", "action": "type", "element_title": "Type a message", "value": "good morning"}),
+        ("PRESS_KEY", {"window_title": "WhatsApp", "key": "enter"}),
+        ("FINISH", {"reason": "Sent Dad 'good morning' on WhatsApp."}),
+    ],
+    "which windows are open": [
+        ("LIST_OPEN_WINDOWS", {}),
+        ("FINISH", {"reason": "Listed the open windows."}),
+    ],
+}
+
+
+# --- Instrumentation ---
+class StepRecorder:
+    """Collects per-step timings; the model stand-in and the action runner report into it."""
+
+    def __init__(self):
+        self.steps = []
+        self.last_end = time.perf_counter()  # When the previous step's action returned.
+
+    def llm(self, seconds):
+        self.steps.append({"llm_ms": seconds * 1000, "action": None, "action_ms": 0.0, "wait_ms": 0.0, "desktop_ms": 0.0,
+                           "critical_ms": 0.0, "error": False})
+
+    def action(self, action, seconds, wait_seconds, desktop_seconds, observation):
+        step = self.steps[-1]
+        step.update(action=action, action_ms=seconds * 1000, wait_ms=wait_seconds * 1000, desktop_ms=desktop_seconds * 1000,
+                    error="Error" in observation)
+        self.end_step()
+
+    def end_step(self):
+        now = time.perf_counter()
+        if self.steps:
+            self.steps[-1]["critical_ms"] = (now - self.last_end) * 1000
+        self.last_end = now
+
+
+class ScriptedAgentModel:
+    """
+    Stands in for local_llm_handler.get_agentic_action_json: answers with the objective's next scripted
+    action after `base_seconds` plus `seconds_per_1k_tokens` of simulated prefill for the part of the prompt
+    not already in the task's prefix cache. prefill() stands in for prefill_agent_prompt; like the agent
+    scheduler, it runs one request at a time.
+    """
+
+    def __init__(self, script, recorder, base_seconds, seconds_per_1k_tokens):
+        self.script = script
+        self.recorder = recorder
+        self.base_seconds = base_seconds
+        self.seconds_per_1k_tokens = seconds_per_1k_tokens
+        self.calls = 0
+        self.cached_text = ""  # What the simulated session cache covers.
+        self.lock = threading.Lock()
+        self.ahead_seconds = 0.0
+
+    def _prefill(self, text):
+        uncached = text[len(os.path.commonprefix([self.cached_text, text])):]
+        time.sleep(self.seconds_per_1k_tokens * estimate_tokens(uncached) / 1000)
+        self.cached_text = text
+        return estimate_tokens(uncached)
+
+    def __call__(self, context, session_id=None, toolkit=None):
+        start = time.perf_counter()
+        prompt = local_llm_handler.build_agent_prompt(context)
+        with self.lock:
+            self._prefill(prompt)
+            time.sleep(self.base_seconds)
+            action, args = self.script[min(self.calls, len(self.script) - 1)]
+            answer = json.dumps({"action": action, "args": args})
+            self.cached_text = prompt + answer
+            self.calls += 1
+        self.recorder.llm(time.perf_counter() - start)
+        return answer
+
+    def prefill(self, prefix_text, session_id=None):
+        start = time.perf_counter()
+        with self.lock:
+            tokens = self._prefill(prefix_text)
+        self.ahead_seconds += time.perf_counter() - start
+        return tokens
+
+
+def run_objective(objective, mode, args):
+    backend = FakeDesktopBackend(apps=APPS, launch_delay=0.0 if args.instant else args.launch_delay,
+                                 latencies=None if args.instant else SIMULATED_WINDOWS_LATENCIES)
+    set_backend(backend)
+    snapshots.invalidate()
+    indexes.invalidate()
+    prefetched.discard()
+    pool.invalidate()
+    assistant_core.AGENT_PIPELINE = mode == "pipelined"
+    prefetch_before = prefetched.stats()
+    recorder = StepRecorder()
+    model = ScriptedAgentModel(SCRIPTS[objective], recorder, args.llm_ms / 1000, args.llm_ms_per_1k_tokens / 1000)
+    execute = assistant_core._execute_action
+
+    def timed_execute(action_upper, action_args):
+        # This thread's share only: speculative reads run alongside on their own threads.
+        waited, simulated = get_thread_wait_seconds(), backend.thread_seconds[threading.get_ident()]
+        start = time.perf_counter()
+        observation = execute(action_upper, action_args)
+        recorder.action(action_upper, time.perf_counter() - start, get_thread_wait_seconds() - waited,
+                        backend.thread_seconds[threading.get_ident()] - simulated, observation)
+        return observation
+
+    local_llm_handler.get_agentic_action_json = model
+    local_llm_handler.prefill_agent_prompt = model.prefill
+    local_llm_handler.count_agent_tokens = estimate_tokens  # No tokenizer download for the benchmark.
+    local_llm_handler.count_agent_tokens_many = lambda texts: [estimate_tokens(text) for text in texts]
+    assistant_core._execute_action = timed_execute
+    output = io.StringIO()
+    try:
+        start = time.perf_counter()
+        recorder.last_end = start
+        with contextlib.redirect_stdout(output if not args.verbose else sys.stdout):
+            result = assistant_core.process_agentic_task(objective)
+        recorder.end_step()  # The FINISH step.
+        total = time.perf_counter() - start
+    finally:
+        assistant_core._execute_action = execute
+    steps = [{k: round(v, 1) if isinstance(v, float) else v for k, v in s.items()} for s in recorder.steps]
+    summary = {key: round(sum(s[key] for s in recorder.steps), 1) for key in ("llm_ms", "action_ms", "wait_ms", "desktop_ms")}
+    summary["other_ms"] = round(total * 1000 - summary["llm_ms"] - summary["action_ms"], 1)
+    prefetch = {key: prefetched.stats()[key] - prefetch_before[key] for key in ("started", "used", "late", "discarded")}
+    return {"objective": objective, "mode": mode, "result": result, "total_ms": round(total * 1000, 1), "steps": steps,
+            "errors": sum(s["error"] for s in recorder.steps), **summary,
+            "ahead_prefill_ms": round(model.ahead_seconds * 1000, 1),
+            # Simulated desktop time spent on other threads, i.e. in speculative reads.
+            "background_desktop_ms": round(backend.simulated_seconds * 1000 - summary["desktop_ms"], 1),
+            "prefetched_reads": prefetch}
+
+
+def print_report(runs):
+    print(f"{'objective / step':44} {'llm ms':>9} {'action ms':>10} {'wait ms':>9} {'desktop ms':>11} {'critical ms':>12}")
+    for run in runs:
+        print(f"{run['mode'][0]}: {run['objective'][:41]:41} {run['llm_ms']:9.0f} {run['action_ms']:10.0f} {run['wait_ms']:9.0f} "
+              f"{run['desktop_ms']:11.0f} {run['total_ms']:12.0f}{'  ERRORS: ' + str(run['errors']) if run['errors'] else ''}")
+        for i, step in enumerate(run["steps"], 1):
+            label = f"  {i}. {step['action'] or 'FINISH'}"
+            print(f"{label[:44]:44} {step['llm_ms']:9.0f} {step['action_ms']:10.0f} {step['wait_ms']:9.0f} {step['desktop_ms']:11.0f} {step['critical_ms']:12.0f}")
+        if run["mode"] == "pipelined":
+            reads = run["prefetched_reads"]
+            print(f"  off the critical path: {run['ahead_prefill_ms']:.0f} ms prefill ahead, {run['background_desktop_ms']:.0f} ms of "
+                  f"speculative reads ({reads['used']} of {reads['started']} used, {reads['late']} too late)")
+    by_mode = {}
+    for run in runs:
+        by_mode.setdefault(run["objective"], {}).setdefault(run["mode"], []).append(run["total_ms"])
+    for objective, modes in by_mode.items():
+        if "serial" in modes and "pipelined" in modes:
+            serial, pipelined = (sum(modes[m]) / len(modes[m]) for m in ("serial", "pipelined"))
+            print(f"Pipelined vs serial, {objective}: {pipelined:.0f} ms vs {serial:.0f} ms ({1 - pipelined / serial:.0%} shorter)")
+    total = sum(r["total_ms"] for r in runs) or 1
+    shares = {key: sum(r[key] for r in runs) / total for key in ("llm_ms", "action_ms", "wait_ms", "desktop_ms", "other_ms")}
+    print(f"Share of task time: LLM {shares['llm_ms']:.0%}, actions {shares['action_ms']:.0%} "
+          f"(waiting on the UI {shares['wait_ms']:.0%}, desktop calls {shares['desktop_ms']:.0%}), loop overhead {shares['other_ms']:.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-step timing of the agent loop on a simulated desktop.")
+    parser.add_argument("--objectives", help="Comma-separated subset of: " + ", ".join(SCRIPTS))
+    parser.add_argument("--llm-ms", type=float, default=400, help="Simulated time per agent model call.")
+    parser.add_argument("--llm-ms-per-1k-tokens", type=float, default=100, help="Extra simulated prefill time per 1000 prompt tokens.")
+    parser.add_argument("--launch-delay", type=float, default=SIMULATED_LAUNCH_DELAY, help="Seconds until a launched window appears.")
+    parser.add_argument("--instant", action="store_true", help="No simulated desktop latency.")
+    parser.add_argument("--modes", default="serial,pipelined", help="Comma-separated subset of: serial, pipelined.")
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="Show the agent loop's own output.")
+    parser.add_argument("--output", help="Also append the JSON results to this file.")
+    args = parser.parse_args()
+
+    assistant_core.plans = PlanCache(path="", max_plans=0)  # Measure the model-driven loop, not plan replays.
+    objectives = [o.strip() for o in args.objectives.split(",")] if args.objectives else list(SCRIPTS)
+    modes = [m.strip() for m in args.modes.split(",")]
+    runs = [run_objective(objective, mode, args) for _ in range(args.repeats) for objective in objectives for mode in modes]
+    print_report(runs)
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"benchmark": "agent_loop", "llm_ms": args.llm_ms, "instant": args.instant, "runs": runs}) + "\n")
+    return 1 if any(r["errors"] for r in runs) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
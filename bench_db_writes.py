@@ -0,0 +1,140 @@
+# --- bench_db_writes.py ---
+# Load test for the chat persistence path: concurrent simulated streams against a scratch SQLite file.
+# Each stream reads its recent history, "streams" for a while, then writes the turn. The "legacy" mode
+# reproduces the old write path (rollback journal, a commit for the user message and another for the
+# reply); "tuned" uses webapp's WAL engine settings and save_turn(). Prints commits/sec, per-turn write
+# latency percentiles and "database is locked" failures for each mode.
+#
+#   python bench_db_writes.py --streams 16 --turns 25 --stream-ms 20 --output bench_output.txt
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+import webapp
+from webapp import db, User, Conversation, Message
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def make_engine(path, mode):
+    url = f"sqlite:///{path}"
+    if mode == "legacy":
+        return create_engine(url, connect_args={"check_same_thread": False})
+    engine = create_engine(url, **webapp.SQLITE_ENGINE_OPTIONS)
+    webapp.apply_sqlite_pragmas(engine)
+    return engine
+
+
+def write_turn_legacy(session, convo_id, command, response_text):
+    session.add(Message(sender='user', text=command, conversation_id=convo_id))
+    session.commit()
+    session.add(Message(sender='assistant', text=response_text, is_long=len(response_text.split()) > 15, conversation_id=convo_id))
+    convo = session.get(Conversation, convo_id)
+    if convo and convo.title == 'New Chat' and command:
+        convo.title = command[:50]
+    session.commit()
+
+
+def run_mode(mode, streams, turns, stream_seconds, history):
+    workdir = tempfile.mkdtemp(prefix="jarvis-db-bench-")
+    engine = make_engine(os.path.join(workdir, "bench.db"), mode)
+    db.metadata.create_all(engine)
+    with Session(engine) as session:
+        user = User(email="bench@example.com", password_hash="-")
+        session.add(user)
+        session.flush()
+        convos = [Conversation(user_id=user.id) for _ in range(streams)]
+        session.add_all(convos)
+        session.commit()
+        convo_ids = [c.id for c in convos]
+
+    latencies, errors, commits = [], [], [0]
+    lock = threading.Lock()
+    reply = "This is a simulated assistant reply with enough words to count as a long answer. " * 3
+
+    def stream(convo_id):
+        rng = random.Random(convo_id)
+        for turn in range(turns):
+            command = f"question {turn} for conversation {convo_id}"
+            try:
+                with Session(engine) as session:
+                    session.query(Message).filter_by(conversation_id=convo_id).order_by(Message.id.desc()).limit(history).all()
+                time.sleep(stream_seconds * rng.uniform(0.5, 1.5))
+                start = time.perf_counter()
+                with Session(engine) as session:
+                    if mode == "legacy":
+                        write_turn_legacy(session, convo_id, command, reply)
+                    else:
+                        webapp.save_turn(convo_id, command, command, reply, session=session)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+                    commits[0] += 2 if mode == "legacy" else 1
+            except OperationalError as e:
+                with lock:
+                    errors.append(str(e.orig))
+
+    threads = [threading.Thread(target=stream, args=(cid,)) for cid in convo_ids]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    engine.dispose()
+
+    return {
+        "mode": mode,
+        "streams": streams,
+        "turns": len(latencies),
+        "commits": commits[0],
+        "commits_per_second": round(commits[0] / wall, 1),
+        "turns_per_second": round(len(latencies) / wall, 1),
+        "write_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "write_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "write_max_ms": round(max(latencies, default=0) * 1000, 2),
+        "locked_errors": sum("locked" in e for e in errors),
+        "other_errors": sum("locked" not in e for e in errors),
+        "wall_seconds": round(wall, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent chat-turn write benchmark for the webapp's SQLite database.")
+    parser.add_argument("--streams", type=int, default=16, help="Concurrent simulated chat streams.")
+    parser.add_argument("--turns", type=int, default=25, help="Turns per stream.")
+    parser.add_argument("--stream-ms", type=float, default=20, help="Average simulated generation time per turn.")
+    parser.add_argument("--history", type=int, default=webapp.CHAT_HISTORY_MESSAGES, help="Messages read per turn.")
+    parser.add_argument("--modes", default="legacy,tuned", help="Comma-separated modes to run.")
+    parser.add_argument("--output", help="Also append the JSON results to this file.")
+    args = parser.parse_args()
+
+    results = []
+    for mode in args.modes.split(","):
+        print(f">>> Running {mode}: {args.streams} streams x {args.turns} turns")
+        result = run_mode(mode.strip(), args.streams, args.turns, args.stream_ms / 1000, args.history)
+        print(json.dumps(result))
+        results.append(result)
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"benchmark": "db_writes", "results": results}) + "\n")
+    return 0 if all(r["locked_errors"] == 0 for r in results if r["mode"] == "tuned") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
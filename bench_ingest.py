@@ -0,0 +1,159 @@
+# --- bench_ingest.py ---
+# File-command benchmark over large generated text files. Each case runs in a child process, so its peak
+# RSS is its own: "stream" is assistant_core.process_file_command (windowed reads, incremental chunks),
+# "naive" reads and decodes the whole file before chunking it the same way. A fake chat model stands in for
+# the real one (--llm-ms per call), so the numbers are the pipeline's own: throughput and memory growth.
+# A needle sentence in the middle of each file checks that questions are answered from the right chunk.
+#
+#   python bench_ingest.py --sizes-mb 100,400 --output bench_output.txt
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+
+NEEDLE = "The maintenance password for the Kestrel pumping station is 4417-amber."
+QUESTION = "What is the maintenance password for the Kestrel pumping station?"
+WORDS = ("pump valve pressure station river flow report meter gauge north south basin level sensor reading "
+         "operator shift alarm check weekly monthly filter intake outlet reservoir district crew log").split()
+
+
+# --- Input files ---
+def write_file(path, size_mb, seed=0):
+    """A text file of about `size_mb` MB: paragraphs of filler words with NEEDLE at the halfway mark."""
+    rng = random.Random(seed)
+    blocks = []
+    for _ in range(8):  # Varied 1 MB blocks, reused in a shuffled order.
+        paragraphs, size = [], 0
+        while size < 1024 * 1024:
+            paragraph = ". ".join(" ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 18))).capitalize()
+                                  for _ in range(rng.randint(2, 6))) + ".\n\n"
+            paragraphs.append(paragraph)
+            size += len(paragraph)
+        blocks.append("".join(paragraphs).encode("utf-8"))
+    with open(path, "wb") as f:
+        for i in range(size_mb):
+            if i == size_mb // 2:
+                f.write(f"{NEEDLE}\n\n".encode("utf-8"))
+            f.write(blocks[rng.randrange(len(blocks))])
+    return path
+
+
+# --- Child: one case ---
+def memory_mb(field):
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def fake_model(llm_seconds, calls):
+    def stream_chat_response(history, command):
+        calls.append(len(command))
+        time.sleep(llm_seconds)
+        if "Using only these excerpts" in command:
+            yield "4417-amber" if "4417-amber" in command else "I couldn't find that."
+        else:
+            yield command[-200:].split(". ", 1)[-1]
+    return stream_chat_response
+
+
+def naive_process(assistant_core, file_ingest, path, command):
+    """The pre-streaming approach: the whole file in memory, then chunked by slicing."""
+    with open(path, "rb") as f:
+        text = f.read().decode("utf-8", errors="replace")
+    chunks = [text[i:i + file_ingest.CHUNK_CHARS] for i in range(0, len(text), file_ingest.CHUNK_CHARS)]
+    if command == "summarize":
+        stride = -(-len(chunks) // assistant_core.FILE_MAX_SUMMARIZED_CHUNKS)
+        picked = [f"Summarize:\n\n{c}" for c in chunks[::stride]]
+        summaries = []
+        for start in range(0, len(picked), assistant_core.FILE_SUMMARY_BATCH):
+            summaries += assistant_core._ask_chat_model(picked[start:start + assistant_core.FILE_SUMMARY_BATCH])
+        return assistant_core._ask_chat_model(["\n".join(summaries)])[0]
+    terms = file_ingest.query_terms(QUESTION)
+    best = sorted(range(len(chunks)), key=lambda i: -file_ingest.relevance(chunks[i], terms))[:assistant_core.FILE_ANSWER_CHUNKS]
+    return assistant_core._ask_chat_model([f"Using only these excerpts: {' '.join(chunks[i] for i in best)}"])[0]
+
+
+def run_case(mode, path, command, llm_ms):
+    os.environ.setdefault("JARVIS_RESPONSE_CACHE", "")
+    os.environ.setdefault("JARVIS_PLAN_CACHE", "")
+    import assistant_core
+    import file_ingest
+
+    calls = []
+    assistant_core.local_llm_handler.stream_chat_response = fake_model(llm_ms / 1000, calls)
+    baseline = memory_mb("VmRSS")
+    events = []
+    start = time.perf_counter()
+    if mode == "stream":
+        result = assistant_core.process_file_command(path, "summarize" if command == "summarize" else QUESTION, on_event=events.append)
+    else:
+        result = naive_process(assistant_core, file_ingest, path, command)
+    elapsed = time.perf_counter() - start
+    size_mb = os.path.getsize(path) / (1024 * 1024)
+    peak = memory_mb("VmHWM")
+    return {
+        "mode": mode,
+        "command": command,
+        "file_mb": round(size_mb, 1),
+        "seconds": round(elapsed, 2),
+        "mb_per_second": round(size_mb / elapsed, 1),
+        "peak_rss_growth_mb": round(peak - baseline, 1) if peak and baseline else None,
+        "model_calls": len(calls),
+        "partial_events": sum(e["type"] == "partial" for e in events),
+        "answer_correct": ("4417-amber" in result) if command == "question" else None,
+    }
+
+
+# --- Parent ---
+def main():
+    parser = argparse.ArgumentParser(description="Streaming file ingestion: throughput and memory vs. file size.")
+    parser.add_argument("--sizes-mb", default="100,400", help="Comma-separated generated file sizes.")
+    parser.add_argument("--modes", default="stream,naive")
+    parser.add_argument("--commands", default="summarize,question")
+    parser.add_argument("--llm-ms", type=float, default=0, help="Simulated time per chat model call.")
+    parser.add_argument("--dir", help="Where to write the generated files (default: a temporary directory).")
+    parser.add_argument("--output", help="Also append the JSON results to this file.")
+    parser.add_argument("--case", nargs=3, metavar=("MODE", "PATH", "COMMAND"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.case:
+        print(json.dumps(run_case(*args.case, args.llm_ms)))
+        return 0
+
+    workdir = args.dir or tempfile.mkdtemp(prefix="jarvis-ingest-bench-")
+    results = []
+    for size_mb in [int(n) for n in args.sizes_mb.split(",")]:
+        path = os.path.join(workdir, f"input-{size_mb}mb.txt")
+        if not os.path.exists(path):
+            print(f">>> Writing {size_mb} MB test file")
+            write_file(path, size_mb)
+        for command in args.commands.split(","):
+            for mode in args.modes.split(","):
+                child = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", mode, path, command,
+                                        "--llm-ms", str(args.llm_ms)], capture_output=True, text=True)
+                lines = [line for line in child.stdout.splitlines() if line.startswith("{")]
+                if child.returncode or not lines:
+                    print(f"ERROR: {mode}/{command} on {size_mb} MB failed:\n{child.stderr[-2000:]}")
+                    continue
+                result = json.loads(lines[-1])
+                print(json.dumps(result))
+                results.append(result)
+        if not args.dir:
+            os.remove(path)
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"benchmark": "ingest", "llm_ms": args.llm_ms, "results": results}) + "\n")
+    return 0 if all(r["answer_correct"] is not False for r in results if r["mode"] == "stream") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
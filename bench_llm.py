@@ -0,0 +1,300 @@
+# --- bench_llm.py ---
+# Inference microbenchmark for local_llm_handler. Runs offline on CPU: a small randomly-initialized Gemma
+# (the architecture of the real agent and chat models) and a BPE tokenizer trained on the spot are installed
+# in the model registry, then get_agentic_action_json() and stream_chat_response() are timed across prompt
+# lengths and concurrent batch sizes. Reports time to first token, decode tokens/sec, prefill time by prompt
+# length and peak RSS as JSON, and can compare a run against a saved baseline.
+#
+#   python bench_llm.py --output bench_llm.json
+#   python bench_llm.py --baseline bench_llm.json --threshold 0.15     (exits 1 on a regression)
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import threading
+import statistics
+
+os.environ.setdefault("JARVIS_PLAN_CACHE", "")
+os.environ.setdefault("JARVIS_RESPONSE_CACHE", "")
+
+import torch
+from tokenizers import Tokenizer, models, trainers, pre_tokenizers, decoders
+from transformers import GemmaConfig, GemmaForCausalLM, PreTrainedTokenizerFast
+
+import local_llm_handler
+from agent_context import AgentContext
+from assistant_core import TOOLKIT
+
+CHAT_TEMPLATE = ("{% for m in messages %}<start_of_turn>{{ 'model' if m['role'] == 'model' else 'user' }}\n{{ m['content'] }}<end_of_turn>\n"
+                 "{% endfor %}{% if add_generation_prompt %}<start_of_turn>model\n{% endif %}")
+# Metrics where a larger value is a regression; every other compared metric regresses by shrinking.
+LOWER_IS_BETTER = {"time_to_first_token_ms", "prefill_ms", "latency_ms", "peak_rss_mb"}
+HIGHER_IS_BETTER = {"tokens_per_second"}
+WORDS = ("window button click open search chrome notepad file edit view help settings message send contact "
+         "the a of to and in for on with desktop agent action result element title type enabled visible").split()
+
+
+# --- Tiny model ---
+def build_tokenizer(vocab_size, seed):
+    rng = random.Random(seed)
+    corpus = [json.dumps({"action": name, "args": {arg: rng.choice(WORDS) for arg in args}}) for name, args in TOOLKIT.items()] * 20
+    corpus += [f"Type: '{rng.choice(['Button', 'Edit', 'Text', 'ListItem'])}', Title: '{rng.choice(WORDS).title()} {rng.randint(0, 999)}'" for _ in range(2000)]
+    corpus += [" ".join(rng.choice(WORDS) for _ in range(30)) for _ in range(2000)]
+    tokenizer = Tokenizer(models.BPE(unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    specials = ["<pad>", "<eos>", "<bos>", "<unk>", "<start_of_turn>", "<end_of_turn>"]
+    trainer = trainers.BpeTrainer(vocab_size=vocab_size, special_tokens=specials, initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    tokenizer.train_from_iterator(corpus, trainer)
+    wrapped = PreTrainedTokenizerFast(tokenizer_object=tokenizer, pad_token="<pad>", eos_token="<eos>", bos_token="<bos>", unk_token="<unk>")
+    wrapped.chat_template = CHAT_TEMPLATE
+    return wrapped
+
+
+def build_model(tokenizer, args):
+    torch.manual_seed(args.seed)
+    config = GemmaConfig(
+        vocab_size=len(tokenizer), hidden_size=args.hidden_size, intermediate_size=args.hidden_size * 4,
+        num_hidden_layers=args.layers, num_attention_heads=args.heads, num_key_value_heads=1,
+        head_dim=args.hidden_size // args.heads, max_position_embeddings=8192,
+        eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id, bos_token_id=tokenizer.bos_token_id,
+    )
+    return GemmaForCausalLM(config).eval()
+
+
+# --- Memory ---
+def reset_peak_rss():
+    """Resets the kernel's peak-RSS mark (Linux); elsewhere the peak is process-wide."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        return None
+
+
+# --- Prompts of a given length ---
+def agent_context(tokenizer, prompt_tokens, seed):
+    """An AgentContext whose rendered agent prompt is about `prompt_tokens` long."""
+    rng = random.Random(seed)
+    context = AgentContext("open notepad and type hello", budget=10 ** 9, recent_steps=10 ** 6)
+    count = lambda: len(tokenizer(local_llm_handler.build_agent_prompt(context))["input_ids"])
+    while count() < prompt_tokens:
+        lines = [f"Type: '{rng.choice(['Button', 'Edit', 'Text'])}', Title: '{rng.choice(WORDS).title()} {rng.randint(0, 99)}'" for _ in range(8)]
+        context.add_step("GET_WINDOW_ELEMENTS", {"window_title": "Notepad"}, "\n".join(lines))
+    return context
+
+
+def chat_prompt(tokenizer, history):
+    return tokenizer.apply_chat_template([{"role": m["role"], "content": m["parts"][0]} for m in history], tokenize=False, add_generation_prompt=True)
+
+
+def chat_history(tokenizer, prompt_tokens, seed):
+    """A conversation, ending with a user message, whose chat prompt is about `prompt_tokens` long."""
+    rng = random.Random(seed)
+    history = []
+    while (not history or history[-1]["role"] != "user"
+           or len(tokenizer(chat_prompt(tokenizer, history), add_special_tokens=False)["input_ids"]) < prompt_tokens):
+        role = "user" if len(history) % 2 == 0 else "model"
+        history.append({"role": role, "parts": [" ".join(rng.choice(WORDS) for _ in range(24))]})
+    return history
+
+
+# --- Measurements ---
+def measure_prefill(model, tokenizer, text, batch_size):
+    ids = tokenizer(text)["input_ids"]
+    input_ids = torch.tensor([ids] * batch_size)
+    with torch.no_grad():
+        start = time.perf_counter()
+        model(input_ids=input_ids, use_cache=True)
+        return (time.perf_counter() - start) * 1000, len(ids)
+
+
+def run_concurrently(batch_size, call):
+    """Starts `batch_size` calls together, so the scheduler can batch them; returns their results."""
+    results = [None] * batch_size
+    barrier = threading.Barrier(batch_size)
+
+    def worker(i):
+        barrier.wait()
+        results[i] = call(i)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(batch_size)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def bench_agent(model, tokenizer, prompt_tokens, batch_size, args):
+    contexts = [agent_context(tokenizer, prompt_tokens, args.seed + i) for i in range(batch_size)]
+    toolkit = TOOLKIT if args.constrained else None
+
+    def call(i):
+        start = time.perf_counter()
+        answer = local_llm_handler.get_agentic_action_json(contexts[i], toolkit=toolkit)
+        return time.perf_counter() - start, len(tokenizer(answer, add_special_tokens=False)["input_ids"])
+
+    timings = run_concurrently(batch_size, call)
+    latency = max(t for t, _ in timings)
+    new_tokens = sum(n for _, n in timings)
+    return latency, new_tokens, None
+
+
+def bench_chat(model, tokenizer, prompt_tokens, batch_size, args):
+    histories = [chat_history(tokenizer, prompt_tokens, args.seed + i) for i in range(batch_size)]
+
+    def call(i):
+        start = time.perf_counter()
+        first, text = None, ""
+        for chunk in local_llm_handler.stream_chat_response(histories[i], histories[i][-1]["parts"][0]):
+            if first is None:
+                first = time.perf_counter() - start
+            text += chunk
+        return time.perf_counter() - start, len(tokenizer(text, add_special_tokens=False)["input_ids"]), first
+
+    timings = run_concurrently(batch_size, call)
+    latency = max(t for t, _, _ in timings)
+    new_tokens = sum(n for _, n, _ in timings)
+    return latency, new_tokens, statistics.median(f for _, _, f in timings if f is not None)
+
+
+def prompt_text(path, tokenizer, prompt_tokens, seed):
+    if path == "agent":
+        return local_llm_handler.build_agent_prompt(agent_context(tokenizer, prompt_tokens, seed))
+    return chat_prompt(tokenizer, chat_history(tokenizer, prompt_tokens, seed))
+
+
+def run_case(path, model, tokenizer, prompt_tokens, batch_size, args):
+    bench = bench_agent if path == "agent" else bench_chat
+    bench(model, tokenizer, prompt_tokens, batch_size, args)  # Warm-up.
+    reset_peak_rss()
+    runs = [bench(model, tokenizer, prompt_tokens, batch_size, args) for _ in range(args.repeats)]
+    prefill_ms, actual_tokens = measure_prefill(model, tokenizer, prompt_text(path, tokenizer, prompt_tokens, args.seed), batch_size)
+    latency = statistics.median(r[0] for r in runs)
+    new_tokens = statistics.median(r[1] for r in runs)
+    first_token = statistics.median(r[2] for r in runs) if path == "chat" else None
+    # Agent answers aren't streamed: their first token costs about one prefill.
+    ttft = first_token * 1000 if first_token is not None else prefill_ms
+    decode_seconds = latency - ttft / 1000
+    return {
+        "path": path,
+        "prompt_tokens": actual_tokens,
+        "target_prompt_tokens": prompt_tokens,
+        "batch_size": batch_size,
+        "new_tokens": new_tokens,
+        "latency_ms": round(latency * 1000, 1),
+        "time_to_first_token_ms": round(ttft, 1),
+        "prefill_ms": round(prefill_ms, 1),
+        "tokens_per_second": round(new_tokens / decode_seconds, 1) if decode_seconds > 0 else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+# --- Baseline comparison ---
+def case_key(result):
+    return result["path"], result["target_prompt_tokens"], result["batch_size"]
+
+
+def compare(results, baseline, threshold):
+    """Regressions beyond `threshold` (a fraction) against the baseline's matching cases."""
+    previous = {case_key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get(case_key(result))
+        if old is None:
+            continue
+        for metric in sorted(LOWER_IS_BETTER | HIGHER_IS_BETTER):
+            new_value, old_value = result.get(metric), old.get(metric)
+            if not new_value or not old_value:
+                continue
+            change = (new_value - old_value) / old_value
+            if (metric in LOWER_IS_BETTER and change > threshold) or (metric in HIGHER_IS_BETTER and change < -threshold):
+                regressions.append({"case": case_key(result), "metric": metric, "baseline": old_value, "current": new_value, "change": round(change, 3)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time local_llm_handler's agent and chat paths on a tiny random Gemma.")
+    parser.add_argument("--paths", default="agent,chat")
+    parser.add_argument("--prompt-tokens", default="256,512,1024", help="Comma-separated target prompt lengths.")
+    parser.add_argument("--batch-sizes", default="1,4", help="Comma-separated numbers of concurrent requests.")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per case (the median is reported).")
+    parser.add_argument("--agent-new-tokens", type=int, default=local_llm_handler.AGENT_MAX_NEW_TOKENS)
+    parser.add_argument("--chat-new-tokens", type=int, default=64)
+    parser.add_argument("--unconstrained", dest="constrained", action="store_false", help="Decode agent actions without the TOOLKIT grammar.")
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--heads", type=int, default=4)
+    parser.add_argument("--vocab-size", type=int, default=4096, help="Target tokenizer vocabulary (the corpus may yield fewer).")
+    parser.add_argument("--threads", type=int, help="torch intra-op threads.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON results here.")
+    parser.add_argument("--baseline", help="Earlier --output file to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Allowed relative slowdown before a metric counts as regressed.")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    local_llm_handler.AGENT_MAX_NEW_TOKENS = args.agent_new_tokens
+    local_llm_handler.CHAT_MAX_NEW_TOKENS = args.chat_new_tokens
+    tokenizer = build_tokenizer(args.vocab_size, args.seed)
+    model = build_model(tokenizer, args)
+    local_llm_handler.registry.install("agent", model, tokenizer)
+    local_llm_handler.registry.install("chat", model, tokenizer)
+    print(f">>> Tiny Gemma: {sum(p.numel() for p in model.parameters()) / 1e6:.1f}M parameters, vocabulary {len(tokenizer)}, {torch.get_num_threads()} threads")
+
+    results = []
+    for path in args.paths.split(","):
+        for prompt_tokens in [int(n) for n in args.prompt_tokens.split(",")]:
+            for batch_size in [int(n) for n in args.batch_sizes.split(",")]:
+                result = run_case(path, model, tokenizer, prompt_tokens, batch_size, args)
+                print(json.dumps(result), flush=True)
+                results.append(result)
+
+    report = {
+        "benchmark": "llm",
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {"python": platform.python_version(), "torch": torch.__version__, "platform": platform.platform(), "threads": torch.get_num_threads()},
+        "model": {"hidden_size": args.hidden_size, "layers": args.layers, "heads": args.heads, "vocabulary": len(tokenizer),
+                  "constrained_agent": args.constrained, "agent_new_tokens": args.agent_new_tokens, "chat_new_tokens": args.chat_new_tokens},
+        "scheduler": local_llm_handler.get_scheduler_stats(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+        print(f"INFO: Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for r in regressions:
+            print(f"ERROR: Regression in {r['case']}: {r['metric']} {r['baseline']} -> {r['current']} ({r['change']:+.0%})")
+        if regressions:
+            return 1
+        print(f"INFO: No regressions beyond {args.threshold:.0%} against {args.baseline}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
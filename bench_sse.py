@@ -0,0 +1,237 @@
+# --- bench_sse.py ---
+# Concurrent SSE connections vs. server memory, for the Flask (thread per stream) and ASGI serving modes.
+# Each mode runs in a child server process with a scratch database, a logged-in user and a fake chat
+# model that streams a word every --token-ms. Two scenarios are measured per connection count:
+#   idle  - N EventSources parked on a running agent job's stream (what a browser tab left open costs)
+#   chat  - N simultaneous /stream-command replies (time to first chunk, total time)
+# Server RSS and thread counts come from /proc, so they are reported on Linux only.
+#
+#   python bench_sse.py --connections 100,500,1000 --modes flask,asgi --output bench_output.txt
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import http.client
+import urllib.parse
+
+BENCH_EMAIL = "bench@example.com"
+BENCH_PASSWORD = "bench"
+OPEN_BATCH = 50  # Connections opened at once, so the dev server's listen backlog doesn't overflow.
+
+
+def raise_file_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+# --- Server side ---
+def serve(mode, port, info_file, tokens, token_ms):
+    """Child process: a webapp with a fake chat model, a user, a conversation and a job that runs until cancelled."""
+    raise_file_limit()
+    os.environ["JARVIS_SERVER"] = mode
+    import webapp
+    import agent_jobs
+    import assistant_core
+    from werkzeug.security import generate_password_hash
+
+    def fake_stream(history, command, use_cache=True):
+        for i in range(tokens):
+            time.sleep(token_ms / 1000)
+            yield f"word{i} "
+
+    assistant_core.stream_simple_command = fake_stream
+    webapp.create_database_if_needed()
+    with webapp.app.app_context():
+        user = webapp.User(email=BENCH_EMAIL, password_hash=generate_password_hash(BENCH_PASSWORD, method='pbkdf2:sha256'))
+        webapp.db.session.add(user)
+        webapp.db.session.flush()
+        convo = webapp.Conversation(user_id=user.id)
+        webapp.db.session.add(convo)
+        webapp.db.session.commit()
+        user_id, convo_id = user.id, convo.id
+    job = agent_jobs.jobs.submit(user_id, "idle", lambda job: job.cancel_event.wait() and "Task cancelled.")
+    with open(info_file, "w") as f:
+        json.dump({"job_id": job.id, "conversation_id": convo_id}, f)
+    webapp.run_server(host="127.0.0.1", port=port)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def process_status(pid):
+    """(RSS in MB, thread count) from /proc, or (None, None) elsewhere."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f)
+        return round(int(fields["VmRSS"].split()[0]) / 1024, 1), int(fields["Threads"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def start_server(mode, args, env, workdir):
+    port = free_port()
+    info_file = os.path.join(workdir, "server.json")
+    with open(os.path.join(workdir, "server.log"), "w") as log:
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", mode, "--port", str(port),
+                                   "--info-file", info_file, "--tokens", str(args.tokens), "--token-ms", str(args.token_ms)],
+                                  stdout=log, stderr=subprocess.STDOUT, env=env)
+    deadline = time.time() + 120
+    while time.time() < deadline and server.poll() is None:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            with open(info_file) as f:
+                return server, port, json.load(f)
+        except (OSError, ValueError):
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"The {mode} server didn't start; see {workdir}/server.log")
+
+
+def login(port):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    body = urllib.parse.urlencode({"email": BENCH_EMAIL, "password": BENCH_PASSWORD})
+    conn.request("POST", "/login", body, {"Content-Type": "application/x-www-form-urlencoded"})
+    response = conn.getresponse()
+    cookies = [v.split(";", 1)[0] for k, v in response.getheaders() if k.lower() == "set-cookie"]
+    conn.close()
+    return "; ".join(cookies)
+
+
+# --- Client side ---
+async def open_stream(port, path, cookie):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nCookie: {cookie}\r\nAccept: text/event-stream\r\n\r\n".encode())
+    await writer.drain()
+    status = await reader.readline()
+    while (await reader.readline()) not in (b"\r\n", b""):
+        pass
+    return reader, writer, status
+
+
+async def open_many(n, opener):
+    streams = []
+    for start in range(0, n, OPEN_BATCH):
+        streams += await asyncio.gather(*(opener() for _ in range(min(OPEN_BATCH, n - start))))
+    return streams
+
+
+async def idle_scenario(server, port, cookie, job_id, n):
+    before_rss, before_threads = process_status(server.pid)
+    streams = await open_many(n, lambda: open_stream(port, f"/api/jobs/{job_id}/stream", cookie))
+    await asyncio.sleep(1)
+    rss, threads = process_status(server.pid)
+    ok = sum(b" 200 " in status for _, _, status in streams)
+    for _, writer, _ in streams:
+        writer.close()
+    await asyncio.sleep(1)
+    return {"scenario": "idle", "connections": n, "open": ok, "rss_mb": rss, "threads": threads,
+            "kb_per_connection": round((rss - before_rss) * 1024 / max(ok, 1), 1) if rss and before_rss else None,
+            "baseline_rss_mb": before_rss, "baseline_threads": before_threads}
+
+
+async def chat_scenario(server, port, cookie, convo_id, n):
+    path = f"/stream-command?{urllib.parse.urlencode({'command': 'hello', 'conversation_id': convo_id})}"
+    peak = {"rss_mb": 0, "threads": 0}
+    sampling = True
+
+    async def sample():
+        while sampling:
+            rss, threads = process_status(server.pid)
+            if rss:
+                peak["rss_mb"], peak["threads"] = max(peak["rss_mb"], rss), max(peak["threads"], threads)
+            await asyncio.sleep(0.1)
+
+    async def one():
+        start = time.perf_counter()
+        reader, writer, _ = await open_stream(port, path, cookie)
+        first, buffer = None, b""
+        while b"[DONE]" not in buffer:
+            data = await reader.read(4096)
+            if not data:
+                break
+            if first is None and b"data:" in data:
+                first = time.perf_counter() - start
+            buffer = buffer[-16:] + data
+        writer.close()
+        return first, time.perf_counter() - start, b"[DONE]" in buffer
+
+    sampler = asyncio.create_task(sample())
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one() for _ in range(n)))
+    wall = time.perf_counter() - start
+    sampling = False
+    await sampler
+    firsts = sorted(r[0] for r in results if r[0] is not None)
+    return {"scenario": "chat", "connections": n, "completed": sum(r[2] for r in results), "wall_seconds": round(wall, 2),
+            "first_chunk_p50_ms": round(firsts[len(firsts) // 2] * 1000, 1) if firsts else None,
+            "first_chunk_p99_ms": round(firsts[int(0.99 * (len(firsts) - 1))] * 1000, 1) if firsts else None,
+            "peak_rss_mb": peak["rss_mb"] or None, "peak_threads": peak["threads"] or None}
+
+
+def run_mode(mode, args):
+    workdir = tempfile.mkdtemp(prefix="jarvis-sse-bench-")
+    env = dict(os.environ, JARVIS_DATABASE=os.path.join(workdir, "bench.db"), JARVIS_PLAN_CACHE="",
+               JARVIS_RESPONSE_CACHE="", JARVIS_MAX_ACTIVE_JOBS="1000")
+    server, port, info = start_server(mode, args, env, workdir)
+    results = []
+    try:
+        cookie = login(port)
+        for n in args.connections:
+            for scenario in args.scenarios:
+                if scenario == "idle":
+                    result = asyncio.run(idle_scenario(server, port, cookie, info["job_id"], n))
+                else:
+                    result = asyncio.run(chat_scenario(server, port, cookie, info["conversation_id"], n))
+                result["mode"] = mode
+                print(json.dumps(result), flush=True)
+                results.append(result)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent SSE streams vs. memory for the Flask and ASGI serving modes.")
+    parser.add_argument("--connections", default="100,500", help="Comma-separated concurrent connection counts.")
+    parser.add_argument("--modes", default="flask,asgi")
+    parser.add_argument("--scenarios", default="idle,chat")
+    parser.add_argument("--tokens", type=int, default=50, help="Words per fake chat reply.")
+    parser.add_argument("--token-ms", type=float, default=20, help="Delay before each fake word.")
+    parser.add_argument("--output", help="Also append the JSON results to this file.")
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--info-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.port, args.info_file, args.tokens, args.token_ms)
+        return 0
+
+    raise_file_limit()
+    args.connections = [int(n) for n in args.connections.split(",")]
+    args.scenarios = args.scenarios.split(",")
+    results = []
+    for mode in args.modes.split(","):
+        print(f">>> Benchmarking {mode} mode")
+        results += run_mode(mode, args)
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"benchmark": "sse", "results": results}) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,423 @@
+# --- desktop_backend.py ---
+# The desktop operations action_handler relies on, behind one interface. The Windows backend drives the
+# real desktop through pywinauto (UIA) and pyautogui; the fake backend is an in-memory desktop that lets
+# the agent loop run, and be measured, on any OS.
+
+import os
+import re
+import sys
+import time
+import subprocess
+import threading
+from collections import defaultdict, namedtuple
+
+WindowInfo = namedtuple("WindowInfo", "handle title")
+# `ref` is the backend's own handle on the control, for bound_element().
+ElementInfo = namedtuple("ElementInfo", "control_type title enabled visible ref", defaults=(None,))
+
+
+class WindowsDesktopBackend:
+    """The real desktop: pywinauto's UIA backend for windows and controls, pyautogui for the keyboard."""
+
+    name = "windows"
+
+    def __init__(self):
+        from pywinauto import Desktop
+        from pywinauto.application import Application
+        import pyautogui
+        import pyperclip
+        self._Desktop = Desktop
+        self._Application = Application
+        self._pyautogui = pyautogui
+        self._pyperclip = pyperclip
+
+    # --- Windows ---
+    def list_windows(self):
+        windows = self._Desktop(backend="uia").windows()
+        return [WindowInfo(w.handle, w.window_text()) for w in windows if w.window_text() and w.is_visible()]
+
+    def foreground_handle(self):
+        import ctypes
+        return ctypes.windll.user32.GetForegroundWindow()
+
+    def find_window(self, window_title):
+        app = self._Application(backend="uia").connect(title_re=f".*{re.escape(window_title)}.*", timeout=10)
+        return app.top_window()
+
+    def window_handle(self, window):
+        return window.handle
+
+    def window_title(self, window):
+        # Straight from user32: far cheaper than a UIA round trip, and valid for any top-level window.
+        import ctypes
+        user32 = ctypes.windll.user32
+        length = user32.GetWindowTextLengthW(window.handle)
+        buffer = ctypes.create_unicode_buffer(length + 1)
+        user32.GetWindowTextW(window.handle, buffer, length + 1)
+        return buffer.value
+
+    def window_alive(self, window):
+        import ctypes
+        user32 = ctypes.windll.user32
+        return bool(user32.IsWindow(window.handle) and user32.IsWindowVisible(window.handle))
+
+    def focus_window(self, window):
+        window.set_focus()
+
+    # --- Controls ---
+    def window_elements(self, window):
+        try:
+            return list(self._cached_descendants(window))
+        except Exception:
+            # Fall back to one cross-process call per control and property.
+            return [ElementInfo(c.element_info.control_type, c.window_text(), c.is_enabled(), c.is_visible(), c)
+                    for c in window.descendants()]
+
+    def _cached_descendants(self, window):
+        """Every descendant with the properties we report, fetched in a single UIA FindAllBuildCache call."""
+        from pywinauto.uia_defines import IUIA
+        uia = IUIA()
+        client = uia.UIA_dll
+        request = uia.iuia.CreateCacheRequest()
+        for prop in (client.UIA_ControlTypePropertyId, client.UIA_NamePropertyId,
+                     client.UIA_IsEnabledPropertyId, client.UIA_IsOffscreenPropertyId):
+            request.AddProperty(prop)
+        found = window.element_info.element.FindAllBuildCache(uia.tree_scope["descendants"], uia.true_condition, request)
+        for i in range(found.Length):
+            e = found.GetElement(i)
+            yield ElementInfo(uia.known_control_type_ids.get(e.CachedControlType), e.CachedName,
+                              bool(e.CachedIsEnabled), not e.CachedIsOffscreen, e)
+
+    def find_element(self, window, title=None, control_type=None):
+        criteria = {}
+        if title: criteria['title_re'] = f"(?i).*{re.escape(title)}.*"
+        if control_type: criteria['control_type'] = control_type
+        return window.child_window(found_index=0, **criteria)
+
+    def bound_element(self, window, ref):
+        """A control read by window_elements(), wrapped directly instead of searched for again."""
+        if hasattr(ref, "click_input"):
+            return ref
+        from pywinauto.controls.uiawrapper import UIAWrapper
+        from pywinauto.uia_element_info import UIAElementInfo
+        return UIAWrapper(UIAElementInfo(ref))
+
+    def element_visible(self, element):
+        if hasattr(element, "exists"):  # A child_window() spec: resolved by walking the tree.
+            return element.exists(timeout=0) and element.wrapper_object().is_visible()
+        try:
+            return element.is_visible()
+        except Exception:
+            return False  # The control is gone.
+
+    def click_element(self, element, use_mouse=False):
+        if use_mouse:
+            coords = element.rectangle().mid_point()
+            self._pyautogui.click(coords.x, coords.y)
+        else:
+            element.click_input()
+
+    def type_into_element(self, element, text):
+        element.set_focus()
+        self._pyperclip.copy(text or "")
+        element.type_keys('^a^v', pause=0.05)
+
+    # --- Input & launching ---
+    def open_url(self, url):
+        subprocess.run(f'start "" "{url}"', shell=True, check=True)
+
+    def press_keys(self, *keys):
+        self._pyautogui.hotkey(*keys)
+
+    def write_text(self, text, interval=0.05):
+        self._pyautogui.write(text, interval=interval)
+
+
+# --- Fake Desktop ---
+# Rough per-call costs of the real backend (pywinauto UIA + pyautogui on a typical desktop), in seconds, for
+# FakeDesktopBackend(latencies=...). "element" is per control read; "keystroke" is per typed character.
+SIMULATED_WINDOWS_LATENCIES = {
+    "list_windows": 0.04,
+    "foreground": 0.001,
+    "find_window": 0.08,
+    "window_check": 0.002,
+    "focus": 0.03,
+    "elements": 0.05,
+    "element": 0.002,
+    "element_check": 0.02,
+    "click": 0.05,
+    "type": 0.04,
+    "key": 0.01,
+    "keystroke": 0.05,
+    "open_url": 0.05,
+}
+SIMULATED_LAUNCH_DELAY = 1.2  # Seconds from launching an app or URL until its window shows.
+
+
+class FakeElement:
+    def __init__(self, control_type, title="", enabled=True, visible=True, on_click=None):
+        self.control_type = control_type
+        self.title = title
+        self.enabled = enabled
+        self.visible = visible
+        self.on_click = on_click  # Called with the backend, e.g. to open a new view.
+        self.value = ""
+        self.clicks = 0
+
+
+class FakeWindow:
+    def __init__(self, handle, title, elements=()):
+        self.handle = handle
+        self.title = title
+        self.elements = list(elements)
+        self.visible = True
+        self.keys = []
+
+
+class FakeElementSpec:
+    """
+    Like pywinauto's child_window(): resolved on every use, so it sees elements that appear later, at the
+    cost of reading controls until one matches. A spec bound to one `element` only checks it is still there.
+    """
+
+    def __init__(self, window, title=None, control_type=None, element=None, simulate=None):
+        self.window = window
+        self.title = title
+        self.control_type = control_type
+        self.element = element
+        self.simulate = simulate
+
+    def resolve(self):
+        if self.element is not None:
+            return self.element if self.element in self.window.elements else None
+        read = 0
+        try:
+            for element in self.window.elements:
+                read += 1
+                if self.title and self.title.lower() not in element.title.lower():
+                    continue
+                if self.control_type and element.control_type != self.control_type:
+                    continue
+                return element
+            return None
+        finally:
+            if self.simulate:
+                self.simulate("element", read)
+
+
+class FakeDesktopBackend:
+    """
+    An in-memory desktop. `apps` maps a Start-menu search term to (window title, element factory);
+    launched windows and opened URLs appear after `launch_delay` seconds, like real ones.
+    `latencies` ({operation: seconds}, see SIMULATED_WINDOWS_LATENCIES) makes each call take as long as
+    it would on a real desktop; by default every call is instant.
+    """
+
+    name = "fake"
+    START_MENU_TITLE = "Search"
+
+    def __init__(self, apps=None, launch_delay=0.0, latencies=None):
+        self.apps = {name.lower(): spec for name, spec in (apps or {}).items()}
+        self.launch_delay = launch_delay
+        self.latencies = dict(latencies or {})
+        self.simulated_seconds = 0.0  # Time spent in simulated call latency.
+        self.thread_seconds = defaultdict(float)  # The same, by thread id, to tell concurrent callers apart.
+        self.windows = {}
+        self.foreground = None
+        self.start_menu = None
+        self.focus_before_start_menu = None
+        self.search_text = ""
+        self.lock = threading.RLock()
+        self._next_handle = 1000
+        self.element_reads = 0  # Full reads of a window's element tree.
+        self.window_scans = 0  # find_window calls, i.e. title scans of every window.
+        self.element_searches = 0  # find_element calls, i.e. control lookups that walk the tree.
+
+    def add_window(self, title, elements=(), foreground=True):
+        with self.lock:
+            self._next_handle += 1
+            window = FakeWindow(self._next_handle, title, elements)
+            self.windows[window.handle] = window
+            if foreground:
+                self.foreground = window.handle
+            return window
+
+    def close_window(self, handle):
+        with self.lock:
+            self.windows.pop(handle, None)
+            if self.foreground == handle:
+                self.foreground = next(reversed(self.windows), None)
+
+    def _launch(self, title, elements):
+        if self.launch_delay > 0:
+            threading.Timer(self.launch_delay, self.add_window, args=(title, elements)).start()
+        else:
+            self.add_window(title, elements)
+
+    def _load_in_place(self, window, title, elements):
+        def load():
+            with self.lock:
+                window.title = title
+                window.elements = list(elements)
+        if self.launch_delay > 0:
+            threading.Timer(self.launch_delay, load).start()
+        else:
+            load()
+
+    def _simulate(self, operation, count=1):
+        seconds = self.latencies.get(operation, 0.0) * count
+        if seconds > 0:
+            time.sleep(seconds)
+            with self.lock:
+                self.simulated_seconds += seconds
+                self.thread_seconds[threading.get_ident()] += seconds
+
+    # --- Windows ---
+    def list_windows(self):
+        self._simulate("list_windows")
+        with self.lock:
+            return [WindowInfo(w.handle, w.title) for w in self.windows.values() if w.visible and w.title]
+
+    def foreground_handle(self):
+        self._simulate("foreground")
+        return self.foreground
+
+    def find_window(self, window_title):
+        self._simulate("find_window")
+        with self.lock:
+            self.window_scans += 1
+            for window in reversed(list(self.windows.values())):
+                if window_title in window.title:
+                    return window
+        raise LookupError(f"No window matching '{window_title}'.")
+
+    def window_handle(self, window):
+        return window.handle
+
+    def window_title(self, window):
+        self._simulate("window_check")
+        if window.handle not in self.windows:
+            raise LookupError("Window was closed.")
+        return window.title
+
+    def window_alive(self, window):
+        self._simulate("window_check")
+        return window.handle in self.windows and window.visible
+
+    def focus_window(self, window):
+        self._simulate("focus")
+        if window.handle not in self.windows:
+            raise LookupError("Window was closed.")
+        self.foreground = window.handle
+
+    # --- Controls ---
+    def window_elements(self, window):
+        self.element_reads += 1
+        self._simulate("elements")
+        self._simulate("element", len(window.elements))
+        return [ElementInfo(e.control_type, e.title, e.enabled, e.visible, e) for e in list(window.elements)]
+
+    def find_element(self, window, title=None, control_type=None):
+        self.element_searches += 1
+        return FakeElementSpec(window, title, control_type, simulate=self._simulate)
+
+    def bound_element(self, window, ref):
+        return FakeElementSpec(window, element=ref)
+
+    def element_visible(self, element):
+        self._simulate("element_check")
+        resolved = element.resolve()
+        return bool(resolved and resolved.visible)
+
+    def click_element(self, element, use_mouse=False):
+        self._simulate("click")
+        resolved = element.resolve()
+        if resolved is None:
+            raise LookupError("Element not found.")
+        resolved.clicks += 1
+        if resolved.on_click:
+            resolved.on_click(self)
+
+    def type_into_element(self, element, text):
+        self._simulate("type")
+        resolved = element.resolve()
+        if resolved is None:
+            raise LookupError("Element not found.")
+        resolved.value = text or ""
+
+    # --- Input & launching ---
+    def open_url(self, url):
+        self._simulate("open_url")
+        domain = re.sub(r"^https?://(www\.)?", "", url).split("/")[0]
+        name = domain.split(".")[0].capitalize()
+        title, elements = f"{name} - Google Chrome", [
+            FakeElement("Edit", "Address and search bar"),
+            FakeElement("Edit", "Search"),
+            FakeElement("Button", f"{name} Search"),
+        ]
+        browser = self.windows.get(self.foreground)
+        if browser is not None and browser.title.endswith(" - Google Chrome"):
+            # A focused browser opens the URL in a new tab: the same window, retitled.
+            self._load_in_place(browser, title, elements)
+        else:
+            self._launch(title, elements)
+
+    def press_keys(self, *keys):
+        keys = tuple(k.lower() for k in keys)
+        self._simulate("key")
+        with self.lock:
+            if keys == ("win",):
+                self.focus_before_start_menu = self.foreground
+                self.start_menu = self.add_window(self.START_MENU_TITLE, [FakeElement("Edit", "Search box")])
+                self.search_text = ""
+            elif keys == ("enter",) and self.start_menu is not None:
+                self.close_window(self.start_menu.handle)
+                if self.focus_before_start_menu in self.windows:
+                    self.foreground = self.focus_before_start_menu  # Focus goes back, as on Windows.
+                self.start_menu = None
+                spec = self.apps.get(self.search_text.strip().lower())
+                if spec:
+                    title, make_elements = spec
+                    self._launch(title, make_elements())
+            elif self.foreground in self.windows:
+                self.windows[self.foreground].keys.append("+".join(keys))
+
+    def write_text(self, text, interval=0.05):
+        self._simulate("keystroke", len(text))
+        with self.lock:
+            if self.start_menu is not None:
+                self.search_text += text
+            elif self.foreground in self.windows:
+                self.windows[self.foreground].keys.append(text)
+
+
+# --- Backend Selection ---
+_backend = None
+
+
+def get_backend():
+    """
+    The active backend: JARVIS_DESKTOP_BACKEND=windows|fake, defaulting to the real desktop on Windows.
+    The fake desktop is only ever used when asked for, so a misconfigured host fails instead of
+    silently acting on a desktop that doesn't exist.
+    """
+    global _backend
+    if _backend is None:
+        kind = os.environ.get("JARVIS_DESKTOP_BACKEND") or ("windows" if sys.platform == "win32" else None)
+        if kind == "fake":
+            print("INFO: Using the in-memory fake desktop backend.")
+            _backend = FakeDesktopBackend()
+        elif kind == "windows":
+            _backend = WindowsDesktopBackend()
+        elif kind is None:
+            raise RuntimeError(f"Desktop control needs Windows (this is {sys.platform}); "
+                               "set JARVIS_DESKTOP_BACKEND=fake to use the in-memory fake desktop.")
+        else:
+            raise RuntimeError(f"Unknown JARVIS_DESKTOP_BACKEND '{kind}' (expected 'windows' or 'fake').")
+    return _backend
+
+
+def set_backend(backend):
+    """Swaps the active backend (tests and benchmarks install a FakeDesktopBackend)."""
+    global _backend
+    _backend = backend
@@ -0,0 +1,168 @@
+# --- element_index.py ---
+# In-memory index of each window's controls (by window handle), by control type, normalized title and title
+# words. It is built from the same single bulk read GET_WINDOW_ELEMENTS does, so INTERACT_WITH_ELEMENT can
+# go straight to its target instead of walking the UIA tree with a title regex on every call, and
+# FIND_ELEMENTS can hand the agent the few controls that match a query instead of the whole element list.
+
+import os
+import re
+import time
+import difflib
+import threading
+from collections import OrderedDict, defaultdict, namedtuple
+
+INDEX_TTL_SECONDS = float(os.environ.get("JARVIS_ELEMENT_INDEX_TTL", "10"))  # Never resolve from an older index.
+MAX_INDEXES = 32
+FUZZY_CUTOFF = 0.75  # How close (difflib ratio) a query word must be to a title word to count as a typo of it.
+PARTIAL_WORD_SCORE = 0.9  # A query word that is part of a title word ("msg" in "msgs") or contains one.
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+IndexedElement = namedtuple("IndexedElement", "position control_type title ref")
+
+
+def words(text):
+    return _WORD.findall((text or "").lower())
+
+
+def normalize(text):
+    """Lowercase words separated by single spaces: how titles are compared."""
+    return " ".join(words(text))
+
+
+class ElementIndex:
+    """One window's enabled, visible controls, in tree order, with lookups by type, title and title word."""
+
+    def __init__(self, handle, elements):
+        self.handle = handle
+        self.built_at = time.monotonic()
+        self.dirty = False  # Set when we interact with the window; resolved controls are re-checked anyway.
+        self.elements = []
+        self.by_type = defaultdict(list)  # Lowercase control type -> positions.
+        self.by_title = defaultdict(list)  # Normalized title -> positions.
+        self.by_word = defaultdict(list)  # Title word -> positions.
+        for info in elements:
+            if not (info.enabled and info.visible and info.control_type):
+                continue
+            element = IndexedElement(len(self.elements), info.control_type, info.title or "", info.ref)
+            self.elements.append(element)
+            self.by_type[element.control_type.lower()].append(element.position)
+            self.by_title[normalize(element.title)].append(element.position)
+            for word in dict.fromkeys(words(element.title)):
+                self.by_word[word].append(element.position)
+
+    def _of_type(self, positions, control_type):
+        wanted = control_type.lower() if control_type else None
+        return [p for p in positions if wanted is None or self.elements[p].control_type.lower() == wanted]
+
+    def resolve(self, title=None, control_type=None):
+        """
+        The control INTERACT_WITH_ELEMENT means, or None: a title equal to `title` (ignoring case and
+        punctuation) first, else the first control whose title contains it, as the title regex matched.
+        Never a fuzzy match: a click must not land on a control the agent didn't name.
+        """
+        if not title:
+            found = self.by_type.get((control_type or "").lower(), [])
+            return self.elements[found[0]] if found else None
+        key = normalize(title)
+        exact = self._of_type(self.by_title.get(key, []), control_type)
+        if exact:
+            return self.elements[exact[0]]
+        title_words = words(title)
+        if title_words:
+            # Only controls with a title word containing the query's longest word can contain the query.
+            longest = max(title_words, key=len)
+            candidates = sorted({p for word, positions in self.by_word.items() if longest in word for p in positions})
+            matches = (p for p in self._of_type(candidates, control_type) if key in normalize(self.elements[p].title))
+        else:
+            lowered = title.lower()
+            matches = (e.position for e in self.elements if lowered in e.title.lower()
+                       and (not control_type or e.control_type.lower() == control_type.lower()))
+        position = next(matches, None)
+        return self.elements[position] if position is not None else None
+
+    def _word_matches(self, word):
+        """{title word: similarity} for one query word: exact, partial, or a close (typo) match."""
+        matches = {}
+        for title_word in self.by_word:
+            if title_word == word:
+                matches[title_word] = 1.0
+            elif word in title_word or (len(title_word) >= 3 and title_word in word):
+                matches[title_word] = PARTIAL_WORD_SCORE
+        for title_word in difflib.get_close_matches(word, self.by_word, n=8, cutoff=FUZZY_CUTOFF):
+            matches.setdefault(title_word, difflib.SequenceMatcher(None, word, title_word).ratio())
+        return matches
+
+    def search(self, query, control_type=None, k=5):
+        """
+        The `k` controls that best match `query`, best first, as (score, element). A control scores the
+        average, over the query's words, of its best title-word similarity (or 1 for a word naming its control
+        type), plus 0.5 for an exact title; earlier controls win ties.
+        """
+        query_words = words(query)
+        if not query_words:
+            return [(1.0, self.elements[p]) for p in self._of_type(range(len(self.elements)), control_type)[:k]]
+        similarity = defaultdict(lambda: [0.0] * len(query_words))  # Position -> best similarity per query word.
+        for i, word in enumerate(query_words):
+            for title_word, score in self._word_matches(word).items():
+                for p in self.by_word[title_word]:
+                    row = similarity[p]
+                    row[i] = max(row[i], score)
+            for p in self.by_type.get(word, ()):  # "send button": the word names the control type.
+                similarity[p][i] = 1.0
+        key = normalize(query)
+        ranked = []
+        for p in self._of_type(similarity, control_type):
+            score = sum(similarity[p]) / len(query_words)
+            if normalize(self.elements[p].title) == key:
+                score += 0.5
+            ranked.append((-score, p))
+        ranked.sort()
+        return [(-score, self.elements[p]) for score, p in ranked[:k]]
+
+
+class IndexCache:
+    def __init__(self, ttl=INDEX_TTL_SECONDS, max_windows=MAX_INDEXES):
+        self.ttl = ttl
+        self.max_windows = max_windows
+        self.indexes = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.builds = 0
+
+    def get(self, handle, allow_dirty=False):
+        """
+        The window's index if it is recent enough, else None. Observations need `allow_dirty=False`; resolving
+        a target may use a dirty index, since the control it finds is checked on screen before use.
+        """
+        with self.lock:
+            index = self.indexes.get(handle)
+            if index is None or (index.dirty and not allow_dirty) or time.monotonic() - index.built_at > self.ttl:
+                return None
+            self.indexes.move_to_end(handle)
+            self.hits += 1
+            return index
+
+    def store(self, handle, elements):
+        """Indexes a fresh read of the window's controls and returns the index."""
+        index = ElementIndex(handle, elements)
+        with self.lock:
+            self.indexes.pop(handle, None)
+            self.indexes[handle] = index
+            self.builds += 1
+            while len(self.indexes) > self.max_windows:
+                self.indexes.popitem(last=False)
+        return index
+
+    def invalidate(self, handle=None):
+        """Marks one window's index (or all of them) as possibly out of date."""
+        with self.lock:
+            for index in (self.indexes.values() if handle is None else filter(None, [self.indexes.get(handle)])):
+                index.dirty = True
+
+    def stats(self):
+        with self.lock:
+            return {"windows": len(self.indexes), "hits": self.hits, "builds": self.builds}
+
+
+indexes = IndexCache()
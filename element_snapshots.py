@@ -0,0 +1,132 @@
+# --- element_snapshots.py ---
+# Remembers the element list last reported for each window (by window handle), so GET_WINDOW_ELEMENTS
+# can skip re-reading an unchanged window and otherwise report only what changed since the last look.
+# A "last look" belongs to one agent task (see SnapshotScope): a task never gets a diff against, or a
+# "No changes" for, a list it wasn't shown, or one its history no longer shows in full.
+
+import os
+import time
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+SNAPSHOT_TTL_SECONDS = float(os.environ.get("JARVIS_SNAPSHOT_TTL", "2"))  # Trust an untouched snapshot this long.
+MAX_SNAPSHOTS = 32
+
+
+class SnapshotScope:
+    """
+    Who is looking: `key` names the task, `position()` is the number of the step being run, and
+    `still_shown(step)` tells whether that step's observation is still in the task's history in full.
+    """
+    def __init__(self, key, position, still_shown):
+        self.key = key
+        self.position = position
+        self.still_shown = still_shown
+
+
+# Outside a scope nothing is known about what the caller has seen, so every read is a full listing.
+_active_scope = ContextVar("jarvis_snapshot_scope", default=None)
+
+
+@contextmanager
+def use_scope(scope):
+    """Makes GET_WINDOW_ELEMENTS calls in the block remember and diff against what `scope` was shown."""
+    token = _active_scope.set(scope)
+    try:
+        yield
+    finally:
+        _active_scope.reset(token)
+
+
+class WindowSnapshot:
+    def __init__(self, handle, title, lines, listed_at):
+        self.handle = handle
+        self.title = title
+        self.lines = tuple(lines)  # The formatted (already redacted) element lines, in tree order.
+        self.listed_at = listed_at  # Step whose observation had the last full listing the diffs build on.
+        self.taken_at = time.monotonic()
+        self.dirty = False  # Set when we interact with the window; the next read must re-walk it.
+
+
+class SnapshotCache:
+    def __init__(self, ttl=SNAPSHOT_TTL_SECONDS, max_windows=MAX_SNAPSHOTS):
+        self.ttl = ttl
+        self.max_windows = max_windows
+        self.snapshots = OrderedDict()  # (scope key, handle) -> WindowSnapshot
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.walks = 0
+
+    def _shown(self, handle):
+        """The current scope's snapshot of the window, if the listing it builds on is still in view."""
+        scope = _active_scope.get()
+        if scope is None:
+            return None
+        snapshot = self.snapshots.get((scope.key, handle))
+        if snapshot is None or not scope.still_shown(snapshot.listed_at):
+            return None
+        return snapshot
+
+    def fresh(self, handle):
+        """The window's snapshot if it can be reused without reading the window again, else None."""
+        with self.lock:
+            snapshot = self._shown(handle)
+            if snapshot is None or snapshot.dirty or time.monotonic() - snapshot.taken_at > self.ttl:
+                return None
+            self.snapshots.move_to_end((_active_scope.get().key, handle))
+            self.hits += 1
+            return snapshot
+
+    def baseline(self, handle):
+        """The snapshot a new read of the window may be reported as a diff against, or None for a full listing."""
+        with self.lock:
+            return self._shown(handle)
+
+    def store(self, handle, title, lines, full):
+        """Records a new read of the window; `full` says whether it was reported as the whole list."""
+        with self.lock:
+            self.walks += 1
+            scope = _active_scope.get()
+            if scope is None:
+                return
+            key = (scope.key, handle)
+            previous = self.snapshots.pop(key, None)
+            listed_at = scope.position() if full or previous is None else previous.listed_at
+            self.snapshots[key] = WindowSnapshot(handle, title, lines, listed_at)
+            while len(self.snapshots) > self.max_windows:
+                self.snapshots.popitem(last=False)
+
+    def invalidate(self, handle=None):
+        """Marks one window's snapshots (or all of them), in every scope, as needing a re-read."""
+        with self.lock:
+            for (_, snapshot_handle), snapshot in self.snapshots.items():
+                if handle is None or snapshot_handle == handle:
+                    snapshot.dirty = True
+
+    def forget(self, key):
+        """Drops a finished task's snapshots."""
+        with self.lock:
+            for stale in [k for k in self.snapshots if k[0] == key]:
+                del self.snapshots[stale]
+
+    def stats(self):
+        with self.lock:
+            return {"windows": len(self.snapshots), "hits": self.hits, "walks": self.walks}
+
+
+def diff_lines(old, new):
+    """Returns (added, removed) lines between two snapshots, treating each as a multiset, in tree order."""
+    old_counts, new_counts = Counter(old), Counter(new)
+    added, removed = [], []
+    for line in new:
+        if new_counts[line] > old_counts[line]:
+            added.append(line); old_counts[line] += 1
+    for line in old:
+        if old_counts[line] > new_counts[line]:
+            removed.append(line); new_counts[line] += 1
+    return added, removed
+
+
+snapshots = SnapshotCache()
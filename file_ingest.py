@@ -0,0 +1,117 @@
+# --- file_ingest.py ---
+# Streaming reader for uploaded text files. A file is decoded window by window (memory-mapped once it is
+# large, with each window's pages released after use) and cut into chunks at paragraph or sentence breaks,
+# so memory use depends on the window and chunk sizes, never on the file size. The chunks feed the chat
+# model in assistant_core.process_file_command.
+
+import os
+import re
+import mmap
+import codecs
+import heapq
+
+READ_BYTES = 1024 * 1024  # Decoded per window; a multiple of the page size so finished pages can be released.
+MMAP_MIN_BYTES = 8 * 1024 * 1024  # Smaller files are read with plain buffered reads.
+CHUNK_CHARS = 6000  # About 1500 tokens: leaves the chat model room for instructions and a reply.
+BINARY_SNIFF_BYTES = 8192
+
+_WORD = re.compile(r"[a-z0-9]{3,}")
+_STOPWORDS = {"the", "and", "for", "are", "was", "were", "what", "which", "who", "whom", "this", "that", "with",
+              "from", "does", "did", "how", "why", "when", "where", "about", "file", "document", "tell", "say",
+              "says", "there", "their", "have", "has", "can", "you", "please", "into", "its"}
+
+
+class UnsupportedFile(ValueError):
+    pass
+
+
+def iter_text(path, read_bytes=READ_BYTES):
+    """Yields (bytes read so far, text) windows of the file decoded as UTF-8; undecodable bytes become U+FFFD."""
+    size = os.path.getsize(path)
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    with open(path, "rb") as f:
+        if b"\0" in f.read(BINARY_SNIFF_BYTES):
+            raise UnsupportedFile("it looks like a binary file; only text files can be read")
+        f.seek(0)
+        if size < MMAP_MIN_BYTES:
+            done = 0
+            while block := f.read(read_bytes):
+                done += len(block)
+                yield done, decoder.decode(block)
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mapped, "madvise"):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                for start in range(0, size, read_bytes):
+                    text = decoder.decode(mapped[start:start + read_bytes])
+                    if hasattr(mmap, "MADV_DONTNEED"):
+                        # Read pages would otherwise stay mapped into this process until the whole file is done.
+                        mapped.madvise(mmap.MADV_DONTNEED, start, min(read_bytes, size - start))
+                    yield min(start + read_bytes, size), text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield size, tail
+
+
+def _break_point(text, start, end):
+    """Where to end a chunk in text[start:end]: the last paragraph, line, sentence or word break in its second half."""
+    floor = start + (end - start) // 2
+    for separator in ("\n\n", "\n", ". ", " "):
+        cut = text.rfind(separator, floor, end)
+        if cut != -1:
+            return cut + len(separator)
+    return end
+
+
+def iter_chunks(path, chunk_chars=CHUNK_CHARS, read_bytes=READ_BYTES):
+    """
+    Yields (index, text, fraction of the file read) for consecutive chunks of at most `chunk_chars`.
+    Only the current window and the unfinished chunk are held in memory.
+    """
+    size = os.path.getsize(path) or 1
+    buffer, index, done = "", 0, 0
+    for done, text in iter_text(path, read_bytes):
+        buffer += text
+        pos = 0
+        while len(buffer) - pos >= chunk_chars:
+            cut = _break_point(buffer, pos, pos + chunk_chars)
+            chunk = buffer[pos:cut].strip()
+            pos = cut
+            if chunk:
+                yield index, chunk, done / size
+                index += 1
+        buffer = buffer[pos:]
+    if buffer.strip():
+        yield index, buffer.strip(), 1.0
+
+
+def estimated_chunks(path, chunk_chars=CHUNK_CHARS):
+    return max(1, -(-os.path.getsize(path) // chunk_chars))
+
+
+def query_terms(question):
+    return {w for w in _WORD.findall(question.lower()) if w not in _STOPWORDS}
+
+
+def relevance(chunk, terms):
+    """How often the question's terms occur in the chunk, counting each term at most 20 times."""
+    lowered = chunk.lower()
+    return sum(min(lowered.count(term), 20) for term in terms)
+
+
+class TopChunks:
+    """The `k` most relevant chunks seen so far (earlier chunks win ties), kept in a small heap."""
+
+    def __init__(self, k):
+        self.k = k
+        self.heap = []
+
+    def offer(self, score, index, chunk):
+        item = (score, -index, chunk)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, item)
+        elif item > self.heap[0]:
+            heapq.heapreplace(self.heap, item)
+
+    def in_file_order(self):
+        return [(-neg_index, chunk) for score, neg_index, chunk in sorted(self.heap, key=lambda item: -item[1])]
@@ -0,0 +1,118 @@
+# --- inference_scheduler.py ---
+# Puts one worker thread in front of each model. Request threads submit work and wait on a Future;
+# the worker collects whatever is pending and runs it as a single padded batch, so concurrent users
+# share forward passes instead of contending for the same CPU cores. Each request's active traces travel
+# with it, so the batch's spans show up in the trace of every request it served.
+
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+import torch
+
+import tracing
+from model_common import MAX_BATCH_SIZE
+
+BATCH_WINDOW_SECONDS = int(os.environ.get("JARVIS_BATCH_WINDOW_MS", "10")) / 1000  # How long a batch waits for company.
+
+
+def left_pad(sequences, pad_token_id):
+    """Left-pads token id lists into (input_ids, attention_mask) tensors, as decoder-only generation expects."""
+    width = max(len(ids) for ids in sequences)
+    input_ids = torch.full((len(sequences), width), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(sequences), width), dtype=torch.long)
+    for row, ids in enumerate(sequences):
+        if ids:
+            input_ids[row, width - len(ids):] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[row, width - len(ids):] = 1
+    return input_ids, attention_mask
+
+
+class InferenceScheduler:
+    """
+    Runs `run_batch(requests) -> results` on a dedicated worker thread.
+    Requests with the same `batch_key` that arrive within `batch_window` of each other are batched
+    together (up to `max_batch_size`); requests with other keys wait for a later batch, in order.
+    """
+
+    def __init__(self, name, run_batch, max_batch_size=MAX_BATCH_SIZE, batch_window=BATCH_WINDOW_SECONDS):
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.batch_window = batch_window
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.worker = None
+        self.batches = 0
+        self.requests = 0
+        self.largest_batch = 0
+
+    def submit(self, request, batch_key=None):
+        future = Future()
+        with self.condition:
+            self.pending.append((batch_key, request, future, tracing.current_traces(), time.perf_counter()))
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._work, name=f"{self.name}-scheduler", daemon=True)
+                self.worker.start()
+            self.condition.notify()
+        return future
+
+    def _take(self, batch_key, batch):
+        for item in list(self.pending):
+            if len(batch) >= self.max_batch_size:
+                return
+            if item[0] == batch_key:
+                self.pending.remove(item)
+                batch.append(item)
+
+    def _next_batch(self):
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+            batch = [self.pending.popleft()]
+            batch_key = batch[0][0]
+            deadline = time.monotonic() + self.batch_window
+            while True:
+                self._take(batch_key, batch)
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.max_batch_size or remaining <= 0:
+                    return batch
+                self.condition.wait(remaining)
+
+    def _work(self):
+        while True:
+            batch = self._next_batch()
+            live = [item[1:] for item in batch if item[2].set_running_or_notify_cancel()]
+            if not live:
+                continue
+            started = time.perf_counter()
+            for _, _, traces, submitted in live:
+                with tracing.use_traces(traces):
+                    tracing.record_span("scheduler.queue", submitted, started, model=self.name)
+            batch_traces = tuple(dict.fromkeys(trace for _, _, traces, _ in live for trace in traces))
+            self.batches += 1
+            self.requests += len(live)
+            self.largest_batch = max(self.largest_batch, len(live))
+            try:
+                with tracing.use_traces(batch_traces), tracing.span("scheduler.batch", model=self.name):
+                    results = self.run_batch([request for request, _, _, _ in live])
+                for (_, future, _, _), result in zip(live, results):
+                    future.set_result(result)
+            except Exception as e:
+                print(f">>> ERROR: {self.name} batch of {len(live)} failed. {e}")
+                for _, future, _, _ in live:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def stats(self):
+        with self.condition:
+            queued = len(self.pending)
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "average_batch_size": round(self.requests / self.batches, 2) if self.batches else 0,
+            "largest_batch": self.largest_batch,
+            "queued": queued,
+        }
@@ -1,124 +1,827 @@
 # --- local_llm_handler.py (FINAL AUTH-FIXED VERSION) ---
 
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import AutoTokenizer, AutoModelForCausalLM, DynamicCache, LogitsProcessorList, StoppingCriteria, StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
 import json
 import re
-
-# --- Model & Tokenizer References ---
-agent_model = None
-agent_tokenizer = None
-chat_model = None
-chat_tokenizer = None
+import action_grammar
+import speculative
+import tracing
+from inference_scheduler import InferenceScheduler, left_pad
+# Re-exported: callers reach the shared settings and prompt builders through this module.
+from model_common import (AGENT_MODEL_ID, CHAT_MODEL_ID, CHAT_MAX_NEW_TOKENS, QUANTIZE_MODE, StreamStalled,
+                          build_agent_prompt, build_agent_prompt_prefix)
+import time
+import queue
+import threading
+import os
+import gc
+from contextlib import contextmanager
+from collections import deque, OrderedDict
 
 # --- Configuration ---
-AGENT_MODEL_ID = "sagar078/gemma-2b-desktop-agent-v1"
-CHAT_MODEL_ID = "sagar078/gemma-2b-dolly-dpo-aligned-final"
+# Model ids, CHAT_MAX_NEW_TOKENS and QUANTIZE_MODE live in model_common.
+STREAM_QUEUE_SIZE = 64  # Decoded chunks buffered between the generation thread and the SSE consumer.
+STREAM_STALL_TIMEOUT_SECONDS = 30  # A consumer that reads nothing for this long is cancelled.
+AGENT_MAX_NEW_TOKENS = 150
+AGENT_CONSTRAINED_DECODING = True  # Restrict agent output to valid TOOLKIT action JSON when a toolkit schema is given.
+# "1" verifies prompt-lookup drafts of several tokens per forward pass for single agent requests (same greedy output).
+AGENT_SPECULATIVE_DECODING = os.environ.get("JARVIS_AGENT_SPECULATIVE", "0") == "1"
+AGENT_DRAFT_HISTORY = 8  # A task's previous actions kept as draft material.
+AGENT_SESSION_CACHE_MB = 1024  # Upper bound on past key/values kept across all running agent tasks.
+# Models unused for this many seconds are unloaded (0 keeps them loaded once used).
+MODEL_IDLE_TTL_SECONDS = int(os.environ.get("JARVIS_MODEL_IDLE_TTL", "1800"))
+# Comma-separated model names ("agent", "chat") to load at startup instead of on first use.
+PRELOAD_MODELS = [name for name in os.environ.get("JARVIS_PRELOAD_MODELS", "").split(",") if name]
+QUANTIZED_DIR = "./quantized"
+QUANTIZED_MIN_AGREEMENT = 0.9  # Teacher-forced top-1 agreement with full precision required to keep an int8 model.
+ACCURACY_PROMPTS = [
+    "INSTRUCTION: You are a PC control assistant. Your goal is to achieve the following objective.\nOBJECTIVE: Open Notepad\n\nHISTORY:\nOBJECTIVE: Open Notepad\n\nJSON_RESPONSE:\n",
+    "INSTRUCTION: You are a PC control assistant. Your goal is to achieve the following objective.\nOBJECTIVE: open google.com and search for the weather\n\nHISTORY:\nAction: OPEN_URL with args {'url': 'https://www.google.com'}. Result:\n---\nSuccessfully opened URL https://www.google.com.\n---\n\nJSON_RESPONSE:\n",
+    "What is the capital of France?",
+    "Explain in one sentence what a keyboard shortcut is.",
+]
+
+# --- Per-request generation timings (most recent last) ---
+generation_stats = deque(maxlen=100)
 
 # --- PASTE YOUR HUGGING FACE "WRITE" TOKEN HERE ---
 # This is the key to solving the authentication issue.
 # Get your token from: https://huggingface.co/settings/tokens
 YOUR_HF_TOKEN = "" # Replace hf_... with your actual token
 
-# In local_llm_handler.py
 
-def initialize_models():
-    """Loads both the agent and chat models into memory, with offloading."""
-    global agent_model, agent_tokenizer, chat_model, chat_tokenizer
+class ModelSlot:
+    """One model the registry knows how to load, plus its load state and usage."""
 
-    print(">>> Initializing local LLM Brain... This may take a moment.")
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f">>> Using device: {device}")
+    def __init__(self, name, model_id, offload_folder):
+        self.name = name
+        self.model_id = model_id
+        self.offload_folder = offload_folder
+        self.model = None
+        self.tokenizer = None
+        self.in_use = 0
+        self.loads = 0
+        self.load_seconds = None
+        self.last_used = None
+        self.lock = threading.Lock()
 
-    # --- PASTE YOUR TOKEN HERE ---
-    YOUR_HF_TOKEN = "" # Your actual write token
+    @property
+    def loaded(self):
+        return self.model is not None
 
-    try:
-        # --- Load the Agent Model (The "Doer") ---
-        print(f">>> Loading Agent model: {AGENT_MODEL_ID}")
-        agent_tokenizer = AutoTokenizer.from_pretrained(
-            AGENT_MODEL_ID,
-            token=YOUR_HF_TOKEN
-        )
-        agent_model = AutoModelForCausalLM.from_pretrained(
-            AGENT_MODEL_ID,
-            torch_dtype=torch.bfloat16,
-            device_map="auto",
-            offload_folder="./offload_agent",  # <-- Add offload folder
-            token=YOUR_HF_TOKEN
-        )
-        print(">>> SUCCESS: Agent model loaded.")
 
-        # --- Load the Chat Model (The "Communicator") ---
-        print(f">>> Loading Chat model: {CHAT_MODEL_ID}")
-        chat_tokenizer = AutoTokenizer.from_pretrained(
-            CHAT_MODEL_ID,
-            token=YOUR_HF_TOKEN
-        )
-        chat_model = AutoModelForCausalLM.from_pretrained(
-            CHAT_MODEL_ID,
-            torch_dtype=torch.bfloat16,
-            device_map="auto",
-            offload_folder="./offload_chat",  # <-- Add offload folder
-            token=YOUR_HF_TOKEN
+class ModelRegistry:
+    """
+    Loads each model on first use, shares one tokenizer between models whose vocabularies match,
+    and unloads models that have been idle for longer than `idle_ttl` seconds.
+    """
+
+    def __init__(self, idle_ttl=MODEL_IDLE_TTL_SECONDS):
+        self.idle_ttl = idle_ttl
+        self.slots = {}
+        self.tokenizers = {}  # vocabulary fingerprint -> tokenizer
+        self.lock = threading.Lock()
+        self.reaper = None
+
+    def register(self, name, model_id, offload_folder=None):
+        self.slots[name] = ModelSlot(name, model_id, offload_folder)
+
+    def install(self, name, model, tokenizer):
+        """Places an already-built model in a slot (benchmarks and offline runs use this)."""
+        slot = self.slots.setdefault(name, ModelSlot(name, getattr(model, "name_or_path", name), None))
+        with slot.lock:
+            slot.model, slot.tokenizer = model, tokenizer
+            slot.last_used = time.monotonic()
+
+    @contextmanager
+    def use(self, name):
+        """Yields (model, tokenizer), loading the model first if needed. It cannot be unloaded while in use."""
+        slot = self.slots.get(name)
+        if slot is None:
+            raise ConnectionError(f"No '{name}' model is registered.")
+        with slot.lock:
+            if not slot.loaded:
+                try:
+                    self._load(slot)
+                except Exception as e:
+                    print(f">>> CRITICAL ERROR: Failed to load the {name} model. {e}")
+                    raise ConnectionError(f"{name.capitalize()} model could not be loaded: {e}")
+            slot.in_use += 1
+        try:
+            yield slot.model, slot.tokenizer
+        finally:
+            with slot.lock:
+                slot.in_use -= 1
+                slot.last_used = time.monotonic()
+
+    def tokenizer(self, name):
+        """The tokenizer of a model, without loading the model's weights."""
+        slot = self.slots.get(name)
+        if slot is None:
+            raise ConnectionError(f"No '{name}' model is registered.")
+        with slot.lock:
+            if slot.tokenizer is None:
+                try:
+                    slot.tokenizer = self._load_tokenizer(slot.model_id)
+                except Exception as e:
+                    raise ConnectionError(f"{name.capitalize()} tokenizer could not be loaded: {e}")
+            return slot.tokenizer
+
+    def _load_tokenizer(self, model_id):
+        tokenizer = AutoTokenizer.from_pretrained(model_id, token=YOUR_HF_TOKEN)
+        fingerprint = (
+            hash(frozenset(tokenizer.get_vocab().items())),
+            tuple(sorted(tokenizer.special_tokens_map.items(), key=str)),
+            getattr(tokenizer, "chat_template", None),
         )
-        print(">>> SUCCESS: Chat model loaded.")
+        with self.lock:
+            shared = self.tokenizers.setdefault(fingerprint, tokenizer)
+        if shared is not tokenizer:
+            print(f">>> Reusing the already loaded tokenizer for {model_id}.")
+        return shared
 
+    def _load(self, slot):
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        print(f">>> Loading {slot.name} model: {slot.model_id} (device: {device})")
+        start = time.perf_counter()
+        if slot.tokenizer is None:
+            slot.tokenizer = self._load_tokenizer(slot.model_id)
+        model = _load_int8_model(slot.model_id, slot.tokenizer) if QUANTIZE_MODE == "int8" else None
+        if model is None:
+            model = AutoModelForCausalLM.from_pretrained(
+                slot.model_id,
+                torch_dtype=torch.bfloat16,
+                device_map="auto",
+                offload_folder=slot.offload_folder,
+                token=YOUR_HF_TOKEN
+            )
+        slot.model = model
+        slot.loads += 1
+        slot.load_seconds = round(time.perf_counter() - start, 2)
+        slot.last_used = time.monotonic()
+        print(f">>> SUCCESS: {slot.name.capitalize()} model loaded in {slot.load_seconds}s.")
+        self._start_reaper()
+
+    def unload(self, name):
+        """Drops a model's weights unless a request is using it. Returns True if it was unloaded."""
+        slot = self.slots[name]
+        with slot.lock:
+            if not slot.loaded or slot.in_use:
+                return False
+            slot.model = None
+        if name == "agent":
+            # Cached key/values belong to the weights that produced them.
+            clear_agent_sessions()
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        print(f">>> Unloaded {name} model.")
         return True
 
+    def unload_idle(self):
+        now = time.monotonic()
+        for name, slot in self.slots.items():
+            if slot.loaded and not slot.in_use and slot.last_used and now - slot.last_used > self.idle_ttl:
+                self.unload(name)
+
+    def _start_reaper(self):
+        if self.idle_ttl <= 0 or self.reaper is not None:
+            return
+        def reap():
+            while True:
+                time.sleep(max(1, min(60, self.idle_ttl / 2)))
+                self.unload_idle()
+        self.reaper = threading.Thread(target=reap, name="model-reaper", daemon=True)
+        self.reaper.start()
+
+    def status(self):
+        """Load state, memory footprint and usage of every registered model."""
+        now = time.monotonic()
+        return {name: {
+            "model_id": slot.model_id,
+            "loaded": slot.loaded,
+            "in_use": slot.in_use,
+            "memory_mb": round(_model_nbytes(slot.model) / (1024 * 1024), 1) if slot.loaded else 0,
+            "quantized": slot.loaded and _is_quantized(slot.model),
+            "loads": slot.loads,
+            "load_seconds": slot.load_seconds,
+            "idle_seconds": round(now - slot.last_used, 1) if slot.last_used else None,
+        } for name, slot in self.slots.items()}
+
+
+# --- Quantized CPU Inference ---
+def _is_quantized(model):
+    return any(hasattr(module, "_packed_params") for module in model.modules())
+
+
+def _model_nbytes(model):
+    """Parameter and buffer bytes, including the packed weights of quantized linear layers."""
+    total = sum(t.numel() * t.element_size() for t in list(model.parameters()) + list(model.buffers()))
+    for module in model.modules():
+        packed = getattr(module, "_packed_params", None)
+        if packed is not None and hasattr(packed, "_weight_bias"):
+            weight, bias = packed._weight_bias()
+            total += weight.numel() * weight.element_size() + (bias.numel() * bias.element_size() if bias is not None else 0)
+    return total
+
+
+def _quantized_paths(model_id):
+    name = re.sub(r"[^A-Za-z0-9_.-]+", "--", model_id)
+    return os.path.join(QUANTIZED_DIR, f"{name}-int8.pt"), os.path.join(QUANTIZED_DIR, f"{name}-int8.json")
+
+
+def _reference_outputs(model, tokenizer, max_new_tokens=24):
+    """Greedy continuations and last-position logits for the fixed accuracy prompts."""
+    references = []
+    with torch.no_grad():
+        for prompt in ACCURACY_PROMPTS:
+            inputs = tokenizer(prompt, return_tensors="pt")
+            sequence = model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False, pad_token_id=tokenizer.eos_token_id)[0]
+            logits = model(**inputs).logits[0, -1].float()
+            references.append((inputs["input_ids"].shape[-1], sequence, logits))
+    return references
+
+
+def check_quantized_accuracy(model, tokenizer, references):
+    """
+    Compares a quantized model with full-precision reference outputs: top-1 agreement when fed the
+    reference continuations (teacher forcing) and cosine similarity of the next-token logits.
+    """
+    matches, positions, cosines = 0, 0, []
+    with torch.no_grad():
+        for prompt_length, sequence, reference_logits in references:
+            logits = model(input_ids=sequence.unsqueeze(0)).logits[0].float()
+            predicted = logits[prompt_length - 1:-1].argmax(dim=-1)
+            matches += int((predicted == sequence[prompt_length:]).sum())
+            positions += sequence.shape[-1] - prompt_length
+            cosines.append(float(torch.nn.functional.cosine_similarity(logits[prompt_length - 1], reference_logits, dim=0)))
+    agreement = matches / positions if positions else 1.0
+    return {"top1_agreement": round(agreement, 4), "min_logit_cosine": round(min(cosines), 4), "passed": agreement >= QUANTIZED_MIN_AGREEMENT}
+
+
+def _load_int8_model(model_id, tokenizer):
+    """
+    Returns an int8 dynamically quantized CPU model, reusing the saved artifact when it was built by the
+    same torch/transformers versions. Builds and checks it otherwise; returns None if it fails the check,
+    or if the same versions already failed it, without building it again.
+    """
+    import transformers
+    artifact_path, report_path = _quantized_paths(model_id)
+    versions = {"model_id": model_id, "torch": torch.__version__, "transformers": transformers.__version__}
+    if os.path.exists(report_path):
+        with open(report_path) as f:
+            report = json.load(f)
+        if {k: report.get(k) for k in versions} == versions:
+            if report.get("top1_agreement", 0) < QUANTIZED_MIN_AGREEMENT:
+                print(f">>> int8 {model_id} failed its accuracy check before (top-1 agreement {report.get('top1_agreement')}); "
+                      f"using full precision. Delete {report_path} to check again.")
+                return None
+            if report.get("passed") and os.path.exists(artifact_path):
+                print(f">>> Loading int8 artifact {artifact_path} (top-1 agreement {report['top1_agreement']}).")
+                return torch.load(artifact_path, weights_only=False).eval()
+
+    print(f">>> Quantizing {model_id} to int8 for CPU inference. This runs once and is saved to {QUANTIZED_DIR}.")
+    model = AutoModelForCausalLM.from_pretrained(model_id, torch_dtype=torch.float32, low_cpu_mem_usage=True, token=YOUR_HF_TOKEN).eval()
+    references = _reference_outputs(model, tokenizer)
+    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    report = {**versions, **check_quantized_accuracy(model, tokenizer, references), "prompts": len(ACCURACY_PROMPTS)}
+    print(f">>> int8 accuracy check: top-1 agreement {report['top1_agreement']}, min logit cosine {report['min_logit_cosine']}.")
+
+    os.makedirs(QUANTIZED_DIR, exist_ok=True)
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    if not report["passed"]:
+        print(f">>> WARNING: int8 model is below {QUANTIZED_MIN_AGREEMENT} agreement; using full precision instead.")
+        return None
+    torch.save(model, artifact_path)
+    return model
+
+
+registry = ModelRegistry()
+registry.register("agent", AGENT_MODEL_ID, offload_folder="./offload_agent")
+registry.register("chat", CHAT_MODEL_ID, offload_folder="./offload_chat")
+
+
+def initialize_models():
+    """
+    Prepares the local LLM Brain. Models load on first use, so this returns immediately
+    unless JARVIS_PRELOAD_MODELS names models to load up front.
+    """
+    print(f">>> Local LLM Brain ready: models load on first use, idle TTL {MODEL_IDLE_TTL_SECONDS}s.")
+    try:
+        for name in PRELOAD_MODELS:
+            with registry.use(name):
+                pass
+        return True
     except Exception as e:
         print(f">>> CRITICAL ERROR: Failed to load models. {e}")
         return False
 
-def get_agentic_action_json(system_prompt: str) -> str:
+
+def model_status():
+    return registry.status()
+
+class AgentSession:
     """
-    Takes the full system prompt and returns a single JSON object with the next action.
-    This function is designed to replace the Gemini call in `process_agentic_task`.
+    The agent model's past key/values for the prompt one agent task has already run through the model.
+    Each step's prompt extends the previous one, so only the newly appended tokens need a prefill.
     """
-    if not agent_model or not agent_tokenizer:
-        raise ConnectionError("Agent model is not initialized.")
 
-    objective_match = re.search(r"\*\*USER'S OBJECTIVE:\*\*\s*(.*)", system_prompt)
-    history_match = re.search(r"\*\*ACTION HISTORY & OBSERVATIONS:\*\*\n(.*?)--- TOOLKIT", system_prompt, re.DOTALL)
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.token_ids = []  # Tokens currently represented in `past_key_values`.
+        self.past_key_values = None
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.steps = 0
+        self.reused_tokens = 0
+        self.prefilled_tokens = 0
+        self.prefilled_ahead_tokens = 0  # Of prefilled_tokens, those run while an action was executing.
+        self.recent_actions = deque(maxlen=AGENT_DRAFT_HISTORY)  # Token ids of the task's previous answers.
+
+    def reusable_cache(self, input_ids):
+        """Crops the cache to the longest prefix shared with `input_ids` and returns it with its length."""
+        if self.past_key_values is None:
+            return None, 0
+        shared = 0
+        for cached_id, new_id in zip(self.token_ids, input_ids):
+            if cached_id != new_id:
+                break
+            shared += 1
+        # At least one prompt token must go through the model to produce the next-token logits.
+        shared = min(shared, len(input_ids) - 1)
+        if shared <= 0:
+            self.clear()
+            return None, 0
+        _crop_cache(self.past_key_values, shared)
+        self.token_ids = self.token_ids[:shared]
+        return self.past_key_values, shared
+
+    def store(self, past_key_values, sequence_ids):
+        self.past_key_values = past_key_values
+        self.token_ids = sequence_ids[:past_key_values.get_seq_length()]
+        self.nbytes = _cache_nbytes(past_key_values)
+
+    def clear(self):
+        self.past_key_values, self.token_ids, self.nbytes = None, [], 0
+
+
+_agent_sessions = OrderedDict()
+_agent_sessions_lock = threading.Lock()
+
+
+def _crop_cache(past_key_values, keep_tokens):
+    remove = past_key_values.get_seq_length() - keep_tokens
+    if remove > 0:
+        past_key_values.crop(-remove)
+
 
-    objective = objective_match.group(1).strip() if objective_match else "No objective found."
-    history = history_match.group(1).strip() if history_match else "No history."
+def _cache_nbytes(past_key_values):
+    """Bytes held by a key/value cache, for both the layered and the legacy list-based cache layouts."""
+    if hasattr(past_key_values, "layers"):
+        tensors = [t for layer in past_key_values.layers for t in (getattr(layer, "keys", None), getattr(layer, "values", None))]
+    else:
+        tensors = list(getattr(past_key_values, "key_cache", [])) + list(getattr(past_key_values, "value_cache", []))
+    return sum(t.numel() * t.element_size() for t in tensors if isinstance(t, torch.Tensor))
 
-    input_text = f"""
-INSTRUCTION: You are a PC control assistant. Your goal is to achieve the following objective.
-OBJECTIVE: {objective}
 
-Given the history of actions and observations, decide the single best tool to use next.
-Your response MUST be a single, valid JSON object with "action" and "args" keys.
+def get_agent_session(session_id):
+    """Returns the session for an agent task, creating it on first use and marking it most recently used."""
+    with _agent_sessions_lock:
+        session = _agent_sessions.get(session_id)
+        if session is None:
+            session = _agent_sessions[session_id] = AgentSession(session_id)
+        _agent_sessions.move_to_end(session_id)
+        return session
 
-HISTORY:
-{history}
 
-JSON_RESPONSE:
-"""
+def release_agent_session(session_id):
+    """Drops a finished task's cached key/values."""
+    with _agent_sessions_lock:
+        session = _agent_sessions.pop(session_id, None)
+    if session:
+        print(f">>> Agent session {session_id[:8]} released: reused {session.reused_tokens} "
+              f"and prefilled {session.prefilled_tokens} prompt tokens ({session.prefilled_ahead_tokens} ahead of time) "
+              f"over {session.steps} steps.")
+
+
+def _evict_agent_sessions(current):
+    """Clears least recently used sessions until the caches fit in AGENT_SESSION_CACHE_MB."""
+    limit = AGENT_SESSION_CACHE_MB * 1024 * 1024
+    with _agent_sessions_lock:
+        total = sum(s.nbytes for s in _agent_sessions.values())
+        for session in list(_agent_sessions.values()):
+            if total <= limit:
+                break
+            if session is current or not session.nbytes:
+                continue
+            total -= session.nbytes
+            session.clear()
+            print(f">>> Evicted prefix cache of agent session {session.session_id[:8]} to stay under {AGENT_SESSION_CACHE_MB} MB.")
+
+
+def clear_agent_sessions():
+    with _agent_sessions_lock:
+        for session in _agent_sessions.values():
+            session.clear()
+
+
+def get_agent_session_stats():
+    """Cache size and prefix reuse for every live agent session, least recently used first."""
+    with _agent_sessions_lock:
+        return [{
+            "session_id": s.session_id,
+            "cached_tokens": len(s.token_ids),
+            "cache_mb": round(s.nbytes / (1024 * 1024), 2),
+            "steps": s.steps,
+            "reused_tokens": s.reused_tokens,
+            "prefilled_tokens": s.prefilled_tokens,
+            "prefilled_ahead_tokens": s.prefilled_ahead_tokens,
+        } for s in _agent_sessions.values()]
+
+
+class _AgentRequest:
+    def __init__(self, prompt_ids, session_id, toolkit):
+        self.prompt_ids = prompt_ids
+        self.session_id = session_id
+        self.toolkit = toolkit
+
+
+class _PrefillRequest:
+    def __init__(self, prompt_ids, session_id):
+        self.prompt_ids = prompt_ids
+        self.session_id = session_id
+
+
+def count_agent_tokens(text: str) -> int:
+    """Number of agent-tokenizer tokens in `text` (loads only the tokenizer, not the model)."""
+    return len(registry.tokenizer("agent")(text, add_special_tokens=False)["input_ids"])
+
+
+def count_agent_tokens_many(texts) -> list:
+    """count_agent_tokens for several texts in one tokenizer call."""
+    return [len(ids) for ids in registry.tokenizer("agent")(list(texts), add_special_tokens=False)["input_ids"]]
+
+
+def get_agentic_action_json(context, session_id: str = None, toolkit: dict = None) -> str:
+    """
+    Takes the task's AgentContext and returns a single JSON object with the next action.
+    This function is designed to replace the Gemini call in `process_agentic_task`.
+    With a `session_id`, the key/values of the prompt prefix shared with the task's previous
+    step are reused, so only the newly appended history is prefilled.
+    With a `toolkit` schema, decoding is constrained to a valid action object and stops when it closes.
+    Requests from concurrent tasks are decoded together by the agent scheduler.
+    """
+    with tracing.span("llm.prompt_build", model="agent"):
+        input_text = build_agent_prompt(context)
+    return get_action_for_prompt(input_text, session_id=session_id, toolkit=toolkit)
+
 
+def get_action_for_prompt(input_text, session_id: str = None, toolkit: dict = None) -> str:
+    """get_agentic_action_json for a prompt already built with build_agent_prompt (what the model server receives)."""
     print(">>> Sending request to local AGENT model...")
-    inputs = agent_tokenizer(input_text, return_tensors="pt").to(agent_model.device)
+    agent_tokenizer = registry.tokenizer("agent")
+    with tracing.span("llm.tokenize", model="agent"):
+        prompt_ids = agent_tokenizer(input_text)["input_ids"]
+    request = _AgentRequest(prompt_ids, session_id, toolkit)
+    return _agent_scheduler.submit(request, batch_key=id(toolkit) if toolkit else None).result()
+
+
+def prefill_agent_prompt(prefix_text, session_id) -> int:
+    """
+    Runs the known start of a task's next prompt (see build_agent_prompt_prefix) into its session cache
+    while the current action executes, so the next step only prefills the action's result.
+    Goes through the agent scheduler, so the next step's decode queues behind it. Returns the tokens prefilled.
+    """
+    agent_tokenizer = registry.tokenizer("agent")
+    with tracing.span("llm.tokenize", model="agent"):
+        prompt_ids = agent_tokenizer(prefix_text)["input_ids"]
+    return _agent_scheduler.submit(_PrefillRequest(prompt_ids, session_id), batch_key="prefill").result()
+
+
+def _action_generate_kwargs(agent_tokenizer, toolkit, prompt_length):
+    generate_kwargs = dict(max_new_tokens=AGENT_MAX_NEW_TOKENS, do_sample=False, pad_token_id=agent_tokenizer.eos_token_id)
+    if toolkit and AGENT_CONSTRAINED_DECODING:
+        grammar = action_grammar.ActionJSONLogitsProcessor(agent_tokenizer, toolkit, prompt_length, AGENT_MAX_NEW_TOKENS)
+        generate_kwargs["logits_processor"] = LogitsProcessorList([grammar])
+        generate_kwargs["stopping_criteria"] = StoppingCriteriaList([action_grammar.ActionCompleteCriteria(grammar)])
+    return generate_kwargs
+
+
+def _run_agent_batch(requests):
+    with registry.use("agent") as (agent_model, agent_tokenizer):
+        if isinstance(requests[0], _PrefillRequest):
+            # Each task extends its own cache, so prefills run one after another.
+            return [_prefill(agent_model, request) for request in requests]
+        if len(requests) == 1:
+            return [_generate_action(agent_model, agent_tokenizer, requests[0])]
+        return _generate_action_batch(agent_model, agent_tokenizer, requests)
 
+
+def _generate_action(agent_model, agent_tokenizer, request):
+    """A single request: reuses the task's cached prefix when it has a session."""
+    prompt_ids = request.prompt_ids
+    session = get_agent_session(request.session_id) if request.session_id else None
+    if session is None:
+        sequence, _ = _decode_action(agent_model, agent_tokenizer, request, None, 0, ())
+    else:
+        with session.lock:
+            past_key_values, reused = session.reusable_cache(prompt_ids)
+            sequence, past_key_values = _decode_action(agent_model, agent_tokenizer, request, past_key_values, reused, session.recent_actions)
+            session.store(past_key_values, sequence)
+            session.recent_actions.append(sequence[len(prompt_ids):])
+            session.steps += 1
+            session.reused_tokens += reused
+            session.prefilled_tokens += len(prompt_ids) - reused
+        print(f">>> Agent prefix cache: reused {reused}/{len(prompt_ids)} prompt tokens.")
+        _evict_agent_sessions(session)
+
+    # Only the newly generated tokens hold the answer.
+    return agent_tokenizer.decode(sequence[len(prompt_ids):], skip_special_tokens=True).strip()
+
+
+@torch.no_grad()
+def _prefill(agent_model, request):
+    """Extends the session's cache over the request's prompt; returns how many tokens that took."""
+    with _agent_sessions_lock:
+        session = _agent_sessions.get(request.session_id)
+    if session is None:
+        return 0  # The task already ended and released its session.
+    with session.lock:
+        past_key_values, reused = session.reusable_cache(request.prompt_ids)
+        cache = past_key_values if past_key_values is not None else DynamicCache()
+        new_ids = request.prompt_ids[reused:]
+        with tracing.span("llm.prefill_ahead", model="agent"):
+            agent_model(input_ids=torch.tensor([new_ids], device=agent_model.device), past_key_values=cache, use_cache=True)
+        session.store(cache, request.prompt_ids)
+        session.prefilled_tokens += len(new_ids)
+        session.prefilled_ahead_tokens += len(new_ids)
+    _evict_agent_sessions(session)
+    return len(new_ids)
+
+
+def _decode_action(agent_model, agent_tokenizer, request, past_key_values, reused, previous_actions):
+    """Greedy decoding of one action; returns (sequence ids, the cache covering it)."""
+    prompt_ids = request.prompt_ids
+    generate_kwargs = _action_generate_kwargs(agent_tokenizer, request.toolkit, len(prompt_ids))
+    if AGENT_SPECULATIVE_DECODING:
+        processors = generate_kwargs.get("logits_processor")
+        grammar = processors[0] if processors else None
+        corpora = [*_toolkit_draft_ids(agent_tokenizer, request.toolkit), *previous_actions]
+        drafter = speculative.PromptLookupDrafter(prompt_ids, corpora)
+        cache = past_key_values if past_key_values is not None else DynamicCache()
+        sequence = speculative.greedy_generate(
+            agent_model, prompt_ids, cache, reused, drafter, AGENT_MAX_NEW_TOKENS, agent_tokenizer.eos_token_id,
+            logits_processor=processors, stopping_criteria=generate_kwargs.get("stopping_criteria"), grammar=grammar
+        )
+        return sequence, cache
+    input_ids = torch.tensor([prompt_ids], device=agent_model.device)
+    timer = _phase_timer()
     outputs = agent_model.generate(
-        **inputs,
-        max_new_tokens=150,
-        do_sample=False,
-        pad_token_id=agent_tokenizer.eos_token_id
+        input_ids=input_ids,
+        attention_mask=torch.ones_like(input_ids),
+        **generate_kwargs,
+        past_key_values=past_key_values,
+        return_dict_in_generate=True,
+        streamer=timer
     )
+    if timer: timer.record("agent")
+    return outputs.sequences[0].tolist(), outputs.past_key_values
 
-    response_text = agent_tokenizer.decode(outputs[0], skip_special_tokens=True)
-    json_part = response_text.split("JSON_RESPONSE:")[-1].strip()
-    return json_part
 
-def stream_chat_response(history, command):
+_toolkit_drafts = {}
+
+
+def _toolkit_draft_ids(agent_tokenizer, toolkit):
+    """Every TOOLKIT action written out as an answer skeleton, tokenized once per tokenizer and toolkit."""
+    if not toolkit:
+        return []
+    key = (id(agent_tokenizer), id(toolkit))
+    if key not in _toolkit_drafts:
+        templates = [json.dumps({"action": name, "args": {arg: "" for arg in args}}) for name, args in toolkit.items()]
+        _toolkit_drafts[key] = [agent_tokenizer.encode(t, add_special_tokens=False) for t in templates]
+    return _toolkit_drafts[key]
+
+
+def _generate_action_batch(agent_model, agent_tokenizer, requests):
+    """
+    Several tasks at once, left-padded into one batch. Per-task prefix caches can't be combined
+    into one batch, so these steps run a full prefill and leave the sessions' caches untouched.
+    """
+    pad_token_id = agent_tokenizer.pad_token_id if agent_tokenizer.pad_token_id is not None else agent_tokenizer.eos_token_id
+    input_ids, attention_mask = left_pad([r.prompt_ids for r in requests], pad_token_id)
+    width = input_ids.shape[-1]
+    timer = _phase_timer()
+    outputs = agent_model.generate(
+        input_ids=input_ids.to(agent_model.device),
+        attention_mask=attention_mask.to(agent_model.device),
+        **_action_generate_kwargs(agent_tokenizer, requests[0].toolkit, width),
+        streamer=timer
+    )
+    if timer: timer.record("agent")
+    print(f">>> Agent batch of {len(requests)} decoded together.")
+    return [agent_tokenizer.decode(row[width:], skip_special_tokens=True).strip() for row in outputs]
+
+
+class _TokenQueueStreamer(BaseStreamer):
     """
-    Takes a conversation history and a new command, and yields the response chunks.
-    This replaces `stream_simple_command`.
+    Receives token ids from `generate` on the generation thread, decodes them incrementally
+    and hands text chunks to the consumer through a queue holding at most `maxsize` unread chunks.
+    The stream always ends with _END, or with an exception (StreamStalled after a stall) that the
+    consumer's iteration raises, so a cut-short reply never looks complete.
     """
-    if not chat_model or not chat_tokenizer:
-        raise ConnectionError("Chat model is not initialized.")
+    _END = object()
+
+    def __init__(self, tokenizer, cancel_event, maxsize=STREAM_QUEUE_SIZE):
+        self.tokenizer = tokenizer
+        self.cancel_event = cancel_event
+        self.queue = queue.Queue()
+        self.free_slots = threading.Semaphore(maxsize)  # Chunks take a slot; the final item never waits for one.
+        self.stalled = False
+        self.token_cache = []
+        self.printed_len = 0
+        self.prompt_skipped = False
+        self.new_tokens = 0
+        self.first_token_time = None
+
+    def put(self, value):
+        # The first call carries the prompt ids, which are never echoed back.
+        if not self.prompt_skipped:
+            self.prompt_skipped = True
+            return
+        token_ids = value.reshape(-1).tolist()
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        self.new_tokens += len(token_ids)
+        self.token_cache.extend(token_ids)
+
+        text = self.tokenizer.decode(self.token_cache, skip_special_tokens=True)
+        if text.endswith("\n"):
+            # Start a fresh decode window at line breaks so decoding stays cheap on long replies.
+            chunk = text[self.printed_len:]
+            self.token_cache, self.printed_len = [], 0
+        elif text.endswith("\ufffd"):
+            # An incomplete multi-byte character; wait for the next token to finish it.
+            return
+        else:
+            chunk = text[self.printed_len:]
+            self.printed_len = len(text)
+        if chunk:
+            self._push(chunk)
+
+    def end(self):
+        if self.token_cache:
+            text = self.tokenizer.decode(self.token_cache, skip_special_tokens=True)
+            if text[self.printed_len:]:
+                self._push(text[self.printed_len:])
+            self.token_cache, self.printed_len = [], 0
+        if self.stalled:
+            self.queue.put(StreamStalled(f"The consumer read nothing for {STREAM_STALL_TIMEOUT_SECONDS}s; the reply was cut short."))
+        else:
+            self.queue.put(self._END)
+
+    def fail(self, error):
+        self.queue.put(error)
+
+    def _push(self, chunk):
+        # Blocks while the consumer is behind, but gives up as soon as the request is cancelled.
+        # A consumer that stops reading altogether is treated as gone, so it can't hold up its batch.
+        deadline = time.monotonic() + STREAM_STALL_TIMEOUT_SECONDS
+        while not self.cancel_event.is_set():
+            if self.free_slots.acquire(timeout=0.1):
+                self.queue.put(chunk)
+                return
+            if time.monotonic() > deadline:
+                print(">>> Stream consumer stalled; cancelling its generation.")
+                self.stalled = True
+                self.cancel_event.set()
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if item is self._END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            self.free_slots.release()
+            yield item
+
+
+class _PhaseTimer(BaseStreamer):
+    """Notes when `generate` emits its first new token, to split a generation into prefill and decode spans."""
 
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.prompt_seen = False
+        self.first_token_time = None
+
+    def put(self, value):
+        # The first call carries the prompt ids; the second, the first generated token.
+        if not self.prompt_seen:
+            self.prompt_seen = True
+        elif self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+
+    def end(self):
+        pass
+
+    def record(self, model):
+        end = time.perf_counter()
+        first_token = self.first_token_time or end
+        tracing.record_span("llm.prefill", self.start, first_token, model=model)
+        tracing.record_span("llm.decode", first_token, end, model=model)
+
+
+def _phase_timer():
+    """A _PhaseTimer for a `generate` call while tracing is on; None (no streamer at all) otherwise."""
+    return _PhaseTimer() if tracing.TRACING_ENABLED else None
+
+
+class _BatchStreamer(_PhaseTimer):
+    """Splits a batch's token stream into one `_TokenQueueStreamer` per row; a row ends at its first stop token."""
+
+    def __init__(self, streamers, stop_token_ids):
+        super().__init__()
+        self.streamers = streamers
+        self.stop_token_ids = stop_token_ids
+        self.finished = [False] * len(streamers)
+
+    def put(self, value):
+        super().put(value)
+        if value.dim() > 1:
+            for row, streamer in enumerate(self.streamers):
+                streamer.put(value[row])
+            return
+        for row, streamer in enumerate(self.streamers):
+            if self.finished[row]:
+                continue
+            if int(value[row]) in self.stop_token_ids:
+                self.finished[row] = True
+                streamer.end()
+            else:
+                streamer.put(value[row:row + 1])
+
+    def end(self):
+        # Recorded before the last rows are released, so their requests' traces still include it.
+        self.record("chat")
+        for row, streamer in enumerate(self.streamers):
+            if not self.finished[row]:
+                self.finished[row] = True
+                streamer.end()
+
+
+class _CancelledCriteria(StoppingCriteria):
+    """Stops each row of `generate` at the next token once that request's cancel event is set."""
+
+    def __init__(self, cancel_events):
+        self.cancel_events = cancel_events
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.tensor([event.is_set() for event in self.cancel_events], dtype=torch.bool, device=input_ids.device)
+
+
+def _record_generation_stats(kind, prompt_tokens, streamer, start_time, cancelled):
+    """Stores first-token latency and decode throughput for one request and logs a summary line."""
+    end_time = time.perf_counter()
+    first_token = streamer.first_token_time
+    decode_time = end_time - first_token if first_token else 0.0
+    stats = {
+        "kind": kind,
+        "prompt_tokens": prompt_tokens,
+        "new_tokens": streamer.new_tokens,
+        "time_to_first_token": round(first_token - start_time, 4) if first_token else None,
+        "tokens_per_second": round((streamer.new_tokens - 1) / decode_time, 2) if decode_time > 0 else None,
+        "total_time": round(end_time - start_time, 4),
+        "cancelled": cancelled,
+    }
+    generation_stats.append(stats)
+    print(f">>> {kind.upper()} stream: first token {stats['time_to_first_token']}s, "
+          f"{stats['tokens_per_second']} tok/s, {stats['new_tokens']} tokens{' (cancelled)' if cancelled else ''}")
+    return stats
+
+
+def get_generation_stats():
+    """Returns the timings of the most recent generation requests, oldest first."""
+    return list(generation_stats)
+
+
+class _ChatRequest:
+    def __init__(self, prompt_ids, streamer, cancel_event):
+        self.prompt_ids = prompt_ids
+        self.streamer = streamer
+        self.cancel_event = cancel_event
+
+
+def stream_chat_response(history, command):
+    """
+    Takes a conversation history and a new command, and yields the response chunks
+    as the chat model produces them.
+    Generation runs on the chat scheduler's thread, batched with other pending chats; closing
+    this generator (e.g. when the SSE client disconnects) cancels it at the next token.
+    """
+    chat_tokenizer = registry.tokenizer("chat")
     chat_template_history = []
     for message in history:
         if message['parts'][0] != command:
@@ -126,19 +829,68 @@ def stream_chat_response(history, command):
 
     chat_template_history.append({"role": "user", "content": command})
 
-    prompt = chat_tokenizer.apply_chat_template(
-        chat_template_history,
-        tokenize=False,
-        add_generation_prompt=True
-    )
+    with tracing.span("llm.prompt_build", model="chat"):
+        prompt = chat_tokenizer.apply_chat_template(
+            chat_template_history,
+            tokenize=False,
+            add_generation_prompt=True
+        )
 
     print(">>> Sending request to local CHAT model...")
-    inputs = chat_tokenizer(prompt, return_tensors="pt", add_special_tokens=False).to(chat_model.device)
+    start_time = time.perf_counter()
+    with tracing.span("llm.tokenize", model="chat"):
+        prompt_ids = chat_tokenizer(prompt, add_special_tokens=False)["input_ids"]
+
+    cancel_event = threading.Event()
+    streamer = _TokenQueueStreamer(chat_tokenizer, cancel_event)
+    future = _chat_scheduler.submit(_ChatRequest(prompt_ids, streamer, cancel_event))
+
+    completed = False
+    try:
+        yield from streamer
+        completed = True
+    finally:
+        # A no-op when generation already finished; otherwise stops it at the next token,
+        # or drops the request if it is still waiting for a batch.
+        cancel_event.set()
+        future.cancel()
+        _record_generation_stats("chat", len(prompt_ids), streamer, start_time, cancelled=not completed)
+
+
+def _run_chat_batch(requests):
+    try:
+        with registry.use("chat") as (chat_model, chat_tokenizer):
+            pad_token_id = chat_tokenizer.pad_token_id if chat_tokenizer.pad_token_id is not None else chat_tokenizer.eos_token_id
+            input_ids, attention_mask = left_pad([r.prompt_ids for r in requests], pad_token_id)
+            eos = chat_model.generation_config.eos_token_id
+            stop_token_ids = {chat_tokenizer.eos_token_id, pad_token_id} | set(eos if isinstance(eos, list) else [eos])
+            chat_model.generate(
+                input_ids=input_ids.to(chat_model.device),
+                attention_mask=attention_mask.to(chat_model.device),
+                max_new_tokens=CHAT_MAX_NEW_TOKENS,
+                pad_token_id=chat_tokenizer.eos_token_id,
+                streamer=_BatchStreamer([r.streamer for r in requests], stop_token_ids),
+                stopping_criteria=StoppingCriteriaList([_CancelledCriteria([r.cancel_event for r in requests])])
+            )
+    except Exception as e:
+        print(f">>> ERROR: Chat generation failed. {e}")
+        for r in requests:
+            r.streamer.fail(e)
+        raise
+    if len(requests) > 1:
+        print(f">>> Chat batch of {len(requests)} streamed together.")
+    return [r.streamer.new_tokens for r in requests]
+
+
+_agent_scheduler = InferenceScheduler("agent", _run_agent_batch)
+_chat_scheduler = InferenceScheduler("chat", _run_chat_batch)
+
 
-    outputs = chat_model.generate(**inputs, max_new_tokens=512, pad_token_id=chat_tokenizer.eos_token_id)
-    full_response = chat_tokenizer.decode(outputs[0], skip_special_tokens=True)
+def get_scheduler_stats():
+    """Batching counters of the agent and chat schedulers."""
+    return {"agent": _agent_scheduler.stats(), "chat": _chat_scheduler.stats()}
 
-    response_only = full_response.split('[/INST]')[-1].strip()
 
-    for word in response_only.split():
-        yield word + " "
\ No newline at end of file
+def get_speculative_stats():
+    """Draft acceptance and tokens per forward pass of speculative agent decoding."""
+    return speculative.get_stats()
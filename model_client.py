@@ -0,0 +1,169 @@
+# --- model_client.py ---
+# Stand-in for local_llm_handler when the models run in a shared model_server.py process: the same functions,
+# each one a request over the server's socket, so any number of web workers share one copy of the models.
+# assistant_core switches to it when JARVIS_MODEL_SERVER is set. Configuration constants and the prompt
+# builders come from model_common, so this never imports torch or transformers.
+
+import os
+import json
+import time
+import socket
+import threading
+from collections import OrderedDict
+
+import tracing
+from model_common import CHAT_MODEL_ID, CHAT_MAX_NEW_TOKENS, QUANTIZE_MODE, StreamStalled, build_agent_prompt, build_agent_prompt_prefix
+
+# "unix:/path/to/socket" or "host:port". Empty (the default) runs the models inside each web process.
+SERVER_ADDRESS = os.environ.get("JARVIS_MODEL_SERVER", "")
+CONNECT_TIMEOUT_SECONDS = 5
+REPLY_TIMEOUT_SECONDS = 300  # An agent step can queue behind other batches; a chat stream can pause between chunks.
+STARTUP_WAIT_SECONDS = int(os.environ.get("JARVIS_MODEL_SERVER_WAIT", "60"))  # For a server still starting up.
+TOKEN_COUNT_CACHE_ENTRIES = 4096  # Token counts kept here, so a text is sent to the server once.
+
+_token_counts = OrderedDict()  # text -> agent-tokenizer token count
+_token_counts_lock = threading.Lock()
+
+
+class ModelServerError(RuntimeError):
+    """The model server couldn't be reached or failed the request."""
+
+
+class ModelServerBusy(ModelServerError):
+    """The model server already has its maximum number of requests in flight."""
+
+
+def parse_address(address):
+    """(socket family, address) for "unix:/path" or "host:port"."""
+    if address.startswith("unix:"):
+        if not hasattr(socket, "AF_UNIX"):
+            raise ValueError(f"Unix sockets aren't available on this platform: {address}")
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def _connect(address):
+    family, target = parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.settimeout(CONNECT_TIMEOUT_SECONDS)
+    try:
+        sock.connect(target)
+    except OSError as e:
+        sock.close()
+        raise ModelServerError(f"Model server at {address} is unreachable: {e}") from e
+    sock.settimeout(REPLY_TIMEOUT_SECONDS)
+    return sock
+
+
+def _request(message, address=None):
+    """
+    Sends one request and yields its replies until the one marked "done". Error replies raise, and so do
+    socket errors and timeouts, as ModelServerError. Closing the generator closes the connection, which
+    makes the server cancel the request.
+    """
+    address = address or SERVER_ADDRESS
+    try:
+        with _connect(address) as sock, sock.makefile("rb") as replies:
+            sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+            for line in replies:
+                reply = json.loads(line)
+                if "error" in reply:
+                    if reply.get("stalled"):
+                        raise StreamStalled(reply["error"])
+                    raise (ModelServerBusy if reply.get("busy") else ModelServerError)(reply["error"])
+                yield reply
+                if reply.get("done"):
+                    return
+    except (OSError, ValueError) as e:  # ValueError: a reply that isn't JSON.
+        raise ModelServerError(f"Model server at {address} failed the {message['op']} request: {e}") from e
+    raise ModelServerError(f"Model server at {address} closed the connection mid-reply.")
+
+
+def _call(message, address=None):
+    """A single-reply request; returns the reply's "result"."""
+    replies = _request(message, address)
+    try:
+        with tracing.span("model_server.request", op=message["op"]):
+            return next(replies).get("result")
+    finally:
+        replies.close()
+
+
+# --- The local_llm_handler API ---
+def get_agentic_action_json(context, session_id: str = None, toolkit: dict = None) -> str:
+    """The task's next action as JSON; the prompt is built here and decoded by the server."""
+    with tracing.span("llm.prompt_build", model="agent"):
+        input_text = build_agent_prompt(context)
+    return _call({"op": "agent", "prompt": input_text, "session_id": session_id, "toolkit": toolkit})
+
+
+def prefill_agent_prompt(prefix_text, session_id) -> int:
+    """Has the server prefill the start of the task's next prompt into its session cache."""
+    return _call({"op": "prefill", "prompt": prefix_text, "session_id": session_id})
+
+
+def stream_chat_response(history, command):
+    """Yields the chat model's reply chunks as the server streams them; closing this cancels generation."""
+    replies = _request({"op": "chat", "history": history, "command": command})
+    try:
+        for reply in replies:
+            if "chunk" in reply:
+                yield reply["chunk"]
+    finally:
+        replies.close()
+
+
+def count_agent_tokens(text: str) -> int:
+    return count_agent_tokens_many([text])[0]
+
+
+def count_agent_tokens_many(texts) -> list:
+    """Token counts for `texts`: remembered ones from the local cache, the rest in one request."""
+    texts = list(texts)
+    with _token_counts_lock:
+        known = {text: _token_counts[text] for text in texts if text in _token_counts}
+    missing = list(dict.fromkeys(text for text in texts if text not in known))
+    if missing:
+        counts = _call({"op": "count_tokens", "texts": missing})
+        with _token_counts_lock:
+            for text, count in zip(missing, counts):
+                _token_counts[text] = known[text] = count
+            while len(_token_counts) > TOKEN_COUNT_CACHE_ENTRIES:
+                _token_counts.popitem(last=False)
+    return [known[text] for text in texts]
+
+
+def release_agent_session(session_id):
+    # Runs in a finally block after the task; a server that has gone away just evicts the session itself.
+    try:
+        _call({"op": "release_session", "session_id": session_id})
+    except ModelServerError as e:
+        print(f"ERROR: Could not release agent session {session_id[:8]}: {e}")
+
+
+def health(address=None):
+    """The server's health reply: pid, uptime, requests in flight and which models are loaded."""
+    return _call({"op": "health"}, address)
+
+
+def initialize_models():
+    """Waits up to STARTUP_WAIT_SECONDS for the model server to answer a health check."""
+    deadline = time.monotonic() + STARTUP_WAIT_SECONDS
+    while True:
+        try:
+            status = health()
+            print(f">>> Using the model server at {SERVER_ADDRESS} (pid {status['pid']}, models loaded: {status['loaded_models'] or 'none yet'}).")
+            return True
+        except ModelServerError as e:
+            if time.monotonic() > deadline:
+                print(f">>> CRITICAL ERROR: {e}")
+                return False
+            time.sleep(1)
+
+
+def model_status():
+    try:
+        return _call({"op": "status"})
+    except ModelServerError as e:
+        return {"error": str(e)}
@@ -0,0 +1,47 @@
+# --- model_common.py ---
+# What the web workers and the model process both need, without importing torch or transformers: the model
+# ids and generation settings, the agent prompt, and the error a cut-short chat stream ends with.
+# local_llm_handler re-exports all of it, so in-process callers see no difference; model_client imports
+# it from here, so a worker that uses the model server never loads the model libraries.
+
+import os
+
+from agent_context import PENDING_OBSERVATION
+
+# --- Configuration ---
+AGENT_MODEL_ID = "sagar078/gemma-2b-desktop-agent-v1"
+CHAT_MODEL_ID = "sagar078/gemma-2b-dolly-dpo-aligned-final"
+CHAT_MAX_NEW_TOKENS = 512
+# "int8" runs both models on the CPU with dynamically quantized linear layers.
+QUANTIZE_MODE = os.environ.get("JARVIS_QUANTIZE", "").lower()
+MAX_BATCH_SIZE = int(os.environ.get("JARVIS_MAX_BATCH_SIZE", "8"))  # Requests decoded together per forward pass.
+
+
+class StreamStalled(Exception):
+    """A chat stream's consumer stopped reading and its generation was cancelled: the reply is incomplete."""
+
+
+def build_agent_prompt_prefix(context, action, args):
+    """The start of the prompt for the step after (action, args): everything up to where its result goes."""
+    prompt = build_agent_prompt(context.preview(action, args))
+    return prompt[:prompt.index(PENDING_OBSERVATION)]
+
+
+def build_agent_prompt(context):
+    """The agent model's prompt for the next step of the task in `context`."""
+    objective = context.objective.strip() or "No objective found."
+    history = context.render_history().strip() or "No history."
+
+    input_text = f"""
+INSTRUCTION: You are a PC control assistant. Your goal is to achieve the following objective.
+OBJECTIVE: {objective}
+
+Given the history of actions and observations, decide the single best tool to use next.
+Your response MUST be a single, valid JSON object with "action" and "args" keys.
+
+HISTORY:
+{history}
+
+JSON_RESPONSE:
+"""
+    return input_text
@@ -0,0 +1,217 @@
+# --- model_server.py ---
+# Standalone inference process that owns the agent and chat models, so several web worker processes share
+# one copy of them instead of each loading both. Workers reach it through model_client.py over a Unix socket
+# (POSIX) or localhost TCP. Each connection carries one request as a line of JSON, answered by JSON lines:
+#   {"op": "agent", "prompt", "session_id", "toolkit"}    -> {"result": "<action JSON>", "done": true}
+#   {"op": "prefill", "prompt", "session_id"}             -> {"result": <tokens prefilled>, "done": true}
+#   {"op": "chat", "history", "command"}                  -> {"chunk": "..."} ... then {"done": true}
+#   {"op": "count_tokens", "text"} or {"op": "count_tokens", "texts": [...]} (a list of counts)
+#   {"op": "release_session", "session_id"} / {"op": "health"} / {"op": "status"}
+# A failure answers {"error": "...", "done": true}, with "stalled": true for a chat stream cut short because
+# its reader fell behind. Past MAX_REQUESTS model requests in flight, new ones are
+# refused at once with "busy" instead of queueing without bound. A client that disconnects mid-stream
+# cancels its generation, like a closed EventSource does in-process.
+#
+#   python model_server.py --listen unix:/tmp/jarvis-models.sock      (or --listen 127.0.0.1:5055)
+#   JARVIS_MODEL_SERVER=unix:/tmp/jarvis-models.sock python webapp.py
+
+import os
+import sys
+import json
+import stat
+import time
+import socket
+import argparse
+import threading
+import socketserver
+
+import local_llm_handler
+from model_client import parse_address
+
+DEFAULT_ADDRESS = "unix:/tmp/jarvis-models.sock" if hasattr(socket, "AF_UNIX") else "127.0.0.1:5055"
+MAX_REQUESTS = int(os.environ.get("JARVIS_MODEL_SERVER_MAX_REQUESTS", "64"))  # Agent and chat requests in flight.
+MAX_REQUEST_BYTES = 4 * 1024 * 1024
+
+_started_at = time.time()
+_slots = threading.BoundedSemaphore(MAX_REQUESTS)
+_in_flight = 0
+_state_lock = threading.Lock()
+_toolkits = {}
+
+
+def _interned_toolkit(toolkit):
+    # Agent batching and the drafter cache key on the toolkit's identity, so equal schemas must share one object.
+    if not toolkit:
+        return None
+    key = json.dumps(toolkit, sort_keys=True)
+    with _state_lock:
+        return _toolkits.setdefault(key, toolkit)
+
+
+# --- Operations ---
+def _agent(send, message):
+    toolkit = _interned_toolkit(message.get("toolkit"))
+    send({"result": local_llm_handler.get_action_for_prompt(message["prompt"], session_id=message.get("session_id"), toolkit=toolkit), "done": True})
+
+
+def _prefill(send, message):
+    send({"result": local_llm_handler.prefill_agent_prompt(message["prompt"], message["session_id"]), "done": True})
+
+
+def _chat(send, message):
+    stream = local_llm_handler.stream_chat_response(message["history"], message["command"])
+    try:
+        for chunk in stream:
+            send({"chunk": chunk})
+        send({"done": True})
+    finally:
+        stream.close()
+
+
+def _count_tokens(send, message):
+    if "texts" in message:
+        send({"result": local_llm_handler.count_agent_tokens_many(message["texts"]), "done": True})
+    else:
+        send({"result": local_llm_handler.count_agent_tokens(message["text"]), "done": True})
+
+
+def _release_session(send, message):
+    local_llm_handler.release_agent_session(message["session_id"])
+    send({"result": True, "done": True})
+
+
+def health():
+    status = local_llm_handler.model_status()
+    return {
+        "ok": True,
+        "pid": os.getpid(),
+        "uptime_seconds": round(time.time() - _started_at, 1),
+        "in_flight": _in_flight,
+        "max_requests": MAX_REQUESTS,
+        "loaded_models": [name for name, model in status.items() if model.get("loaded")],
+    }
+
+
+def _health(send, message):
+    send({"result": health(), "done": True})
+
+
+def _status(send, message):
+    send({"result": local_llm_handler.model_status(), "done": True})
+
+
+MODEL_OPS = {"agent": _agent, "prefill": _prefill, "chat": _chat}  # Count against MAX_REQUESTS.
+LIGHT_OPS = {"count_tokens": _count_tokens, "release_session": _release_session, "health": _health, "status": _status}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def send(self, reply):
+        self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+
+    def handle(self):
+        global _in_flight
+        line = self.rfile.readline(MAX_REQUEST_BYTES + 1)
+        if not line:
+            return
+        try:
+            if len(line) > MAX_REQUEST_BYTES:
+                raise ValueError(f"request larger than {MAX_REQUEST_BYTES} bytes")
+            message = json.loads(line)
+            op = message.get("op")
+            operation = MODEL_OPS.get(op) or LIGHT_OPS.get(op)
+            if operation is None:
+                raise ValueError(f"unknown op {op!r}")
+        except (ValueError, AttributeError) as e:
+            self._reply_error(f"Bad request: {e}")
+            return
+        if op in MODEL_OPS and not _slots.acquire(blocking=False):
+            self._reply_error(f"Model server busy: {MAX_REQUESTS} requests in flight.", busy=True)
+            return
+        if op in MODEL_OPS:
+            with _state_lock:
+                _in_flight += 1
+        try:
+            operation(self.send, message)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client went away; its stream was closed above, which cancelled generation.
+        except local_llm_handler.StreamStalled as e:
+            print(f">>> ERROR: Model server '{op}' stream stalled. {e}")
+            self._reply_error(str(e), stalled=True)
+        except Exception as e:
+            print(f">>> ERROR: Model server '{op}' request failed. {e}")
+            self._reply_error(str(e))
+        finally:
+            if op in MODEL_OPS:
+                with _state_lock:
+                    _in_flight -= 1
+                _slots.release()
+
+    def _reply_error(self, error, busy=False, stalled=False):
+        try:
+            self.send({"error": error, "busy": busy, "stalled": stalled, "done": True})
+        except OSError:
+            pass
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class _UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+
+def _claim_socket_path(path):
+    """Removes a socket file left by a server that is gone; refuses to start next to a live one."""
+    if not os.path.exists(path):
+        return
+    if not stat.S_ISSOCK(os.stat(path).st_mode):
+        raise RuntimeError(f"{path} exists and is not a socket.")
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.remove(path)
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f"Another model server is already listening on {path}.")
+
+
+def create_server(address=DEFAULT_ADDRESS):
+    family, target = parse_address(address)
+    if family == socket.AF_INET:
+        return _TCPServer(target, _Handler)
+    _claim_socket_path(target)
+    server = _UnixServer(target, _Handler)
+    os.chmod(target, 0o600)  # Only this user's web workers may use the models.
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared local inference server for JARVIS web workers.")
+    parser.add_argument("--listen", default=os.environ.get("JARVIS_MODEL_SERVER") or DEFAULT_ADDRESS,
+                        help='"unix:/path/to/socket" or "host:port" (keep TCP on 127.0.0.1).')
+    args = parser.parse_args()
+    if not local_llm_handler.initialize_models():
+        return 1
+    server = create_server(args.listen)
+    print(f">>> Model server listening on {args.listen} (up to {MAX_REQUESTS} model requests in flight).")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.listen.startswith("unix:"):
+            try:
+                os.remove(args.listen[len("unix:"):])
+            except OSError:
+                pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+# --- observation_prefetch.py ---
+# Speculative observation capture for the pipelined agent loop. While the model decides its next step, the
+# read it is likely to ask for next (the elements of the window it clicked in, sent a key to, or launched) is
+# taken in the background. An observation action uses such a read only if the agent actually asks for it;
+# the next action that changes the desktop discards the rest. Only raw reads are kept: the observation text,
+# and the GET_WINDOW_ELEMENTS snapshot it updates, are still produced when the agent asks, so an unused read
+# leaves no trace.
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import tracing
+
+PREFETCH_MAX_AGE_SECONDS = float(os.environ.get("JARVIS_PREFETCH_MAX_AGE", "5"))  # Older reads aren't used.
+PREFETCH_WAIT_SECONDS = 1.0  # How long take() waits for a read still running before the caller reads for itself.
+PREFETCH_WORKERS = 2
+
+
+class PrefetchCache:
+    def __init__(self, max_age=PREFETCH_MAX_AGE_SECONDS, workers=PREFETCH_WORKERS):
+        self.max_age = max_age
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self.reads = {}  # Key -> (future, generation, started at).
+        self.generation = 0  # Bumped by discard(), so reads still running then are never used.
+        self.lock = threading.Lock()
+        self.started = 0
+        self.used = 0
+        self.late = 0  # Still running PREFETCH_WAIT_SECONDS after they were asked for; the action read for itself.
+        self.discarded = 0
+
+    def start(self, key, read):
+        """Runs `read()` in the background for a later take(key); a read already pending for `key` is kept."""
+        traces = tracing.current_traces()
+
+        def run():
+            with tracing.use_traces(traces), tracing.span("agent.prefetch", read=key[0]):
+                return read()
+
+        with self.lock:
+            if key in self.reads:
+                return
+            self.reads[key] = (self.executor.submit(run), self.generation, time.monotonic())
+            self.started += 1
+
+    def current(self, generation):
+        return generation == self.generation
+
+    def take(self, key, wait=PREFETCH_WAIT_SECONDS):
+        """
+        The read for `key`, or None if there is no usable one. A read still running is waited for, up to
+        `wait` seconds: it started before the caller's own read could, so it normally finishes first.
+        """
+        with self.lock:
+            entry = self.reads.pop(key, None)
+            if entry is None:
+                return None
+            future, generation, started_at = entry
+        if not self.current(generation) or time.monotonic() - started_at > self.max_age:
+            return None
+        try:
+            with tracing.span("agent.prefetch_wait", read=key[0]):
+                value = future.result(timeout=wait)
+        except FutureTimeout:
+            with self.lock:
+                self.late += 1
+            return None
+        except Exception as e:
+            print(f"ERROR: Prefetched {key[0]} read failed: {e}")
+            return None
+        if not self.current(generation):
+            return None  # The desktop changed while we waited.
+        with self.lock:
+            self.used += 1
+        return value
+
+    def generation_now(self):
+        with self.lock:
+            return self.generation
+
+    def discard(self):
+        """Drops every pending read: the desktop is about to change."""
+        with self.lock:
+            self.generation += 1
+            self.discarded += len(self.reads)
+            for future, _, _ in self.reads.values():
+                future.cancel()
+            self.reads.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"started": self.started, "used": self.used, "late": self.late, "discarded": self.discarded,
+                    "pending": len(self.reads)}
+
+
+prefetched = PrefetchCache()
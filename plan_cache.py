@@ -0,0 +1,192 @@
+# --- plan_cache.py ---
+# Remembers the actions that completed an objective, so the same kind of objective can be replayed
+# without asking the agent model for every step. Argument values that appear word-for-word in the
+# objective become slots: "open whatsapp and message Mom" is stored as "open whatsapp and message {0}"
+# and also serves "open whatsapp and message Dad".
+
+import os
+import re
+import json
+import time
+import threading
+
+PLAN_CACHE_PATH = os.environ.get("JARVIS_PLAN_CACHE", "./plan_cache.json")
+MAX_PLANS = 200
+MAX_FAILURES = 3  # A plan that fails this many times more than it succeeds is forgotten.
+# Actions that only look at the screen. The model needs them to decide; a replay doesn't.
+OBSERVE_ONLY = {"LIST_OPEN_WINDOWS", "GET_WINDOW_ELEMENTS", "FIND_ELEMENTS"}
+
+_SLOT = re.compile(r"\{(\d+)\}")
+
+
+def normalize(objective):
+    return re.sub(r"\s+", " ", objective).strip().rstrip(".!?").strip()
+
+
+def _escape(text):
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+class Plan:
+    def __init__(self, template, steps, finish, examples=(), successes=0, failures=0, last_used=None):
+        self.template = template  # Normalized, lowercased objective with {n} slots (literal braces doubled).
+        self.steps = steps  # [{"action": ..., "args": {...}}] with {n} slots in the string values.
+        self.finish = finish
+        self.examples = list(examples)  # The slot values the plan was recorded with.
+        self.successes = successes
+        self.failures = failures
+        self.last_used = last_used or time.time()
+        parts = re.split(r"\{\d+\}", template)
+        literal = [re.escape(p.replace("{{", "{").replace("}}", "}")) for p in parts]
+        self.pattern = re.compile("(.+?)".join(literal), re.IGNORECASE)
+        self.specificity = sum(len(p) for p in parts)
+
+    def bind(self, objective):
+        """The slot values for `objective`, or None when it doesn't fit this plan's template."""
+        match = self.pattern.fullmatch(normalize(objective))
+        return list(match.groups()) if match else None
+
+    def instantiate(self, slots):
+        """The plan's (action, args) steps and finish reason with the slots filled in."""
+        # "open whatsapp" replays the recorded "WhatsApp": window titles match case-sensitively.
+        slots = [example if example.lower() == value.lower() else value
+                 for value, example in zip(slots, self.examples + slots[len(self.examples):])]
+        fill = lambda value: value.format(*slots) if isinstance(value, str) else value
+        return [(s["action"], {k: fill(v) for k, v in s["args"].items()}) for s in self.steps], fill(self.finish)
+
+    def to_dict(self):
+        return {"template": self.template, "steps": self.steps, "finish": self.finish, "examples": self.examples,
+                "successes": self.successes, "failures": self.failures, "last_used": self.last_used}
+
+
+def make_plan(objective, trace, finish_reason):
+    """
+    Builds a plan from a finished task's (action, args, observation) trace, dropping failed and
+    observe-only steps. Returns None when nothing is worth replaying.
+    """
+    steps = [(a, args) for a, args, observation in trace if a not in OBSERVE_ONLY and "Error" not in observation]
+    if not steps:
+        return None
+    objective = normalize(objective)
+    values = {v for _, args in steps for v in args.values() if isinstance(v, str) and len(v.strip()) >= 2}
+    # Only exact-case, whole-word occurrences become slots; a model-capitalized "WhatsApp" for
+    # "open whatsapp" stays literal.
+    found = {}
+    for v in values:
+        match = re.search(rf"(?<!\w){re.escape(v)}(?!\w)", objective)
+        if match: found[v] = match.start()
+    # Slots are numbered in the order they appear in the objective (the order bind() returns them),
+    # and substituted longest first so a value inside a longer one doesn't split it.
+    slots = sorted(found, key=found.get)
+
+    def templated(text):
+        text = _escape(text)
+        for value in sorted(slots, key=len, reverse=True):
+            n = slots.index(value)
+            text = re.sub(rf"(?<!\w){re.escape(_escape(value))}(?!\w)", lambda _: f"{{{n}}}", text)
+        return text
+
+    template = templated(objective)
+    if [int(n) for n in _SLOT.findall(template)] != list(range(len(slots))):
+        return None  # Overlapping or repeated values; the template wouldn't bind them unambiguously.
+    plan_steps = [{"action": a, "args": {k: templated(v) if isinstance(v, str) else v for k, v in args.items()}} for a, args in steps]
+    return Plan(template.lower(), plan_steps, templated(finish_reason or "Objective complete."), slots)
+
+
+class PlanCache:
+    def __init__(self, path=PLAN_CACHE_PATH, max_plans=MAX_PLANS):
+        self.path = path
+        self.max_plans = max_plans
+        self.plans = {}
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.replays_completed = 0
+        self.fallbacks = 0
+        self.replay_seconds = 0.0
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for entry in json.load(f):
+                    plan = Plan(**entry)
+                    self.plans[plan.template] = plan
+            print(f"INFO: Loaded {len(self.plans)} cached action plans.")
+        except Exception as e:
+            print(f"ERROR: Could not read the plan cache at {self.path}: {e}")
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump([p.to_dict() for p in self.plans.values()], f, indent=1)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"ERROR: Could not save the plan cache to {self.path}: {e}")
+
+    def lookup(self, objective):
+        """The most specific plan whose template fits `objective`, with its slot values, or (None, None)."""
+        with self.lock:
+            self.lookups += 1
+            best, best_slots = None, None
+            for plan in self.plans.values():
+                slots = plan.bind(objective)
+                if slots is not None and (best is None or plan.specificity > best.specificity):
+                    best, best_slots = plan, slots
+            if best:
+                self.hits += 1
+                best.last_used = time.time()
+            return best, best_slots
+
+    def record(self, objective, trace, finish_reason):
+        """Stores (or refreshes) the plan for a task that finished."""
+        plan = make_plan(objective, trace, finish_reason)
+        if plan is None:
+            return None
+        with self.lock:
+            existing = self.plans.get(plan.template)
+            if existing and existing.steps == plan.steps:
+                existing.successes += 1
+                existing.last_used = time.time()
+            else:
+                plan.successes = 1
+                self.plans[plan.template] = plan
+                while len(self.plans) > self.max_plans:
+                    del self.plans[min(self.plans.values(), key=lambda p: p.last_used).template]
+            self._save()
+        return plan
+
+    def replay_finished(self, plan, seconds, completed):
+        """Records how a replay went; a plan that keeps diverging is dropped."""
+        with self.lock:
+            self.replay_seconds += seconds
+            if completed:
+                self.replays_completed += 1
+                plan.successes += 1
+            else:
+                self.fallbacks += 1
+                plan.failures += 1
+                if plan.failures - plan.successes >= MAX_FAILURES and self.plans.get(plan.template) is plan:
+                    del self.plans[plan.template]
+            self._save()
+
+    def stats(self):
+        with self.lock:
+            replays = self.replays_completed + self.fallbacks
+            return {
+                "plans": len(self.plans),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+                "replays_completed": self.replays_completed,
+                "fallbacks": self.fallbacks,
+                "average_replay_seconds": round(self.replay_seconds / replays, 3) if replays else 0.0,
+            }
+
+
+plans = PlanCache()
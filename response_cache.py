@@ -0,0 +1,142 @@
+# --- response_cache.py ---
+# Answers repeated chat questions without the chat model. A response is keyed by a fingerprint of the
+# normalized command and the last few history messages, held in an in-memory LRU in front of a small
+# SQLite file (so it survives restarts), and expires after a TTL.
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+RESPONSE_CACHE_PATH = os.environ.get("JARVIS_RESPONSE_CACHE", "./response_cache.db")  # "" keeps it in memory only.
+RESPONSE_CACHE_TTL_SECONDS = int(os.environ.get("JARVIS_RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+MEMORY_ENTRIES = 512
+DISK_ENTRIES = 20000
+HISTORY_WINDOW = 4  # Earlier messages that must also match for an answer to be reused.
+REPLAY_WORDS_PER_CHUNK = 3
+
+_PUNCTUATION = re.compile(r"[\s?!.,;:]+$")
+
+
+def normalize(text):
+    """Case, spacing and trailing punctuation don't change what is being asked."""
+    return _PUNCTUATION.sub("", re.sub(r"\s+", " ", text).strip().lower())
+
+
+def fingerprint(history, command, namespace=""):
+    """
+    Cache key for answering `command` after `history` (the webapp's [{'role', 'parts'}] list, which
+    may already end with the command). `namespace` separates models and generation settings.
+    """
+    earlier = [m for m in history if m['parts'][0] != command][-HISTORY_WINDOW:]
+    material = [namespace, [(m['role'], normalize(m['parts'][0])) for m in earlier], normalize(command)]
+    return hashlib.sha256(json.dumps(material).encode("utf-8")).hexdigest()
+
+
+def replay(response):
+    """Yields a cached response in word-sized chunks, the way the model's stream arrives."""
+    words = re.findall(r"\S+\s*|\s+", response)
+    for i in range(0, len(words), REPLAY_WORDS_PER_CHUNK):
+        yield "".join(words[i:i + REPLAY_WORDS_PER_CHUNK])
+
+
+class ResponseCache:
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttl=RESPONSE_CACHE_TTL_SECONDS, memory_entries=MEMORY_ENTRIES, disk_entries=DISK_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.memory = OrderedDict()  # key -> (response, created_at)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self._db = None
+        self._opened = False
+
+    def _database(self):
+        """The SQLite store, opened on first use (None when disabled or unavailable). Call with the lock held."""
+        if not self._opened:
+            self._opened = True
+            if self.path:
+                try:
+                    self._db = sqlite3.connect(self.path, check_same_thread=False)
+                    self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, last_hit REAL NOT NULL)")
+                    self._db.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,))
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    print(f"ERROR: Response cache at {self.path} unavailable, keeping it in memory only: {e}")
+                    self._db = None
+        return self._db
+
+    def get(self, key):
+        """The cached response for `key`, or None."""
+        now = time.time()
+        with self.lock:
+            db = self._database()
+            entry = self.memory.get(key)
+            if entry is None and db is not None:
+                row = db.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row:
+                    entry = self._remember(key, row[0], row[1])
+            if entry is not None and now - entry[1] > self.ttl:
+                self._forget(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.memory.move_to_end(key)
+            self.hits += 1
+            if db is not None:
+                db.execute("UPDATE responses SET last_hit = ? WHERE key = ?", (now, key))
+                db.commit()
+            return entry[0]
+
+    def put(self, key, response):
+        now = time.time()
+        with self.lock:
+            self._remember(key, response, now)
+            self.stores += 1
+            db = self._database()
+            if db is not None:
+                db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, response, now, now))
+                if self.stores % 100 == 0:
+                    self._trim_disk(db, now)
+                db.commit()
+
+    def _remember(self, key, response, created_at):
+        entry = self.memory[key] = (response, created_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+        return entry
+
+    def _forget(self, key):
+        self.memory.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._db.commit()
+
+    def _trim_disk(self, db, now):
+        db.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        db.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_hit DESC LIMIT -1 OFFSET ?)", (self.disk_entries,))
+
+    def stats(self):
+        with self.lock:
+            db = self._database()
+            disk = db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] if db is not None else 0
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "memory_entries": len(self.memory),
+                "disk_entries": disk,
+            }
+
+
+responses = ResponseCache()
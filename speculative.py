@@ -0,0 +1,130 @@
+# --- speculative.py ---
+# Speculative decoding for the agent's short greedy JSON answers. A prompt-lookup drafter guesses the
+# next few tokens by finding the current n-gram earlier in the prompt, in the TOOLKIT action templates
+# or in the task's previous actions; one forward pass then checks all the guesses at once. Tokens are
+# still chosen by greedy argmax over the processed logits, so the output matches plain greedy decoding.
+
+import time
+import threading
+
+import torch
+
+import tracing
+
+DRAFT_TOKENS = 8  # Most tokens guessed per forward pass.
+MIN_NGRAM = 2  # Shorter matches (a lone '"') predict too little to be worth verifying.
+MAX_NGRAM = 4
+
+_stats_lock = threading.Lock()
+speculative_stats = {"generations": 0, "forward_passes": 0, "generated_tokens": 0, "drafted_tokens": 0, "accepted_tokens": 0}
+
+
+def get_stats():
+    """Totals plus the draft acceptance rate and the tokens produced per forward pass."""
+    with _stats_lock:
+        stats = dict(speculative_stats)
+    stats["acceptance_rate"] = round(stats["accepted_tokens"] / stats["drafted_tokens"], 3) if stats["drafted_tokens"] else 0.0
+    stats["tokens_per_forward"] = round(stats["generated_tokens"] / stats["forward_passes"], 2) if stats["forward_passes"] else 0.0
+    return stats
+
+
+class PromptLookupDrafter:
+    """
+    Indexes every n-gram (MIN_NGRAM..MAX_NGRAM tokens) of the prompt and the extra `corpora` by the position
+    that follows it. A proposal continues the longest n-gram ending the live sequence from its most recent
+    earlier occurrence; tokens generated in this call take priority, then the corpora, then the prompt.
+    """
+
+    def __init__(self, prompt_ids, corpora=(), draft_tokens=DRAFT_TOKENS):
+        self.draft_tokens = draft_tokens
+        self.sequences = [list(prompt_ids)]
+        self.index = {}
+        self._index(0, 0)
+        for ids in corpora:
+            self.sequences.append(list(ids))
+            self._index(len(self.sequences) - 1, 0)
+
+    def _index(self, seq_no, start):
+        seq = self.sequences[seq_no]
+        for p in range(max(start, 1), len(seq)):  # p: the token that follows the n-gram.
+            for n in range(MIN_NGRAM, min(MAX_NGRAM, p) + 1):
+                self.index[tuple(seq[p - n:p])] = (seq_no, p)
+
+    def extend(self, token_ids):
+        """Appends generated tokens to the live sequence (the prompt) and indexes the new n-grams."""
+        live = self.sequences[0]
+        start = len(live)
+        live.extend(token_ids)
+        self._index(0, start)
+
+    def propose(self):
+        live = self.sequences[0]
+        for n in range(min(MAX_NGRAM, len(live)), MIN_NGRAM - 1, -1):
+            hit = self.index.get(tuple(live[-n:]))
+            if hit:
+                seq_no, p = hit
+                return self.sequences[seq_no][p:p + self.draft_tokens]
+        return []
+
+
+@torch.no_grad()
+def greedy_generate(model, prompt_ids, past_key_values, cached_tokens, drafter, max_new_tokens, eos_token_id,
+                    logits_processor=None, stopping_criteria=None, grammar=None):
+    """
+    Greedy generation with drafted tokens verified in one forward pass each.
+    `past_key_values` (a DynamicCache, possibly empty) holds the first `cached_tokens` prompt tokens and
+    is left holding every token of the returned sequence except the last, like `generate()` leaves it.
+    With a `grammar` processor, drafts are cut at the first token the grammar can't accept.
+    """
+    device = model.device
+    ids = list(prompt_ids)
+    pending = ids[cached_tokens:]  # Tokens not yet in the cache.
+    generated = drafted = accepted = passes = 0
+    done = False
+    start = time.perf_counter()
+    first_token_time = None
+    while not done:
+        draft = drafter.propose()[:max(0, max_new_tokens - generated - 1)]
+        if grammar is not None:
+            for j in range(len(draft)):
+                if grammar.state_for(ids[grammar.prompt_length:] + draft[:j + 1]) is None:
+                    draft = draft[:j]
+                    break
+        logits = model(input_ids=torch.tensor([pending + draft], device=device), past_key_values=past_key_values,
+                       use_cache=True).logits[0, len(pending) - 1:].float()
+        passes += 1
+        drafted += len(draft)
+        # logits[j] scores the token after `ids + draft[:j]`: keep drafts while they equal the greedy choice,
+        # and the first differing position still yields a correct token.
+        new_tokens = []
+        for j in range(len(draft) + 1):
+            context = torch.tensor([ids + new_tokens], device=device)
+            scores = logits[j:j + 1]
+            if logits_processor is not None:
+                scores = logits_processor(context, scores)
+            token = int(scores.argmax(-1))
+            new_tokens.append(token)
+            context = torch.tensor([ids + new_tokens], device=device)
+            done = (token == eos_token_id or generated + len(new_tokens) >= max_new_tokens
+                    or bool(stopping_criteria and stopping_criteria(context, scores).any()))
+            if done or j == len(draft) or token != draft[j]:
+                break
+            accepted += 1
+        ids.extend(new_tokens)
+        generated += len(new_tokens)
+        first_token_time = first_token_time or time.perf_counter()  # The first pass is the prefill.
+        drafter.extend(new_tokens)
+        # The last chosen token hasn't been through the model yet; drop cached rejected drafts.
+        keep = len(ids) - 1
+        if past_key_values.get_seq_length() > keep:
+            past_key_values.crop(keep - past_key_values.get_seq_length())
+        pending = ids[-1:]
+    with _stats_lock:
+        speculative_stats["generations"] += 1
+        speculative_stats["forward_passes"] += passes
+        speculative_stats["generated_tokens"] += generated
+        speculative_stats["drafted_tokens"] += drafted
+        speculative_stats["accepted_tokens"] += accepted
+    tracing.record_span("llm.prefill", start, first_token_time, model="agent")
+    tracing.record_span("llm.decode", first_token_time, model="agent")
+    return ids
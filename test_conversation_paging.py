@@ -0,0 +1,86 @@
+# --- test_conversation_paging.py ---
+# The conversation and message listings: a bare list when no page is asked for, and cursor paging
+# (`limit`, `before`, `next_cursor`) that neither repeats nor skips rows at page boundaries.
+
+import os
+import tempfile
+import uuid
+
+import pytest
+
+os.environ.setdefault('JARVIS_DATABASE', os.path.join(tempfile.mkdtemp(), 'jarvis_test.db'))
+import webapp
+
+
+@pytest.fixture
+def client():
+    """A test client signed in as a new user, so every test starts with no conversations."""
+    with webapp.app.app_context():
+        webapp.create_database_if_needed()
+    client = webapp.app.test_client()
+    client.post('/signup', data={'email': f"{uuid.uuid4().hex}@example.com", 'password': 'pw'})
+    return client
+
+
+def _new_conversations(client, count):
+    return [client.post('/api/conversations').get_json()['id'] for _ in range(count)]
+
+
+def _add_messages(convo_id, count):
+    with webapp.app.app_context():
+        for i in range(count):
+            webapp.db.session.add(webapp.Message(sender='user', text=f"message {i}", conversation_id=convo_id))
+        webapp.db.session.commit()
+
+
+def _page_through(client, url, key, limit):
+    """Every page of a listing, following next_cursor until it runs out."""
+    pages, cursor = [], None
+    while True:
+        page = client.get(url, query_string={'limit': limit, **({'before': cursor} if cursor else {})}).get_json()
+        pages.append(page[key])
+        cursor = page['next_cursor']
+        if cursor is None:
+            return pages
+
+
+# --- Unpaged requests keep the original shape ---
+def test_unpaged_listings_are_bare_lists(client):
+    ids = _new_conversations(client, 3)
+    assert [c['id'] for c in client.get('/api/conversations').get_json()] == ids[::-1]
+    _add_messages(ids[0], 3)
+    assert [m['text'] for m in client.get(f"/api/conversations/{ids[0]}").get_json()] == ["message 0", "message 1", "message 2"]
+
+
+def test_empty_listings(client):
+    assert client.get('/api/conversations').get_json() == []
+    assert client.get('/api/conversations', query_string={'limit': 5}).get_json() == {'conversations': [], 'next_cursor': None}
+    convo_id = _new_conversations(client, 1)[0]
+    assert client.get(f"/api/conversations/{convo_id}").get_json() == []
+    assert client.get(f"/api/conversations/{convo_id}", query_string={'limit': 5}).get_json() == {'messages': [], 'next_cursor': None}
+
+
+# --- Page boundaries ---
+@pytest.mark.parametrize('count, sizes', [(4, [4]), (5, [4, 1]), (8, [4, 4]), (9, [4, 4, 1])])
+def test_conversation_pages_cover_every_row_once(client, count, sizes):
+    ids = _new_conversations(client, count)
+    pages = _page_through(client, '/api/conversations', 'conversations', 4)
+    assert [len(page) for page in pages] == sizes
+    assert [c['id'] for page in pages for c in page] == ids[::-1]
+
+
+@pytest.mark.parametrize('count, sizes', [(3, [3]), (4, [3, 1]), (6, [3, 3])])
+def test_message_pages_are_oldest_first_and_go_back_in_time(client, count, sizes):
+    convo_id = _new_conversations(client, 1)[0]
+    _add_messages(convo_id, count)
+    pages = _page_through(client, f"/api/conversations/{convo_id}", 'messages', 3)
+    assert [len(page) for page in pages] == sizes
+    texts = [m['text'] for page in reversed(pages) for m in page]
+    assert texts == [f"message {i}" for i in range(count)]
+
+
+def test_before_alone_pages_with_the_default_size(client):
+    ids = _new_conversations(client, 3)
+    page = client.get('/api/conversations', query_string={'before': ids[-1]}).get_json()
+    assert [c['id'] for c in page['conversations']] == ids[-2::-1]
+    assert page['next_cursor'] is None
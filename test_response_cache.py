@@ -0,0 +1,113 @@
+# --- test_response_cache.py ---
+# The chat response cache: what counts as the same question, expiry and eviction, and which replies
+# stream_simple_command is allowed to store.
+
+import response_cache
+import assistant_core
+from response_cache import ResponseCache, fingerprint
+
+
+def _history(*texts):
+    return [{'role': 'user' if i % 2 == 0 else 'model', 'parts': [text]} for i, text in enumerate(texts)]
+
+
+# --- Keys ---
+def test_key_ignores_case_spacing_and_trailing_punctuation():
+    history = _history("Hi there", "Hello!")
+    assert fingerprint(history, "What's the  weather?") == fingerprint(_history("hi THERE", "hello"), "what's the weather")
+
+
+def test_key_depends_on_command_history_and_namespace():
+    history = _history("Hi there", "Hello!")
+    key = fingerprint(history, "what's the weather", "model-a")
+    assert key != fingerprint(history, "what's the time", "model-a")
+    assert key != fingerprint(_history("Hi there", "Hey!"), "what's the weather", "model-a")
+    assert key != fingerprint(history, "what's the weather", "model-b")
+
+
+def test_key_ignores_the_command_in_history_and_older_messages():
+    earlier = _history("one", "two", "three", "four", "five")
+    assert fingerprint(earlier + _history("ask"), "ask") == fingerprint(earlier, "ask")
+    window = response_cache.HISTORY_WINDOW
+    older = _history("something else entirely") + earlier[-window:]
+    assert fingerprint(older, "ask") == fingerprint(earlier[-window:], "ask")
+
+
+# --- Expiry and eviction ---
+def test_entries_expire_after_ttl(monkeypatch):
+    cache = ResponseCache(path="", ttl=60)
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    cache.put("k", "answer")
+    now[0] += 59
+    assert cache.get("k") == "answer"
+    now[0] += 2
+    assert cache.get("k") is None
+
+
+def test_memory_evicts_least_recently_used():
+    cache = ResponseCache(path="", memory_entries=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"  # "b" is now the least recently used.
+    cache.put("c", "C")
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("A", "C")
+
+
+def test_disk_entries_survive_a_restart_and_expire(tmp_path, monkeypatch):
+    path = str(tmp_path / "responses.db")
+    ResponseCache(path=path, ttl=60).put("k", "answer")
+    assert ResponseCache(path=path, ttl=60).get("k") == "answer"
+    later = response_cache.time.time() + 120
+    monkeypatch.setattr(response_cache.time, "time", lambda: later)
+    assert ResponseCache(path=path, ttl=60).get("k") is None
+
+
+# --- What stream_simple_command stores ---
+def _fake_model(monkeypatch, chunks, error=None):
+    calls = []
+
+    def stream_chat_response(history, command):
+        calls.append(command)
+        yield from chunks
+        if error:
+            raise error
+    monkeypatch.setattr(assistant_core.local_llm_handler, "stream_chat_response", stream_chat_response)
+    cache = ResponseCache(path="")
+    monkeypatch.setattr(response_cache, "responses", cache)
+    return cache, calls
+
+
+def test_complete_reply_is_cached_and_replayed(monkeypatch):
+    cache, calls = _fake_model(monkeypatch, ["It is ", "sunny."])
+    assert "".join(assistant_core.stream_simple_command(_history("weather?"), "weather?")) == "It is sunny."
+    assert "".join(assistant_core.stream_simple_command(_history("Weather"), "Weather")) == "It is sunny."
+    assert calls == ["weather?"]
+    assert cache.stats()["hits"] == 1
+
+
+def test_opted_out_conversation_neither_reads_nor_writes(monkeypatch):
+    cache, calls = _fake_model(monkeypatch, ["It is ", "sunny."])
+    history = _history("weather?")
+    key = fingerprint(history, "weather?", assistant_core._chat_cache_namespace())
+    cache.put(key, "A cached answer.")
+    assert "".join(assistant_core.stream_simple_command(history, "weather?", use_cache=False)) == "It is sunny."
+    assert calls == ["weather?"]
+    assert cache.get(key) == "A cached answer."
+
+
+def test_stalled_reply_is_marked_and_not_cached(monkeypatch):
+    stalled = assistant_core.local_llm_handler.StreamStalled("cut short")
+    cache, _ = _fake_model(monkeypatch, ["It is "], error=stalled)
+    reply = "".join(assistant_core.stream_simple_command(_history("weather?"), "weather?"))
+    assert reply == "It is " + assistant_core.CUT_SHORT_NOTE
+    assert cache.stats()["memory_entries"] == 0
+
+
+def test_disconnected_client_reply_is_not_cached(monkeypatch):
+    cache, _ = _fake_model(monkeypatch, ["It is ", "sunny."])
+    stream = assistant_core.stream_simple_command(_history("weather?"), "weather?")
+    next(stream)
+    stream.close()
+    assert cache.stats()["memory_entries"] == 0
@@ -0,0 +1,256 @@
+# --- tracing.py ---
+# Lightweight spans for the request path: HTTP requests, database queries, prompt building, tokenization,
+# prefill and decode, agent steps and desktop actions. Every span's duration goes into a latency histogram
+# per span name (and labels), served in Prometheus text format by the webapp's /metrics route. With
+# JARVIS_TRACE_DIR set, the spans of each HTTP request, chat stream and agent job are also written there as
+# a Chrome trace (open it in chrome://tracing or ui.perfetto.dev). JARVIS_TRACING=0 makes every span a no-op.
+
+import os
+import re
+import json
+import time
+import uuid
+import bisect
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+TRACING_ENABLED = os.environ.get("JARVIS_TRACING", "1") != "0"
+TRACE_DIR = os.environ.get("JARVIS_TRACE_DIR", "")
+# Histogram bucket upper bounds, in seconds: from a cached SQLite read up to a whole agent task.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+MAX_TRACE_EVENTS = 20000  # A trace this long stops collecting instead of growing without bound.
+
+# The traces that spans recorded in the current context belong to (usually one; a batch serves several).
+_active_traces = ContextVar("jarvis_active_traces", default=())
+_histograms = {}  # (span name, sorted label pairs) -> _Histogram
+_lock = threading.Lock()
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # The last slot is +Inf.
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+
+
+def record_span(name, start, end=None, **labels):
+    """Records an operation that ran from `start` to `end` (time.perf_counter() values; `end` defaults to now)."""
+    if not TRACING_ENABLED:
+        return
+    end = time.perf_counter() if end is None else end
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram()
+        histogram.observe(max(end - start, 0.0))
+    for trace in _active_traces.get():
+        trace.add(name, start, end, labels)
+
+
+class Span:
+    """One timed operation; use it as a context manager, or call end() yourself."""
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.start = time.perf_counter()
+
+    def set(self, **labels):
+        self.labels.update(labels)
+
+    def end(self):
+        record_span(self.name, self.start, **self.labels)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end()
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **labels):
+        pass
+
+    def end(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name, **labels):
+    """A span starting now. Labels become Prometheus labels, so keep their values to a small fixed set."""
+    if not TRACING_ENABLED:
+        return _NOOP_SPAN
+    return Span(name, labels)
+
+
+def traced(name):
+    """Decorator: every call of the function is a `name` span."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACING_ENABLED:
+                return func(*args, **kwargs)
+            with Span(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# --- Per-request Chrome traces ---
+class Trace:
+    """The spans of one request, chat stream or agent job, written to TRACE_DIR when it finishes."""
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.started_at = time.time()
+        self.events = []
+        self.lock = threading.Lock()
+
+    def add(self, name, start, end, labels):
+        event = {"name": name, "cat": name.split(".", 1)[0], "ph": "X", "ts": round(start * 1e6, 1),
+                 "dur": round((end - start) * 1e6, 1), "pid": os.getpid(), "tid": threading.get_ident()}
+        if labels:
+            event["args"] = {k: str(v) for k, v in labels.items()}
+        with self.lock:
+            if len(self.events) < MAX_TRACE_EVENTS:
+                self.events.append(event)
+
+    def finish(self):
+        """Writes the trace file and returns its path (None when no span was recorded)."""
+        with self.lock:
+            events = list(self.events)
+        if not events:
+            return None
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started_at))
+        path = os.path.join(TRACE_DIR, f"{stamp}-{re.sub(r'[^A-Za-z0-9]+', '-', self.name).strip('-')[:60]}-{self.id}.json")
+        try:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"name": self.name}}, f)
+        except OSError as e:
+            print(f"ERROR: Could not write trace {path}: {e}")
+            return None
+        return path
+
+
+def new_trace(name):
+    """A Trace to collect a request's spans into, or None when Chrome traces aren't being written."""
+    return Trace(name) if TRACING_ENABLED and TRACE_DIR else None
+
+
+def begin_trace(name):
+    """Starts collecting the current context's spans into a new trace; pass the result to end_trace()."""
+    trace = new_trace(name)
+    if trace is None:
+        return None
+    return trace, _active_traces.set(_active_traces.get() + (trace,))
+
+
+def end_trace(handle):
+    if handle is None:
+        return
+    trace, token = handle
+    _active_traces.reset(token)
+    trace.finish()
+
+
+@contextmanager
+def trace(name):
+    """Collects every span recorded in the block (including the model work it submits) into one trace."""
+    handle = begin_trace(name)
+    try:
+        yield handle[0] if handle else None
+    finally:
+        end_trace(handle)
+
+
+def current_traces():
+    """The active traces, to hand to another thread that works on this request (see use_traces)."""
+    return _active_traces.get()
+
+
+@contextmanager
+def use_traces(traces):
+    """Adds the spans recorded in the block to `traces`, captured with current_traces() on another thread."""
+    if not traces:
+        yield
+        return
+    token = _active_traces.set(tuple(traces))
+    try:
+        yield
+    finally:
+        _active_traces.reset(token)
+
+
+def iterate_in_trace(trace, iterator):
+    """
+    Yields from `iterator` with `trace` active only while each item is produced, so a generator consumed
+    chunk by chunk (an SSE stream) records into its own trace without leaking it into the consumer.
+    """
+    try:
+        while True:
+            with use_traces((trace,) if trace else ()):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close:
+            close()
+
+
+# --- Prometheus exposition ---
+def _label_text(pairs):
+    def escape(value):
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{k}="{escape(v)}"' for k, v in pairs)
+
+
+def metrics_text():
+    """Every span histogram in the Prometheus text exposition format."""
+    with _lock:
+        snapshot = sorted((key, list(h.counts), h.sum) for key, h in _histograms.items())
+    lines = [
+        "# HELP jarvis_span_seconds Duration of traced operations (HTTP requests, queries, model and agent steps).",
+        "# TYPE jarvis_span_seconds histogram",
+    ]
+    for (name, labels), counts, total in snapshot:
+        base = _label_text((("span", name),) + labels)
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (None,), counts):
+            cumulative += count
+            le = "+Inf" if bound is None else repr(bound)
+            lines.append(f'jarvis_span_seconds_bucket{{{base},le="{le}"}} {cumulative}')
+        lines.append(f"jarvis_span_seconds_sum{{{base}}} {total:.6f}")
+        lines.append(f"jarvis_span_seconds_count{{{base}}} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Clears every histogram (for benchmarks that measure one run at a time)."""
+    with _lock:
+        _histograms.clear()
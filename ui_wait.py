@@ -0,0 +1,85 @@
+# --- ui_wait.py ---
+# Condition-based waits for desktop actions: poll for what we are actually waiting on (a window to appear,
+# an element to become visible, focus to settle) with an adaptive backoff, instead of sleeping a worst case.
+
+import time
+import threading
+from collections import defaultdict
+
+DEFAULT_TIMEOUT = 10.0
+INITIAL_INTERVAL = 0.05
+MAX_INTERVAL = 0.5
+BACKOFF = 1.5
+
+_stats_lock = threading.Lock()
+wait_stats = {"waits": 0, "timeouts": 0, "polls": 0, "seconds": 0.0}
+_thread_seconds = defaultdict(float)  # Thread id -> seconds spent waiting, to tell concurrent waits apart.
+
+
+def _record(polls, seconds, timed_out):
+    with _stats_lock:
+        wait_stats["waits"] += 1
+        wait_stats["polls"] += polls
+        wait_stats["seconds"] += seconds
+        wait_stats["timeouts"] += int(timed_out)
+        _thread_seconds[threading.get_ident()] += seconds
+
+
+def get_wait_stats():
+    """Totals across all waits so far: how many, how many timed out, polls made and seconds spent."""
+    with _stats_lock:
+        return dict(wait_stats, seconds=round(wait_stats["seconds"], 3))
+
+
+def get_thread_wait_seconds():
+    """Seconds the calling thread has spent in waits so far."""
+    with _stats_lock:
+        return _thread_seconds[threading.get_ident()]
+
+
+def wait_until(condition, timeout=DEFAULT_TIMEOUT, description="", initial_interval=INITIAL_INTERVAL, max_interval=MAX_INTERVAL):
+    """
+    Polls `condition()` until it returns something truthy and returns that value, or None after `timeout`.
+    The poll interval starts short and grows, so fast UIs return quickly and slow ones aren't hammered.
+    Exceptions from `condition` count as "not yet" (the element or window may not exist yet).
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    interval, polls = initial_interval, 0
+    while True:
+        polls += 1
+        try:
+            result = condition()
+        except Exception:
+            result = None
+        if result:
+            _record(polls, time.monotonic() - start, False)
+            return result
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            _record(polls, time.monotonic() - start, True)
+            if description:
+                print(f"WAIT: Timed out after {timeout}s waiting for {description}.")
+            return None
+        time.sleep(min(interval, remaining))
+        interval = min(interval * BACKOFF, max_interval)
+
+
+def wait_until_stable(read, settle_time=0.3, timeout=3.0, description=""):
+    """
+    Waits until `read()` returns the same value for `settle_time` seconds and returns that value
+    (the last value read if `timeout` comes first). Used where there is no single event to wait for,
+    e.g. focus and window titles settling after a keystroke.
+    """
+    state = {"value": None, "since": None}
+
+    def settled():
+        value = read()
+        now = time.monotonic()
+        if state["since"] is None or value != state["value"]:
+            state["value"], state["since"] = value, now
+            return False
+        return now - state["since"] >= settle_time
+
+    wait_until(settled, timeout=timeout, description=description, max_interval=settle_time / 2)
+    return state["value"]
@@ -1,14 +1,16 @@
 # --- webapp.py ---
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, Response
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, Response, g
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import assistant_core
-import os, sys, webbrowser, time, json
+import agent_jobs
+import tracing
+import os, sys, webbrowser, time, json, sqlite3, uuid, shutil, hmac
 from threading import Timer
-from sqlalchemy import inspect as sql_inspect
+from sqlalchemy import event, inspect as sql_inspect
 
 # APP SETUP
 def resource_path(relative_path):
@@ -19,19 +21,139 @@ def resource_path(relative_path):
 app = Flask(__name__, template_folder=resource_path('templates'), static_folder=resource_path('static'))
 if getattr(sys, 'frozen', False): application_path = os.path.dirname(sys.executable)
 else: application_path = os.path.dirname(os.path.abspath(__file__))
-db_path = os.path.join(application_path, 'database.db'); app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'; app.config['SECRET_KEY'] = 'a-very-secret-string-for-flask'
+db_path = os.environ.get('JARVIS_DATABASE') or os.path.join(application_path, 'database.db'); app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'; app.config['SECRET_KEY'] = 'a-very-secret-string-for-flask'
 UPLOAD_FOLDER = os.path.join(application_path, 'uploads');
 if not os.path.exists(UPLOAD_FOLDER): os.makedirs(UPLOAD_FOLDER)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER; db = SQLAlchemy(app); login_manager = LoginManager(app); login_manager.login_view = 'login'
+app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+
+# DATABASE ENGINE
+# Every Flask thread and streaming response shares one SQLite file. WAL lets readers run alongside the single
+# writer, and a writer waits up to DB_BUSY_TIMEOUT_SECONDS for the lock instead of failing with "database is locked".
+DB_POOL_SIZE = int(os.environ.get('JARVIS_DB_POOL_SIZE', '10')); DB_BUSY_TIMEOUT_SECONDS = 15
+SQLITE_PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': DB_BUSY_TIMEOUT_SECONDS * 1000, 'temp_store': 'MEMORY', 'cache_size': -8000}
+SQLITE_ENGINE_OPTIONS = {'pool_size': DB_POOL_SIZE, 'max_overflow': DB_POOL_SIZE, 'pool_timeout': 30, 'connect_args': {'timeout': DB_BUSY_TIMEOUT_SECONDS, 'check_same_thread': False}}
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = SQLITE_ENGINE_OPTIONS
+
+def apply_sqlite_pragmas(engine, pragmas=SQLITE_PRAGMAS):
+    """Runs `pragmas` on every new connection the engine opens."""
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection): return
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items(): cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+def trace_queries(engine):
+    """Times every statement the engine runs as a db.query span, labelled with its SQL verb."""
+    @event.listens_for(engine, 'before_cursor_execute')
+    def query_started(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_starts', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def query_finished(conn, cursor, statement, parameters, context, executemany):
+        tracing.record_span('db.query', conn.info['query_starts'].pop(), operation=statement.lstrip().split(None, 1)[0].upper())
+
+    @event.listens_for(engine, 'handle_error')
+    def query_failed(exception_context):
+        # A failed statement never reaches after_cursor_execute; drop its start so the list can't grow.
+        conn = exception_context.connection
+        if conn is not None and exception_context.statement is not None and conn.info.get('query_starts'):
+            conn.info['query_starts'].pop()
+
+db = SQLAlchemy(app)
+with app.app_context():
+    apply_sqlite_pragmas(db.engine)
+    if tracing.TRACING_ENABLED: trace_queries(db.engine)
+login_manager = LoginManager(app); login_manager.login_view = 'login'
 
 # DATABASE MODELS
 class User(UserMixin, db.Model): id=db.Column(db.Integer, primary_key=True); email=db.Column(db.String(100), unique=True); password_hash=db.Column(db.String(200)); conversations=db.relationship('Conversation', backref='user', cascade="all, delete-orphan")
-class Conversation(db.Model): id=db.Column(db.Integer, primary_key=True); title=db.Column(db.String(100), default='New Chat'); user_id=db.Column(db.Integer, db.ForeignKey('user.id')); messages=db.relationship('Message', backref='conversation', cascade="all, delete-orphan")
-class Message(db.Model): id=db.Column(db.Integer, primary_key=True); sender=db.Column(db.String(10)); text=db.Column(db.Text); is_long=db.Column(db.Boolean, default=False); conversation_id=db.Column(db.Integer, db.ForeignKey('conversation.id'))
+class Conversation(db.Model): id=db.Column(db.Integer, primary_key=True); title=db.Column(db.String(100), default='New Chat'); user_id=db.Column(db.Integer, db.ForeignKey('user.id'), index=True); cache_responses=db.Column(db.Boolean, default=True, nullable=False, server_default='1'); messages=db.relationship('Message', backref='conversation', cascade="all, delete-orphan")
+class Message(db.Model): id=db.Column(db.Integer, primary_key=True); sender=db.Column(db.String(10)); text=db.Column(db.Text); is_long=db.Column(db.Boolean, default=False); conversation_id=db.Column(db.Integer, db.ForeignKey('conversation.id'), index=True)
+
+# Listings are paged by id: `before` is the smallest id of the previous page (the `next_cursor` it returned).
+# A request with neither `limit` nor `before` gets the whole listing as a bare list, the shape it had before paging.
+CONVERSATIONS_PAGE_SIZE = 50; MESSAGES_PAGE_SIZE = 50; MAX_PAGE_SIZE = 200; CHAT_HISTORY_MESSAGES = 10
+
+def page_args(default_limit):
+    """(limit, before) for a paged listing, or None when the request asked for no page."""
+    if 'limit' not in request.args and 'before' not in request.args: return None
+    limit = request.args.get('limit', default_limit, type=int); before = request.args.get('before', type=int)
+    return min(max(limit, 1), MAX_PAGE_SIZE), before
+
+def newest_first_page(query, id_column, limit, before):
+    """One page of rows, newest first, and the cursor for the next (older) page, or None."""
+    if before: query = query.filter(id_column < before)
+    rows = query.order_by(id_column.desc()).limit(limit + 1).all()
+    return rows[:limit], (rows[limit - 1].id if len(rows) > limit else None)
+
+def recent_messages(convo_id, limit):
+    """The conversation's last `limit` messages, oldest first, fetched without loading the rest."""
+    messages, _ = newest_first_page(Message.query.filter_by(conversation_id=convo_id), Message.id, limit, None)
+    return messages[::-1]
+
+def save_turn(convo_id, command, user_text, response_text, session=None):
+    """
+    Stores one chat turn in a single transaction: the user's message, the assistant's reply, and a new
+    chat's title. Returns whether the reply counts as long (for the read-aloud button).
+    """
+    session = session or db.session
+    is_long = len(response_text.split()) > 15
+    session.add_all([Message(sender='user', text=user_text, conversation_id=convo_id), Message(sender='assistant', text=response_text, is_long=is_long, conversation_id=convo_id)])
+    session.flush()  # Take the write lock before reading, so no other writer can slip in between.
+    convo = session.get(Conversation, convo_id)
+    if convo and convo.title == 'New Chat' and command: convo.title = command[:50]
+    session.commit()
+    return is_long
+
+def begin_chat_turn(convo_id, command):
+    """The history for answering `command` in a conversation, and whether cached answers may be reused."""
+    # The turn is written once, when the reply is complete; until then the command is only in this history.
+    convo = db.session.get(Conversation, convo_id)
+    history = [{'role':'model' if m.sender=='assistant' else 'user', 'parts':[m.text]} for m in recent_messages(convo_id, CHAT_HISTORY_MESSAGES - 1)]
+    history.append({'role': 'user', 'parts': [command]})
+    return history, convo.cache_responses
+
+def finish_chat_turn(convo_id, command, response_text):
+    """Saves a streamed turn from outside the request (the response generator, or an ASGI worker thread)."""
+    with app.app_context():
+        try: save_turn(convo_id, command, command, response_text)
+        except Exception as e: print(f"CRITICAL ERROR saving chat turn: {e}"); db.session.rollback()
 
 @login_manager.user_loader
 def load_user(user_id): return db.session.get(User, int(user_id))
 
+# REQUEST TRACING
+# Each request is an http.request span labelled with its route pattern (never the raw path, which would make
+# a histogram per conversation id). Streamed bodies outlive the request; chat streams trace themselves.
+@app.before_request
+def start_request_span():
+    if not tracing.TRACING_ENABLED: return
+    # Scrapes and static files would bury the interesting traces.
+    if request.endpoint not in ('metrics', 'static'): g.request_trace = tracing.begin_trace(f"{request.method} {request.path}")
+    g.request_span = tracing.span('http.request', route=request.url_rule.rule if request.url_rule else 'unmatched', method=request.method)
+
+@app.teardown_request
+def end_request_span(error=None):
+    request_span = g.pop('request_span', None)
+    if request_span is None: return
+    request_span.end()
+    tracing.end_trace(g.pop('request_trace', None))
+
+# Prometheus authenticates with `Authorization: Bearer <JARVIS_METRICS_TOKEN>` (its bearer_token setting);
+# without the token, /metrics needs a login. The client address is never trusted: behind a reverse proxy on
+# the same host, every request comes from 127.0.0.1.
+METRICS_TOKEN = os.environ.get('JARVIS_METRICS_TOKEN', '')
+
+def _metrics_token_matches():
+    supplied = request.headers.get('Authorization', '')
+    return bool(METRICS_TOKEN) and hmac.compare_digest(supplied.encode(), f"Bearer {METRICS_TOKEN}".encode())
+
+@app.route('/metrics')
+def metrics():
+    if not current_user.is_authenticated and not _metrics_token_matches(): return login_manager.unauthorized()
+    return Response(tracing.metrics_text(), mimetype='text/plain; version=0.0.4')
+
 # AUTH & MAIN ROUTES
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -62,18 +184,44 @@ def index(): return render_template('index.html')
 @app.route('/api/conversations', methods=['GET', 'POST'])
 @login_required
 def handle_conversations():
-    if request.method == 'POST': new_convo = Conversation(user_id=current_user.id); db.session.add(new_convo); db.session.commit(); return jsonify({'id': new_convo.id, 'title': new_convo.title})
-    convos = Conversation.query.filter_by(user_id=current_user.id).order_by(Conversation.id.desc()).all(); return jsonify([{'id': c.id, 'title': c.title} for c in convos])
+    if request.method == 'POST': new_convo = Conversation(user_id=current_user.id); db.session.add(new_convo); db.session.commit(); return jsonify({'id': new_convo.id, 'title': new_convo.title, 'cache_responses': new_convo.cache_responses})
+    query = Conversation.query.filter_by(user_id=current_user.id); page = page_args(CONVERSATIONS_PAGE_SIZE)
+    describe = lambda c: {'id': c.id, 'title': c.title, 'cache_responses': c.cache_responses}
+    if page is None: return jsonify([describe(c) for c in query.order_by(Conversation.id.desc()).all()])
+    convos, next_cursor = newest_first_page(query, Conversation.id, *page)
+    return jsonify({'conversations': [describe(c) for c in convos], 'next_cursor': next_cursor})
 
-@app.route('/api/conversations/<int:convo_id>', methods=['GET', 'DELETE'])
+@app.route('/api/conversations/<int:convo_id>', methods=['GET', 'DELETE', 'PATCH'])
 @login_required
 def handle_single_conversation(convo_id):
     convo = db.session.get(Conversation, convo_id)
     if not convo or convo.user_id != current_user.id: return jsonify({'error': 'Unauthorized'}), 403
     if request.method == 'DELETE': db.session.delete(convo); db.session.commit(); return jsonify({'success': True})
-    messages = Message.query.filter_by(conversation_id=convo_id).order_by(Message.id.asc()).all(); return jsonify([{'sender': m.sender, 'text': m.text, 'is_long': m.is_long} for m in messages])
+    if request.method == 'PATCH':
+        # Per-conversation settings; currently whether chat answers may come from the response cache.
+        data = request.get_json(silent=True) or {}
+        if 'cache_responses' in data: convo.cache_responses = bool(data['cache_responses'])
+        db.session.commit(); return jsonify({'id': convo.id, 'title': convo.title, 'cache_responses': convo.cache_responses})
+    query = Message.query.filter_by(conversation_id=convo_id); page = page_args(MESSAGES_PAGE_SIZE)
+    describe = lambda m: {'id': m.id, 'sender': m.sender, 'text': m.text, 'is_long': m.is_long}
+    if page is None: return jsonify([describe(m) for m in query.order_by(Message.id.asc()).all()])
+    messages, next_cursor = newest_first_page(query, Message.id, *page)
+    return jsonify({'messages': [describe(m) for m in reversed(messages)], 'next_cursor': next_cursor})
+
+@app.route('/api/models')
+@login_required
+def model_status(): return jsonify(assistant_core.model_status())
+
+@app.route('/api/response-cache')
+@login_required
+def response_cache_stats(): return jsonify(assistant_core.response_cache_stats())
+
+@app.route('/api/plan-cache')
+@login_required
+def plan_cache_stats(): return jsonify(assistant_core.plan_cache_stats())
 
 # STREAMING ENDPOINT FOR SIMPLE CHAT
+# asgi_app.py serves this route, and the job status/stream routes below, on an event loop instead.
 @app.route('/stream-command')
 @login_required
 def stream_command_route():
@@ -81,32 +229,30 @@ def stream_command_route():
     convo_id = request.args.get('conversation_id')
     if not convo_id: return Response("Error: Missing conversation ID", mimetype='text/event-stream')
     
-    db.session.add(Message(sender='user', text=command, conversation_id=convo_id)); db.session.commit()
-    history = [{'role':'model' if m.sender=='assistant' else 'user', 'parts':[m.text]} for m in db.session.get(Conversation, convo_id).messages[-10:]]
+    history, use_cache = begin_chat_turn(convo_id, command)
+    # Nothing below touches the request's session, so its pooled connection is returned before streaming starts.
     def generate():
         full_response_text = ""
+        stream = assistant_core.stream_simple_command(history, command, use_cache=use_cache)
         try:
-            for chunk in assistant_core.stream_simple_command(history, command):
+            for chunk in stream:
                 yield f"data: {json.dumps(chunk)}\n\n"; full_response_text += chunk
         finally:
-            with app.app_context():
-                is_long = len(full_response_text.split()) > 15
-                db.session.add(Message(sender='assistant', text=full_response_text, is_long=is_long, conversation_id=convo_id))
-                convo = db.session.get(Conversation, convo_id)
-                if convo and convo.title == 'New Chat' and command: convo.title = command[:50]
-                db.session.commit()
-            yield "data: [DONE]\n\n"
+            # Closing the stream right away cancels generation if the client disconnected.
+            stream.close()
+            finish_chat_turn(convo_id, command, full_response_text)
+        yield "data: [DONE]\n\n"
     return Response(generate(), mimetype='text/event-stream')
 
-# AGENTIC/FILE TASK ENDPOINT (NON-STREAMING)
-# In webapp.py, replace the existing /process-command route with this one
+# AGENTIC/FILE TASK ENDPOINT
+# Agent tasks and file commands run in the background: this returns a job ID right away, and the browser
+# follows progress (agent steps, partial file summaries) on /api/jobs/<job_id>/stream.
 
 @app.route('/process-command', methods=['POST'])
 @login_required
 def process_command_route():
     command = request.form.get('command', '')
     convo_id = request.form.get('conversation_id')
-    response_text, is_long = "An unexpected error occurred.", False
 
     if not convo_id:
         return jsonify({'error': 'Missing conversation ID'}), 400
@@ -118,62 +264,136 @@ def process_command_route():
     if 'file' in request.files and request.files['file'].filename != '':
         user_message_text = f"{command} [File: {request.files['file'].filename}]".strip()
     
-    # Save the user's message to the database
-    db.session.add(Message(sender='user', text=user_message_text, conversation_id=convo_id))
-    db.session.commit()
-    
-    try:
-        # Get conversation history for context
-        history = [{'role':'model' if m.sender=='assistant' else 'user', 'parts':[m.text]} for m in db.session.get(Conversation, convo_id).messages[-10:]]
-        
-        # Handle file-based commands first
-        if 'file' in request.files and request.files['file'].filename != '':
-            file = request.files['file']
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
-            
-            # This part still needs to be updated to use a unified function if we want file processing
-            # For now, we are focusing on agentic tasks. We will assume file processing is a future feature.
-            # You would call a function like `assistant_core.process_file_command(...)` here.
-            response_text = "File processing is not yet fully integrated in this version."
-            
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        else:
-            # --- THIS IS THE FIX ---
-            # Call the correct function name for agentic tasks
-            response_text = assistant_core.process_agentic_task(command)
-
-        # Save the final response from the agent
-        if isinstance(response_text, str):
-            is_long = len(response_text.split()) > 15
-            db.session.add(Message(sender='assistant', text=response_text, is_long=is_long, conversation_id=convo_id))
-            
-            # Update conversation title if it's a new chat
-            convo = db.session.get(Conversation, convo_id)
-            if convo and convo.title == 'New Chat' and command:
-                convo.title = command[:50]
-            
-            db.session.commit()
-            print(f"INFO: Successfully saved assistant response to DB: '{response_text[:50]}...'")
-        else:
-            response_text = "Received an invalid response from the core agent."
-            print("ERROR: Non-string response.")
+    # Commands without a file are agent tasks; their turn is saved when the job finishes
+    if 'file' not in request.files or request.files['file'].filename == '':
+        return start_agent_job(command, convo_id)
 
+    # Werkzeug has already spooled a large upload to a temporary file; save() copies it across in blocks.
+    # Each upload gets its own directory, so two uploads with the same name can't overwrite each other.
+    file = request.files['file']
+    upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], uuid.uuid4().hex)
+    try:
+        os.makedirs(upload_dir)
+        file_path = os.path.join(upload_dir, secure_filename(file.filename) or 'upload.txt')
+        file.save(file_path)
     except Exception as e:
         print(f"CRITICAL ERROR in /process-command: {e}")
-        db.session.rollback()
-    
-    return jsonify({'response': response_text, 'is_long': is_long})
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        return jsonify({'error': 'Could not store the uploaded file.'}), 500
+    return start_file_job(command, convo_id, file_path, user_message_text, cleanup=lambda: shutil.rmtree(upload_dir, ignore_errors=True))
+
+def start_agent_job(command, convo_id):
+    def task(job):
+        return assistant_core.process_agentic_task(command, on_event=job.add_event, cancel_event=job.cancel_event)
+    return start_job('agent-job', command, convo_id, task, pool='desktop')
+
+def start_file_job(command, convo_id, file_path, user_message_text, cleanup):
+    def task(job):
+        return assistant_core.process_file_command(file_path, command, on_event=job.add_event, cancel_event=job.cancel_event)
+    return start_job('file-job', command, convo_id, task, pool='file', user_message_text=user_message_text, cleanup=cleanup)
+
+def start_job(kind, command, convo_id, task, pool, user_message_text=None, cleanup=None):
+    """
+    Runs `task(job)` on the `pool` job workers and saves the turn when it finishes. `cleanup()` runs once
+    the job is over, even if it was cancelled before starting or never queued.
+    """
+    def run(job):
+        with tracing.trace(f"{kind} {job.id}"):
+            return task(job)
+
+    def on_finish(job, result):
+        if cleanup: cleanup()
+        response_text = result if isinstance(result, str) else "Received an invalid response from the core agent."
+        with app.app_context():
+            try:
+                is_long = save_turn(convo_id, command, user_message_text or command, response_text)
+                print(f"INFO: Successfully saved assistant response to DB: '{response_text[:50]}...'")
+                return {'is_long': is_long}
+            except Exception as e:
+                print(f"CRITICAL ERROR saving job {job.id}: {e}")
+                db.session.rollback()
+
+    try:
+        job = agent_jobs.jobs.submit(current_user.id, user_message_text or command, run, conversation_id=convo_id,
+                                     on_finish=on_finish, pool=pool)
+    except agent_jobs.JobQueueFull as e:
+        if cleanup: cleanup()
+        return jsonify({'error': f'The assistant is busy: {e}'}), 429
+    return jsonify({'job_id': job.id, 'status': job.status}), 202
+
+@app.route('/api/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    job = agent_jobs.jobs.get(job_id, owner_id=current_user.id)
+    if not job: return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    job = agent_jobs.jobs.cancel(job_id, owner_id=current_user.id)
+    if not job: return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/stream')
+@login_required
+def stream_job(job_id):
+    job = agent_jobs.jobs.get(job_id, owner_id=current_user.id)
+    if not job: return Response("Error: Job not found", status=404, mimetype='text/event-stream')
+    def generate():
+        sent = 0
+        while True:
+            events, finished = job.wait_for_events(sent, timeout=15)
+            for event in events:
+                yield f"data: {json.dumps(event)}\n\n"
+            sent += len(events)
+            if finished and sent == len(job.events): break
+            if not events: yield ": keep-alive\n\n"
+    return Response(generate(), mimetype='text/event-stream')
+
+# SCHEMA MIGRATIONS
+# The schema version lives in SQLite's `PRAGMA user_version`. MIGRATIONS[n - 1] upgrades version n - 1 to n;
+# a new database is created at the latest version. Each step must be safe to re-run.
+def _add_cache_responses_column(conn):
+    if 'cache_responses' not in {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(conversation)")}:
+        conn.exec_driver_sql("ALTER TABLE conversation ADD COLUMN cache_responses BOOLEAN NOT NULL DEFAULT 1")
+
+def _add_foreign_key_indexes(conn):
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_message_conversation_id ON message (conversation_id)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_conversation_user_id ON conversation (user_id)")
+
+MIGRATIONS = [_add_cache_responses_column, _add_foreign_key_indexes]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def migrate_database():
+    with db.engine.begin() as conn:
+        version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+        for number in range(version + 1, SCHEMA_VERSION + 1):
+            MIGRATIONS[number - 1](conn); print(f"INFO: Migrated database to schema version {number} ({MIGRATIONS[number - 1].__name__}).")
+        if version != SCHEMA_VERSION: conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+def create_tables():
+    db.create_all()
+    with db.engine.begin() as conn: conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
 # MAIN ENTRY POINT
 def create_database_if_needed():
     with app.app_context():
-        if not os.path.exists(db_path): db.create_all(); print("INFO: New database created.")
+        if not os.path.exists(db_path): create_tables(); print("INFO: New database created.")
         else:
             inspector = sql_inspect(db.engine)
-            if not inspector.has_table("user"): db.create_all(); print("INFO: DB file exists but tables not found. Creating.")
-            else: print("INFO: Database already exists.")
+            if not inspector.has_table("user"): create_tables(); print("INFO: DB file exists but tables not found. Creating.")
+            else: print("INFO: Database already exists."); migrate_database()
+
+# JARVIS_SERVER=asgi serves the app with uvicorn (see asgi_app.py); the default is Flask's threaded server.
+SERVER_MODE = os.environ.get('JARVIS_SERVER', 'flask')
+
+def run_server(host='0.0.0.0', port=5000):
+    if SERVER_MODE == 'asgi':
+        try: import asgi_app
+        except ImportError as e: print(f"ERROR: ASGI mode needs starlette, uvicorn and a2wsgi ({e}). Falling back to Flask.")
+        else: asgi_app.run(host=host, port=port); return
+    app.run(debug=False, host=host, port=port, threaded=True)
 
 if __name__ == '__main__':
     if not assistant_core.initialize():
@@ -181,6 +401,4 @@ if __name__ == '__main__':
     create_database_if_needed()
     if getattr(sys, 'frozen', False):
         Timer(1, lambda: webbrowser.open_new("http://127.0.0.1:5000")).start()
-        app.run(debug=False, host='0.0.0.0', port=5000)
-    else:
-       app.run(debug=False, host='0.0.0.0', port=5000)
\ No newline at end of file
+    run_server()
\ No newline at end of file
@@ -0,0 +1,67 @@
+# --- window_pool.py ---
+# Remembers which window each title the agent used resolved to, so repeated actions on the same window
+# reuse it after a cheap liveness/title check instead of re-scanning every desktop window by regex.
+
+import threading
+from collections import OrderedDict
+
+MAX_WINDOWS = 64
+
+
+class WindowPool:
+    def __init__(self, max_windows=MAX_WINDOWS):
+        self.max_windows = max_windows
+        self.windows = OrderedDict()  # Requested title -> (window handle, its title then, window object from the backend).
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def get(self, window_title, backend):
+        """The window matching `window_title`, from the pool if it is still open and still matches."""
+        with self.lock:
+            entry = self.windows.get(window_title)
+        if entry is not None:
+            _, pooled_title, window = entry
+            try:
+                # Still open, and either still matching or untouched since we pooled it
+                # (connecting returns the app's top window, whose title may not contain the request).
+                current_title = backend.window_alive(window) and backend.window_title(window)
+                valid = bool(current_title) and (window_title in current_title or current_title == pooled_title)
+            except Exception:
+                valid = False
+            with self.lock:
+                if valid:
+                    self.hits += 1
+                    if window_title in self.windows:
+                        self.windows.move_to_end(window_title)
+                    return window
+                self.stale += 1
+                self.windows.pop(window_title, None)
+        # Slow path: the backend's full scan of desktop windows by title.
+        window = backend.find_window(window_title)
+        with self.lock:
+            self.misses += 1
+            self.windows[window_title] = (backend.window_handle(window), backend.window_title(window), window)
+            while len(self.windows) > self.max_windows:
+                self.windows.popitem(last=False)
+        return window
+
+    def invalidate(self, handle=None):
+        """Forgets every title that resolved to `handle` (or everything when no handle is given)."""
+        with self.lock:
+            for title in [t for t, (h, _, _) in self.windows.items() if handle is None or h == handle]:
+                del self.windows[title]
+
+    def retain(self, open_handles):
+        """Forgets windows that have closed, given the handles of every open window."""
+        with self.lock:
+            for title in [t for t, (h, _, _) in self.windows.items() if h not in open_handles]:
+                del self.windows[title]
+
+    def stats(self):
+        with self.lock:
+            return {"windows": len(self.windows), "hits": self.hits, "misses": self.misses, "stale": self.stale}
+
+
+pool = WindowPool()